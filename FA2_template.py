@@ -8,6 +8,8 @@
 ## <https://gitlab.com/smondet/fa2-smartpy/> and
 ## <https://assets.tqtezos.com/docs/token-contracts/fa2/1-fa2-smartpy/>.
 ##
+import os
+
 import smartpy as sp
 ##
 ## ## Meta-Programming Configuration
@@ -24,7 +26,13 @@ class FA2_config:
                  force_layouts                = True,
                  support_operator             = True,
                  assume_consecutive_token_ids = True,
+                 token_ids_in_big_map         = False,
                  store_total_supply           = True,
+                 support_permits              = False,
+                 owner_index                  = False,
+                 remove_zero_balances         = False,
+                 bare_ledger_values           = False,
+                 shared_metadata              = False,
                  lazy_entry_points = False,
                  lazy_entry_points_multiple = False
                  ):
@@ -74,6 +82,17 @@ class FA2_config:
         # If `true` we don't need a real set of token ids, just to know how
         # many there are.
 
+        self.token_ids_in_big_map = token_ids_in_big_map
+        # For sparse token ids (`assume_consecutive_token_ids = False`), keep
+        # the set in a big-map `token-id -> unit` next to its cardinal
+        # instead of an `sp.set` in the storage: the cost of `contains`,
+        # `add` and `remove` does not grow with the collection anymore, but
+        # the `all_tokens` view is gone (indexers can list the big-map).
+        if token_ids_in_big_map and assume_consecutive_token_ids:
+            raise Exception(
+                "Cannot provide token_ids_in_big_map and"
+                " assume_consecutive_token_ids")
+
         self.store_total_supply = store_total_supply
         # Whether to store the total-supply for each token (next to
         # the token-metadata).
@@ -82,6 +101,31 @@ class FA2_config:
         # Add an entry point for the administrator to transfer tez potentially
         # in the contract's balance.
 
+        self.support_permits = support_permits
+        # Add the TZIP-17 `permit` and `set_expiry` entry points: owners sign
+        # the hash of a transfer off-chain and anyone (e.g. a relayer
+        # batching many users' transfers) can then submit it before it
+        # expires.
+
+        self.owner_index = owner_index
+        # Maintain a reverse index `owner -> set(token-id)` of the tokens
+        # held by each address (for the `tokens_of_owner` view) at the cost
+        # of an extra big-map update per transfer.
+
+        self.remove_zero_balances = remove_zero_balances
+        # Delete the ledger entry of an owner when its balance reaches zero
+        # instead of keeping a `0` for ever (e.g. the seller of every NFT
+        # sale); a missing entry is then read as a zero balance.
+
+        self.bare_ledger_values = bare_ledger_values
+        # Store the balances of the ledger as `nat` values instead of
+        # `{balance : nat}` records.
+
+        self.shared_metadata = shared_metadata
+        # Store each distinct token-metadata map once, in a big-map keyed by
+        # its hash, and only the hash in each token (collections where many
+        # tokens share their metadata: editions, fungible series, …).
+
         self.lazy_entry_points = lazy_entry_points
         self.lazy_entry_points_multiple = lazy_entry_points_multiple
         #
@@ -108,8 +152,20 @@ class FA2_config:
             name += "-no_ops"
         if not assume_consecutive_token_ids:
             name += "-no_toknat"
+        if token_ids_in_big_map:
+            name += "-tokbigmap"
         if not store_total_supply:
             name += "-no_totsup"
+        if support_permits:
+            name += "-permits"
+        if owner_index:
+            name += "-owner_index"
+        if remove_zero_balances:
+            name += "-rm_zero"
+        if bare_ledger_values:
+            name += "-bare_ledger"
+        if shared_metadata:
+            name += "-shared_md"
         if lazy_entry_points:
             name += "-lep"
         if lazy_entry_points_multiple:
@@ -133,6 +189,9 @@ class Error_message:
     def not_operator(self):          return self.make("NOT_OPERATOR")
     def not_owner(self):             return self.make("NOT_OWNER")
     def operators_unsupported(self): return self.make("OPERATORS_UNSUPPORTED")
+    def missigned(self):             return self.make("MISSIGNED")
+    def permit_undefined(self):      return self.make("PERMIT_UNDEFINED")
+    def not_admin(self):             return self.make("NOT_ADMIN")
 
 ## The current type for a batched transfer in the specification is as
 ## follows:
@@ -217,6 +276,25 @@ class Ledger_value:
     def make(balance):
         return sp.record(balance = balance)
 
+## The contract uses the ledger values of its configuration: with
+## `bare_ledger_values` the balance is stored as a plain `nat`, like in the
+## `CryptobotsFA2` contract, otherwise they are the `Ledger_value` records.
+class Ledger_entry:
+    def __init__(self, config):
+        self.config = config
+    def get_type(self):
+        if self.config.bare_ledger_values:
+            return sp.TNat
+        return Ledger_value.get_type()
+    def make(self, balance):
+        if self.config.bare_ledger_values:
+            return sp.set_type_expr(balance, sp.TNat)
+        return Ledger_value.make(balance)
+    def balance(self, value):
+        if self.config.bare_ledger_values:
+            return value
+        return value.balance
+
 ## The link between operators and the addresses they operate is kept
 ## in a *lazy set* of `(owner × operator × token-id)` values.
 ##
@@ -269,11 +347,22 @@ class Balance_of:
             requests = sp.TList(Balance_of.request_type())
         ).layout(("requests", "callback"))
 
+##
+## With `shared_metadata`, tokens hold the hash of their metadata map
+## (`sp.blake2b(sp.pack(map))`) and each distinct map is stored once in the
+## `metadata_maps` big-map, cf. `FA2_core.intern_metadata`.
 class Token_meta_data:
     def __init__(self, config):
         self.config = config
+    def get_map_type(self):
+        return sp.TMap(sp.TString, sp.TBytes)
     def get_type(self):
-        t = sp.TMap(sp.TString, sp.TBytes)
+        if self.config.shared_metadata:
+            t = sp.TBytes
+            if self.config.store_total_supply:
+                return (sp.TRecord(total_supply = sp.TNat, metadata_hash = t))
+            return t
+        t = self.get_map_type()
         if self.config.store_total_supply:
             return (sp.TRecord(total_supply = sp.TNat, metadata_map = t))
         else:
@@ -281,12 +370,24 @@ class Token_meta_data:
     def set_type_and_layout(self, expr):
         sp.set_type(expr, self.get_type())
     def get_metadata(self, expr):
+        "The metadata map, or its hash with `shared_metadata`."
         if self.config.store_total_supply:
+            if self.config.shared_metadata:
+                return expr.metadata_hash
             return expr.metadata_map
         else:
             return expr
+    def with_metadata(self, expr, metadata):
+        "The token value `expr` with another metadata map (or hash)."
+        if self.config.store_total_supply:
+            return self.make(expr.total_supply, metadata)
+        else:
+            return metadata
     def make(self, amount, metadata):
         if self.config.store_total_supply:
+            if self.config.shared_metadata:
+                return sp.record(total_supply = amount,
+                                 metadata_hash = metadata)
             return sp.record(total_supply = amount,
                              metadata_map = metadata)
         else:
@@ -295,6 +396,9 @@ class Token_meta_data:
 
 ## The set of all tokens is represented by a `nat` if we assume that token-ids
 ## are consecutive, or by an actual `(set nat)` if not.
+## With `token_ids_in_big_map` it is a big-map of the ids with their cardinal
+## and `next_id`, one more than the highest id ever added (the end of the
+## pages of `all_tokens_page`).
 ##
 ## - Knowing the set of tokens is useful for throwing accurate error messages.
 ## - Previous versions of the specification required this set for functional
@@ -306,24 +410,109 @@ class Token_id_set:
         if self.config.assume_consecutive_token_ids:
             # The "set" is its cardinal.
             return sp.nat(0)
+        elif self.config.token_ids_in_big_map:
+            return sp.record(
+                ids = sp.big_map(tkey = token_id_type, tvalue = sp.TUnit),
+                cardinal = sp.nat(0),
+                next_id = sp.nat(0))
         else:
             return sp.set(t = token_id_type)
+    def make(self, token_ids):
+        "The set of `token_ids` (a python list), e.g. to restore a snapshot."
+        if self.config.assume_consecutive_token_ids:
+            if sorted(token_ids) != list(range(len(token_ids))):
+                raise Exception("Token-IDs should be consecutive")
+            return sp.nat(len(token_ids))
+        elif self.config.token_ids_in_big_map:
+            return sp.record(
+                ids = sp.big_map(l = dict((i, sp.unit) for i in token_ids),
+                                 tkey = token_id_type, tvalue = sp.TUnit),
+                cardinal = sp.nat(len(token_ids)),
+                next_id = sp.nat(max(token_ids, default = -1) + 1))
+        else:
+            return sp.set(l = token_ids, t = token_id_type)
     def add(self, metaset, v):
         if self.config.assume_consecutive_token_ids:
             sp.verify(metaset == v, "Token-IDs should be consecutive")
             metaset.set(sp.max(metaset, v + 1))
+        elif self.config.token_ids_in_big_map:
+            sp.if ~ metaset.ids.contains(v):
+                metaset.ids[v] = sp.unit
+                metaset.cardinal += 1
+                metaset.next_id = sp.max(metaset.next_id, v + 1)
         else:
             metaset.add(v)
     def contains(self, metaset, v):
         if self.config.assume_consecutive_token_ids:
             return (v < metaset)
+        elif self.config.token_ids_in_big_map:
+            return metaset.ids.contains(v)
         else:
             return metaset.contains(v)
     def cardinal(self, metaset):
         if self.config.assume_consecutive_token_ids:
             return metaset
+        elif self.config.token_ids_in_big_map:
+            return metaset.cardinal
         else:
             return sp.len(metaset)
+    def remove(self, metaset, v):
+        if self.config.assume_consecutive_token_ids:
+            # Only the last token can go, the ids stay `0 … n - 1`:
+            sp.verify(metaset == v + 1, "Token-IDs should be consecutive")
+            metaset.set(v)
+        elif self.config.token_ids_in_big_map:
+            sp.if metaset.ids.contains(v):
+                del metaset.ids[v]
+                metaset.cardinal = sp.as_nat(metaset.cardinal - 1)
+        else:
+            metaset.remove(v)
+    def next_id(self, metaset):
+        "One more than the highest token id, known in constant gas."
+        if self.config.assume_consecutive_token_ids:
+            return metaset
+        elif self.config.token_ids_in_big_map:
+            return metaset.next_id
+        raise Exception("The highest id of a set of token-ids is unknown")
+    def page(self, metaset, token_ids, end):
+        """A page of `token_ids` (a list) that ends before the token id `end`,
+        with the `end` as the start of the next page while there is one."""
+        return sp.record(token_ids = token_ids,
+                         next = sp.eif(end < self.next_id(metaset),
+                                       sp.some(end),
+                                       sp.none))
+
+## The class `Owner_index` keeps the token-ids held by each address in a
+## big-map of sets; a token is in the set of `owner` while `owner` has a
+## non-zero balance of it (for NFTs, the sets are bounded by the number of
+## tokens one holds).
+class Owner_index:
+    def __init__(self, config):
+        self.config = config
+    def get_type(self):
+        return sp.TSet(token_id_type)
+    def empty(self):
+        return self.config.my_map(tkey = sp.TAddress, tvalue = self.get_type())
+    def make(self, ledger):
+        "The index of a python list of `(owner, token_id, balance)`."
+        index = {}
+        for owner, token_id, balance in ledger:
+            if balance > 0:
+                index.setdefault(owner, []).append(token_id)
+        return self.config.my_map(
+            l = dict((sp.address(o), sp.set(l = sorted(t), t = token_id_type))
+                     for o, t in index.items()),
+            tkey = sp.TAddress, tvalue = self.get_type())
+    def add(self, index, owner, token_id):
+        sp.if index.contains(owner):
+            index[owner].add(token_id)
+        sp.else:
+            index[owner] = sp.set([token_id], t = token_id_type)
+    def remove(self, index, owner, token_id):
+        sp.if index.contains(owner):
+            index[owner].remove(token_id)
+            sp.if sp.len(index[owner]) == 0:
+                del index[owner]
 
 ##
 ## ## Implementation of the Contract
@@ -336,6 +525,68 @@ def mutez_transfer(contract, params):
     sp.set_type(params.amount, sp.TMutez)
     sp.send(params.destination, params.amount)
 ##
+## `mutez_transfer_batch` pays several destinations from a single call (one
+## operation per payout); when the balance of the contract does not cover
+## the sum of the amounts, the protocol rejects the whole batch (the
+## operations of a call are applied atomically), so there is no check here.
+def mutez_transfer_batch(contract, params):
+    sp.verify(sp.sender == contract.data.administrator,
+              message = contract.error_message.not_admin())
+    sp.set_type(params, sp.TList(
+        sp.TRecord(destination = sp.TAddress, amount = sp.TMutez).layout(
+            ("destination", "amount"))))
+    sp.for payout in params:
+        sp.send(payout.destination, payout.amount)
+##
+## `permit` is the optional entry-point of
+## [TZIP-17](https://gitlab.com/tzip/tzip/-/blob/master/proposals/tzip-17/):
+## each element is `(public_key, (signature, param_hash))` where the signed
+## bytes are `pack(((chain_id, self_address), (counter, param_hash)))` and
+## `param_hash` is the `blake2b` of the packed `transfer` item (one
+## `from_` with its `txs`) to allow.
+## The permit is consumed by the first `transfer` of that item, whoever
+## sends it, and expires after the expiry of its owner (`default_expiry`
+## seconds unless set with `set_expiry`).
+def permit(contract, params):
+    sp.set_type(params, sp.TList(
+        sp.TPair(sp.TKey, sp.TPair(sp.TSignature, sp.TBytes))))
+    sp.for p in params:
+        key = sp.fst(p)
+        signature = sp.fst(sp.snd(p))
+        param_hash = sp.snd(sp.snd(p))
+        signed = sp.pack(sp.pair(sp.pair(sp.chain_id, sp.self_address),
+                                 sp.pair(contract.data.counter, param_hash)))
+        sp.verify(sp.check_signature(key, signature, signed),
+                  message = contract.error_message.missigned())
+        owner = sp.to_address(sp.implicit_account(sp.hash_key(key)))
+        expiry = contract.data.user_expiries.get(owner,
+                                                 contract.data.default_expiry)
+        contract.data.permits[sp.pair(owner, param_hash)] = \
+            sp.now.add_seconds(sp.to_int(expiry))
+        contract.data.counter += 1
+##
+## `set_expiry` sets the expiry (in seconds) of the future permits of the
+## sender (`permit_hash = None`) or of one of its permits, counted from
+## now; an expiry of `0` revokes that permit.
+def set_expiry(contract, params):
+    sp.set_type(params, sp.TRecord(
+        issuer = sp.TAddress, expiry = sp.TNat,
+        permit_hash = sp.TOption(sp.TBytes)).layout(
+            ("issuer", ("expiry", "permit_hash"))))
+    sp.verify(params.issuer == sp.sender,
+              message = contract.error_message.not_owner())
+    sp.if params.permit_hash.is_some():
+        key = sp.pair(params.issuer, params.permit_hash.open_some())
+        sp.verify(contract.data.permits.contains(key),
+                  message = contract.error_message.permit_undefined())
+        sp.if params.expiry == 0:
+            del contract.data.permits[key]
+        sp.else:
+            contract.data.permits[key] = \
+                sp.now.add_seconds(sp.to_int(params.expiry))
+    sp.else:
+        contract.data.user_expiries[params.issuer] = params.expiry
+##
 ## The `FA2` class builds a contract according to an `FA2_config` and an
 ## administrator address.
 ## It is inheriting from `FA2_core` which implements the strict
@@ -357,26 +608,52 @@ class FA2_core(sp.Contract):
         self.operator_set = Operator_set(self.config)
         self.operator_param = Operator_param(self.config)
         self.token_id_set = Token_id_set(self.config)
+        self.owner_index = Owner_index(self.config)
         self.ledger_key = Ledger_key(self.config)
+        self.ledger_value = Ledger_entry(self.config)
         self.token_meta_data = Token_meta_data(self.config)
         self.batch_transfer    = Batch_transfer(self.config)
         if  self.config.add_mutez_transfer:
             self.transfer_mutez = sp.entry_point(mutez_transfer)
+            self.transfer_mutez_batch = sp.entry_point(mutez_transfer_batch)
+        if self.config.support_permits:
+            self.permit = sp.entry_point(permit)
+            self.set_expiry = sp.entry_point(set_expiry)
         if config.lazy_entry_points:
             self.add_flag("lazy-entry-points", "single")
         if config.lazy_entry_points_multiple:
             self.add_flag("lazy-entry-points", "multiple")
         self.exception_optimization_level = "default-line"
-        self.init(
+        storage = dict(
             ledger =
-                self.config.my_map(tvalue = Ledger_value.get_type()),
+                self.config.my_map(tvalue = self.ledger_value.get_type()),
             tokens =
                 self.config.my_map(tvalue = self.token_meta_data.get_type()),
             operators = self.operator_set.make(),
             all_tokens = self.token_id_set.empty(),
-            metadata = metadata,
-            **extra_storage
+            metadata = metadata
         )
+        if self.config.owner_index:
+            storage.update(owner_tokens = self.owner_index.empty())
+        if self.config.shared_metadata:
+            storage.update(
+                metadata_maps = self.config.my_map(
+                    tkey = sp.TBytes,
+                    tvalue = self.token_meta_data.get_map_type()))
+        if self.config.support_permits:
+            storage.update(
+                permits = self.config.my_map(
+                    tkey = sp.TPair(sp.TAddress, sp.TBytes),
+                    tvalue = sp.TTimestamp),
+                user_expiries = self.config.my_map(tkey = sp.TAddress,
+                                                   tvalue = sp.TNat),
+                # One day, TZIP-17's `default_expiry`:
+                default_expiry = sp.nat(86400),
+                counter = sp.nat(0))
+        # `extra_storage` may also override the initial value of the fields
+        # above, cf. `storage_of_snapshot`.
+        storage.update(extra_storage)
+        self.init(**storage)
 
     @sp.entry_point
     def transfer(self, params):
@@ -384,6 +661,10 @@ class FA2_core(sp.Contract):
         sp.set_type(params, self.batch_transfer.get_type())
         sp.for transfer in params:
            current_from = transfer.from_
+           if self.config.support_permits:
+               permitted = self.consume_permit(current_from, transfer)
+           else:
+               permitted = sp.bool(False)
            sp.for tx in transfer.txs:
                 #sp.verify(tx.amount > 0, message = "TRANSFER_OF_ZERO")
                 if self.config.single_asset:
@@ -392,6 +673,7 @@ class FA2_core(sp.Contract):
                           sp.verify(
                               (self.is_administrator(sp.sender)) |
                               (current_from == sp.sender) |
+                              permitted |
                               self.operator_set.is_member(self.data.operators,
                                                           current_from,
                                                           sp.sender,
@@ -400,7 +682,8 @@ class FA2_core(sp.Contract):
                 else:
                           sp.verify(
                               (self.is_administrator(sp.sender)) |
-                              (current_from == sp.sender),
+                              (current_from == sp.sender) |
+                              permitted,
                               message = self.error_message.not_owner())
                 sp.verify(self.data.tokens.contains(tx.token_id),
                           message = self.error_message.token_undefined())
@@ -408,15 +691,13 @@ class FA2_core(sp.Contract):
                 sp.if (tx.amount > 0):
                     from_user = self.ledger_key.make(current_from, tx.token_id)
                     sp.verify(
-                        (self.data.ledger[from_user].balance >= tx.amount),
+                        (self.ledger_balance(from_user) >= tx.amount),
                         message = self.error_message.insufficient_balance())
                     to_user = self.ledger_key.make(tx.to_, tx.token_id)
-                    self.data.ledger[from_user].balance = sp.as_nat(
-                        self.data.ledger[from_user].balance - tx.amount)
-                    sp.if self.data.ledger.contains(to_user):
-                        self.data.ledger[to_user].balance += tx.amount
-                    sp.else:
-                         self.data.ledger[to_user] = Ledger_value.make(tx.amount)
+                    self.debit(from_user, tx.amount)
+                    self.credit(to_user, tx.amount)
+                    self.index_owners(current_from, from_user, tx.to_,
+                                      tx.token_id)
                 sp.else:
                     pass
 
@@ -430,7 +711,7 @@ class FA2_core(sp.Contract):
             sp.verify(self.data.tokens.contains(req.token_id),
                       message = self.error_message.token_undefined())
             sp.if self.data.ledger.contains(user):
-                balance = self.data.ledger[user].balance
+                balance = self.ledger_value.balance(self.data.ledger[user])
                 sp.result(
                     sp.record(
                         request = sp.record(
@@ -460,7 +741,7 @@ class FA2_core(sp.Contract):
         user = self.ledger_key.make(req.owner, req.token_id)
         sp.verify(self.data.tokens.contains(req.token_id),
                   message = self.error_message.token_undefined())
-        sp.result(self.data.ledger[user].balance)
+        sp.result(self.ledger_balance(user))
 
 
     @sp.entry_point
@@ -489,6 +770,69 @@ class FA2_core(sp.Contract):
         else:
             sp.failwith(self.error_message.operators_unsupported())
 
+    # The balance of the ledger key `user`; with `remove_zero_balances` a
+    # missing entry is a zero balance.
+    def ledger_balance(self, user):
+        if self.config.remove_zero_balances:
+            return self.ledger_value.balance(
+                self.data.ledger.get(user, self.ledger_value.make(sp.nat(0))))
+        else:
+            return self.ledger_value.balance(self.data.ledger[user])
+
+    # Take `amount` (already checked) out of the balance of `user`, the
+    # entry is deleted when it reaches zero with `remove_zero_balances`.
+    def debit(self, user, amount):
+        balance = self.ledger_value.balance(self.data.ledger[user])
+        if self.config.remove_zero_balances:
+            sp.if balance == amount:
+                del self.data.ledger[user]
+            sp.else:
+                self.data.ledger[user] = self.ledger_value.make(
+                    sp.as_nat(balance - amount))
+        else:
+            self.data.ledger[user] = self.ledger_value.make(
+                sp.as_nat(balance - amount))
+
+    # Add `amount` to the balance of `user`, creating the entry if needed.
+    def credit(self, user, amount):
+        sp.if self.data.ledger.contains(user):
+            self.data.ledger[user] = self.ledger_value.make(
+                self.ledger_value.balance(self.data.ledger[user]) + amount)
+        sp.else:
+            self.data.ledger[user] = self.ledger_value.make(amount)
+
+    # What a token stores for its `metadata` map: the map itself, or with
+    # `shared_metadata` its hash, the map being added to `metadata_maps` by
+    # the first token using it (maps are never removed, other tokens may
+    # share them).
+    def intern_metadata(self, metadata):
+        if self.config.shared_metadata:
+            metadata_hash = sp.local("metadata_hash", sp.blake2b(sp.pack(metadata)))
+            sp.if ~ self.data.metadata_maps.contains(metadata_hash.value):
+                self.data.metadata_maps[metadata_hash.value] = metadata
+            return metadata_hash.value
+        else:
+            return metadata
+
+    # Update the optional `owner_tokens` index after some `token_id` moved
+    # from `from_` (of ledger key `from_user`) to `to_`.
+    def index_owners(self, from_, from_user, to_, token_id):
+        if self.config.owner_index:
+            sp.if self.ledger_balance(from_user) == 0:
+                self.owner_index.remove(self.data.owner_tokens, from_, token_id)
+            self.owner_index.add(self.data.owner_tokens, to_, token_id)
+
+    # Whether `owner` has permitted this `transfer` item (cf. `permit`) and
+    # the permit has not expired; a matching permit is removed whoever
+    # sends the transfer, so that it cannot be replayed later.
+    def consume_permit(self, owner, transfer):
+        permitted = sp.local("permitted", False)
+        key = sp.pair(owner, sp.blake2b(sp.pack(transfer)))
+        sp.if self.data.permits.contains(key):
+            permitted.value = sp.now < self.data.permits[key]
+            del self.data.permits[key]
+        return permitted.value
+
     # this is not part of the standard but can be supported through inheritance.
     def is_paused(self):
         return sp.bool(False)
@@ -521,6 +865,30 @@ class FA2_change_metadata(FA2_core):
         sp.verify(self.is_administrator(sp.sender))
         self.data.metadata[k] = v
 
+    # Batched versions, for reveals that rewrite many keys or tokens at
+    # once: the administrator is checked once per call.
+    @sp.entry_point
+    def set_metadata_batch(self, params):
+        sp.set_type(params, sp.TMap(sp.TString, sp.TBytes))
+        sp.verify(self.is_administrator(sp.sender))
+        sp.for item in params.items():
+            self.data.metadata[item.key] = item.value
+
+    @sp.entry_point
+    def update_token_metadata_batch(self, params):
+        sp.set_type(params, sp.TList(
+            sp.TRecord(
+                token_id = token_id_type,
+                metadata = self.token_meta_data.get_map_type()
+            ).layout(("token_id", "metadata"))))
+        sp.verify(self.is_administrator(sp.sender))
+        sp.for update in params:
+            sp.verify(self.data.tokens.contains(update.token_id),
+                      message = self.error_message.token_undefined())
+            self.data.tokens[update.token_id] = self.token_meta_data.with_metadata(
+                self.data.tokens[update.token_id],
+                self.intern_metadata(update.metadata))
+
 class FA2_mint(FA2_core):
     @sp.entry_point
     def mint(self, params):
@@ -535,16 +903,17 @@ class FA2_mint(FA2_core):
                       "NFT-asset: cannot mint twice same token")
         user = self.ledger_key.make(params.address, params.token_id)
         self.token_id_set.add(self.data.all_tokens, params.token_id)
-        sp.if self.data.ledger.contains(user):
-            self.data.ledger[user].balance += params.amount
-        sp.else:
-            self.data.ledger[user] = Ledger_value.make(params.amount)
+        self.credit(user, params.amount)
+        if self.config.owner_index:
+            sp.if params.amount > 0:
+                self.owner_index.add(self.data.owner_tokens, params.address,
+                                     params.token_id)
         sp.if self.data.tokens.contains(params.token_id):
              pass
         sp.else:
              self.data.tokens[params.token_id] = self.token_meta_data.make(
                  amount = params.amount,
-                 metadata = params.metadata)
+                 metadata = self.intern_metadata(params.metadata))
 
 class FA2_token_metadata(FA2_core):
     @sp.offchain_view(pure = True)
@@ -556,10 +925,10 @@ class FA2_token_metadata(FA2_core):
         most flexible choice.
         """
         sp.set_type(tok, sp.TNat)
-        sp.result(
-            sp.pair(tok + 0,
-                    self.token_meta_data.get_metadata(self.data.tokens[tok]))
-        )
+        metadata = self.token_meta_data.get_metadata(self.data.tokens[tok])
+        if self.config.shared_metadata:
+            metadata = self.data.metadata_maps[metadata]
+        sp.result(sp.pair(tok + 0, metadata))
 
     def make_metadata(symbol, name, decimals):
         "Helper function to build metadata JSON bytes values."
@@ -589,9 +958,47 @@ class FA2(FA2_change_metadata, FA2_token_metadata, FA2_mint, FA2_administrator,
     def all_tokens(self):
         if self.config.assume_consecutive_token_ids:
             sp.result(sp.range(0, self.data.all_tokens))
+        elif self.config.token_ids_in_big_map:
+            # Big-maps cannot be iterated, this view is not advertised.
+            sp.failwith("FA2_ALL_TOKENS_UNSUPPORTED")
         else:
             sp.result(self.data.all_tokens.elements())
 
+    @sp.offchain_view(pure = True)
+    def all_tokens_page(self, params):
+        """Get the token ids by pages, at a cost bounded by `limit`: the
+        defined ids among `offset`, …, `offset + limit - 1` and the `offset`
+        of the next page (`None` after the last page).
+        """
+        sp.set_type(params, sp.TRecord(
+            offset = sp.TNat,
+            limit = sp.TNat
+        ).layout(("offset", "limit")))
+        if self.config.assume_consecutive_token_ids:
+            # The ids are the positions `0 … all_tokens - 1`:
+            end = sp.local("end", sp.min(params.offset + params.limit,
+                                         self.data.all_tokens))
+            sp.result(self.token_id_set.page(self.data.all_tokens,
+                                             sp.range(params.offset,
+                                                      end.value),
+                                             end.value))
+        elif self.config.token_ids_in_big_map:
+            # The ids cannot be enumerated, each one of the window is
+            # looked up; a page can be empty before the last one.
+            page = sp.local("page", sp.list(t = token_id_type))
+            sp.for token_id in sp.range(params.offset,
+                                        params.offset + params.limit):
+                sp.if self.token_id_set.contains(self.data.all_tokens,
+                                                 token_id):
+                    page.value.push(token_id)
+            sp.result(self.token_id_set.page(self.data.all_tokens,
+                                             page.value.rev(),
+                                             params.offset + params.limit))
+        else:
+            # The whole set comes with the storage, its cost is not bounded
+            # by `limit`: the view is not advertised.
+            sp.failwith("FA2_ALL_TOKENS_PAGE_UNSUPPORTED")
+
     @sp.offchain_view(pure = True)
     def total_supply(self, tok):
         if self.config.store_total_supply:
@@ -600,6 +1007,18 @@ class FA2(FA2_change_metadata, FA2_token_metadata, FA2_mint, FA2_administrator,
             sp.set_type(tok, sp.TNat)
             sp.result("total-supply not supported")
 
+    @sp.offchain_view(pure = True)
+    def tokens_of_owner(self, owner):
+        "Get the token ids held by an address."
+        sp.set_type(owner, sp.TAddress)
+        if self.config.owner_index:
+            sp.if self.data.owner_tokens.contains(owner):
+                sp.result(self.data.owner_tokens[owner].elements())
+            sp.else:
+                sp.result(sp.list(t = token_id_type))
+        else:
+            sp.result("owner index not supported")
+
     @sp.offchain_view(pure = True)
     def is_operator(self, query):
         sp.set_type(query,
@@ -614,7 +1033,7 @@ class FA2(FA2_change_metadata, FA2_token_metadata, FA2_mint, FA2_administrator,
                                         query.token_id)
         )
 
-    def __init__(self, config, metadata, admin):
+    def __init__(self, config, metadata, admin, **extra_storage):
         # Let's show off some meta-programming:
         if config.assume_consecutive_token_ids:
             self.all_tokens.doc = """
@@ -623,6 +1042,20 @@ class FA2(FA2_change_metadata, FA2_token_metadata, FA2_mint, FA2_administrator,
             This contract is built with assume_consecutive_token_ids =
             True, so we return a list constructed from the number of tokens.
             """
+        elif config.token_ids_in_big_map:
+            self.all_tokens.doc = """
+            This view is specified (but optional) in the standard.
+
+            This contract is built with token_ids_in_big_map = True, the
+            token ids cannot be listed on-chain so the view is not
+            advertised; use an indexer on the `all_tokens.ids` big-map.
+            """
+            self.all_tokens_page.doc = """
+            Get the defined token ids among `offset`, …, `offset + limit -
+            1` (token ids in a big-map cannot be enumerated) and the
+            `offset` of the next page (`None` after the last page); a page
+            can be empty before the last one.
+            """
         else:
             self.all_tokens.doc = """
             This view is specified (but optional) in the standard.
@@ -637,10 +1070,17 @@ class FA2(FA2_change_metadata, FA2_token_metadata, FA2_mint, FA2_administrator,
             , self.does_token_exist
             , self.count_tokens
             , self.all_tokens
+            , self.all_tokens_page
             , self.is_operator
         ]
+        if config.token_ids_in_big_map:
+            list_of_views.remove(self.all_tokens)
+        elif not config.assume_consecutive_token_ids:
+            list_of_views.remove(self.all_tokens_page)
         if config.store_total_supply:
             list_of_views = list_of_views + [self.total_supply]
+        if config.owner_index:
+            list_of_views = list_of_views + [self.tokens_of_owner]
         if False: # Experiment thing:
             list_of_views = list_of_views + [
                 {
@@ -667,6 +1107,7 @@ class FA2(FA2_change_metadata, FA2_token_metadata, FA2_mint, FA2_administrator,
                 + config.name + "."
             )
             , "interfaces": ["TZIP-012-2020-12-24"]
+                            + (["TZIP-017"] if config.support_permits else [])
             , "authors": [
                 "Seb Mondet <https://seb.mondet.org>"
             ]
@@ -689,7 +1130,8 @@ class FA2(FA2_change_metadata, FA2_token_metadata, FA2_mint, FA2_administrator,
         }
         self.init_metadata("metadata_base", metadata_base)
         FA2_core.__init__(self, config, metadata,
-                          paused = False, administrator = admin)
+                          paused = False, administrator = admin,
+                          **extra_storage)
 
 ## ## Tests
 ##
@@ -718,6 +1160,75 @@ class View_consumer(sp.Contract):
         sp.for resp in params:
             self.data.last_sum += resp.balance
 
+## ### Restoring Snapshots
+##
+## Replaying a long history of mints and transfers before reaching the case
+## under test is slow; `storage_of_snapshot` builds the initial storage
+## fields from a snapshot (as written by `scenario_snapshot.py`) so that a
+## contract can be originated directly in that state:
+##
+## ```python
+## c1 = FA2(config = config, metadata = ..., admin = admin.address,
+##          **storage_of_snapshot(config, snapshot))
+## ```
+##
+## Snapshot values are plain Python: addresses are strings, metadata values
+## are hexadecimal strings.
+def storage_of_snapshot(config, snapshot):
+    ledger_key = Ledger_key(config)
+    ledger_value = Ledger_entry(config)
+    token_meta_data = Token_meta_data(config)
+    operator_set = Operator_set(config)
+    ledger = {}
+    for e in snapshot["ledger"]:
+        if config.remove_zero_balances and e["balance"] == 0:
+            continue
+        ledger[ledger_key.make(sp.address(e["owner"]), e["token_id"])] = (
+            ledger_value.make(sp.nat(e["balance"])))
+    tokens = {}
+    # With `shared_metadata`: distinct maps (as sorted items) -> their hash.
+    metadata_hashes = {}
+    metadata_maps = {}
+    for t in snapshot["tokens"]:
+        metadata = sp.map(l = dict((k, sp.bytes("0x" + v))
+                                   for k, v in t["metadata"].items()),
+                          tkey = sp.TString, tvalue = sp.TBytes)
+        if config.shared_metadata:
+            items = tuple(sorted(t["metadata"].items()))
+            if items not in metadata_hashes:
+                metadata_hashes[items] = sp.blake2b(sp.pack(metadata))
+                metadata_maps[metadata_hashes[items]] = metadata
+            metadata = metadata_hashes[items]
+        tokens[sp.nat(t["token_id"])] = token_meta_data.make(
+            amount = sp.nat(t["total_supply"]), metadata = metadata)
+    operators = {}
+    for o in snapshot.get("operators", []):
+        key = operator_set.make_key(sp.address(o["owner"]),
+                                    sp.address(o["operator"]),
+                                    sp.nat(o["token_id"]))
+        operators[key] = sp.unit
+    token_ids = sorted(t["token_id"] for t in snapshot["tokens"])
+    all_tokens = Token_id_set(config).make(token_ids)
+    storage = dict(
+        ledger = config.my_map(l = ledger, tvalue = ledger_value.get_type()),
+        tokens = config.my_map(l = tokens,
+                               tkey = token_id_type,
+                               tvalue = token_meta_data.get_type()),
+        operators = config.my_map(l = operators,
+                                  tkey = operator_set.key_type(),
+                                  tvalue = sp.TUnit),
+        all_tokens = all_tokens
+    )
+    if config.shared_metadata:
+        storage["metadata_maps"] = config.my_map(
+            l = metadata_maps, tkey = sp.TBytes,
+            tvalue = token_meta_data.get_map_type())
+    if config.owner_index:
+        storage["owner_tokens"] = Owner_index(config).make(
+            [(e["owner"], e["token_id"], e["balance"])
+             for e in snapshot["ledger"]])
+    return storage
+
 ## ### Generation of Test Scenarios
 ##
 ## Tests are also parametrized by the `FA2_config` object.
@@ -740,6 +1251,9 @@ def add_test(config, is_default = True):
                  metadata = sp.metadata_of_url("https://example.com"),
                  admin = admin.address)
         scenario += c1
+        def balance(owner, token_id):
+            return c1.ledger_value.balance(
+                c1.data.ledger[c1.ledger_key.make(owner, token_id)])
         if config.non_fungible:
             # TODO
             return
@@ -763,10 +1277,8 @@ def add_test(config, is_default = True):
                                                   token_id = 0)
                                     ])
             ]).run(sender = alice)
-        scenario.verify(
-            c1.data.ledger[c1.ledger_key.make(alice.address, 0)].balance == 90)
-        scenario.verify(
-            c1.data.ledger[c1.ledger_key.make(bob.address, 0)].balance == 10)
+        scenario.verify(balance(alice.address, 0) == 90)
+        scenario.verify(balance(bob.address, 0) == 10)
         scenario += c1.transfer(
             [
                 c1.batch_transfer.item(from_ = alice.address,
@@ -779,12 +1291,208 @@ def add_test(config, is_default = True):
                                                   token_id = 0)
                                     ])
             ]).run(sender = alice)
-        scenario.verify(
-            c1.data.ledger[c1.ledger_key.make(alice.address, 0)].balance
-            == 90 - 10 - 11)
-        scenario.verify(
-            c1.data.ledger[c1.ledger_key.make(bob.address, 0)].balance
-            == 10 + 10 + 11)
+        scenario.verify(balance(alice.address, 0) == 90 - 10 - 11)
+        scenario.verify(balance(bob.address, 0) == 10 + 10 + 11)
+        if config.support_permits:
+            scenario.h2("Permits")
+            scenario.p("Alice and Bob sign transfers, a relayer submits them"
+                       + " all in one call.")
+            relayer = sp.test_account("Relayer")
+            chain_id = sp.chain_id_cst("0x9caecab9")
+            alice_tx = c1.batch_transfer.item(from_ = alice.address,
+                                              txs = [
+                                                  sp.record(to_ = bob.address,
+                                                            amount = 2,
+                                                            token_id = 0)
+                                              ])
+            bob_tx = c1.batch_transfer.item(from_ = bob.address,
+                                            txs = [
+                                                sp.record(to_ = alice.address,
+                                                          amount = 2,
+                                                          token_id = 0)
+                                            ])
+            def signature(account, counter, param_hash):
+                return sp.make_signature(
+                    account.secret_key,
+                    sp.pack(sp.pair(sp.pair(chain_id, c1.address),
+                                    sp.pair(sp.nat(counter), param_hash))),
+                    message_format = "Raw")
+            def signed_permit(account, counter, item):
+                param_hash = sp.blake2b(sp.pack(item))
+                return sp.pair(account.public_key,
+                               sp.pair(signature(account, counter, param_hash),
+                                       param_hash))
+            scenario.p("Without permits the relayer cannot transfer.")
+            scenario += c1.transfer([alice_tx, bob_tx]).run(sender = relayer,
+                                                           valid = False)
+            scenario += c1.permit([signed_permit(alice, 0, alice_tx),
+                                   signed_permit(bob, 1, bob_tx)]
+                                  ).run(sender = relayer, chain_id = chain_id)
+            scenario += c1.transfer([alice_tx, bob_tx]).run(sender = relayer)
+            scenario.verify(balance(alice.address, 0) == 90 - 10 - 11)
+            scenario.p("Permits are used only once.")
+            scenario += c1.transfer([alice_tx]).run(sender = relayer,
+                                                    valid = False)
+            scenario.p("Signatures cannot be replayed (the counter moved).")
+            scenario += c1.permit([signed_permit(alice, 0, alice_tx)]
+                                  ).run(sender = relayer, chain_id = chain_id,
+                                        valid = False)
+            scenario.p("Signatures are bound to the permitted transfer.")
+            alice_hash = sp.blake2b(sp.pack(alice_tx))
+            scenario += c1.permit([
+                sp.pair(alice.public_key,
+                        sp.pair(signature(alice, 2, alice_hash),
+                                sp.blake2b(sp.pack(bob_tx))))
+            ]).run(sender = relayer, chain_id = chain_id, valid = False)
+            permit_key = sp.pair(alice.address, alice_hash)
+            scenario.p("Permits expire (after one day by default).")
+            scenario += c1.permit([signed_permit(alice, 2, alice_tx)]
+                                  ).run(sender = relayer, chain_id = chain_id,
+                                        now = sp.timestamp(100))
+            scenario += c1.transfer([alice_tx]).run(
+                sender = relayer, now = sp.timestamp(100 + 86400),
+                valid = False)
+            scenario.p("Only their owner revokes them, with a zero expiry.")
+            scenario += c1.set_expiry(issuer = alice.address, expiry = 0,
+                                      permit_hash = sp.some(alice_hash)
+                                      ).run(sender = bob, valid = False)
+            scenario += c1.set_expiry(issuer = alice.address, expiry = 0,
+                                      permit_hash = sp.some(alice_hash)
+                                      ).run(sender = alice)
+            scenario.verify(~ c1.data.permits.contains(permit_key))
+            scenario += c1.set_expiry(issuer = alice.address, expiry = 0,
+                                      permit_hash = sp.some(alice_hash)
+                                      ).run(sender = alice, valid = False)
+            scenario.p("Owners choose the expiry of their next permits.")
+            scenario += c1.set_expiry(issuer = alice.address, expiry = 60,
+                                      permit_hash = sp.none
+                                      ).run(sender = alice)
+            scenario += c1.permit([signed_permit(alice, 3, alice_tx)]
+                                  ).run(sender = relayer, chain_id = chain_id,
+                                        now = sp.timestamp(1000))
+            scenario += c1.transfer([alice_tx]).run(
+                sender = relayer, now = sp.timestamp(1060), valid = False)
+            scenario.p("A transfer by the owner consumes a matching permit.")
+            scenario += c1.transfer([alice_tx]).run(
+                sender = alice, now = sp.timestamp(1001))
+            scenario.verify(~ c1.data.permits.contains(permit_key))
+            scenario += c1.transfer([alice_tx]).run(
+                sender = relayer, now = sp.timestamp(1002), valid = False)
+            scenario.p("Bob sends the same 2 tokens back to Alice.")
+            scenario += c1.transfer([bob_tx]).run(sender = bob)
+        if config.owner_index:
+            scenario.h2("Owner Index")
+            scenario.verify(c1.data.owner_tokens[alice.address].contains(0))
+            scenario.verify(c1.data.owner_tokens[bob.address].contains(0))
+            scenario.p("Bob gives all his token-0's back to Alice.")
+            scenario += c1.transfer(
+                [
+                    c1.batch_transfer.item(from_ = bob.address,
+                                        txs = [
+                                            sp.record(to_ = alice.address,
+                                                      amount = 31,
+                                                      token_id = 0)
+                                        ])
+                ]).run(sender = bob)
+            scenario.verify(~ c1.data.owner_tokens.contains(bob.address))
+            scenario += c1.transfer(
+                [
+                    c1.batch_transfer.item(from_ = alice.address,
+                                        txs = [
+                                            sp.record(to_ = bob.address,
+                                                      amount = 31,
+                                                      token_id = 0)
+                                        ])
+                ]).run(sender = alice)
+            scenario.verify(c1.data.owner_tokens[bob.address].contains(0))
+        if config.remove_zero_balances:
+            scenario.h2("Zero Balances")
+            scenario.p("Bob gives all his token-0's to Alice, his ledger"
+                       + " entry is gone.")
+            bob_0 = c1.ledger_key.make(bob.address, 0)
+            scenario += c1.transfer(
+                [
+                    c1.batch_transfer.item(from_ = bob.address,
+                                        txs = [
+                                            sp.record(to_ = alice.address,
+                                                      amount = 31,
+                                                      token_id = 0)
+                                        ])
+                ]).run(sender = bob)
+            scenario.verify(~ c1.data.ledger.contains(bob_0))
+            scenario.p("A missing entry is a zero balance.")
+            scenario += c1.transfer(
+                [
+                    c1.batch_transfer.item(from_ = bob.address,
+                                        txs = [
+                                            sp.record(to_ = alice.address,
+                                                      amount = 1,
+                                                      token_id = 0)
+                                        ])
+                ]).run(sender = bob, valid = False)
+            scenario += c1.transfer(
+                [
+                    c1.batch_transfer.item(from_ = alice.address,
+                                        txs = [
+                                            sp.record(to_ = bob.address,
+                                                      amount = 31,
+                                                      token_id = 0)
+                                        ])
+                ]).run(sender = alice)
+            scenario.verify(balance(bob.address, 0) == 31)
+        if config.add_mutez_transfer:
+            scenario.h2("Mutez Payouts")
+            scenario.p("The administrator pays Alice and Bob in one call.")
+            payouts = [sp.record(destination = alice.address,
+                                 amount = sp.mutez(700)),
+                       sp.record(destination = bob.address,
+                                 amount = sp.mutez(300))]
+            scenario += c1.transfer_mutez_batch(payouts).run(
+                sender = alice, amount = sp.mutez(1000), valid = False)
+            scenario.p("A balance short of the total fails all the payouts.")
+            scenario += c1.transfer_mutez_batch(payouts).run(
+                sender = admin, amount = sp.mutez(999), valid = False)
+            scenario.verify(c1.balance == sp.mutez(0))
+            scenario += c1.transfer_mutez_batch(payouts).run(
+                sender = admin, amount = sp.mutez(1000))
+            scenario.verify(c1.balance == sp.mutez(0))
+            scenario += c1.transfer_mutez_batch([]).run(sender = admin)
+        scenario.h2("Metadata Updates")
+        scenario.p("The administrator rewrites several keys and tokens at once.")
+        revealed_md = FA2.make_metadata(
+            name = "The Token Zero, Revealed",
+            decimals = 2,
+            symbol= "TK0" )
+        scenario += c1.set_metadata_batch(
+            {"name": sp.bytes_of_string("Revealed"),
+             "description": sp.bytes_of_string("A revealed drop")}
+        ).run(sender = alice, valid = False)
+        scenario += c1.set_metadata_batch(
+            {"name": sp.bytes_of_string("Revealed"),
+             "description": sp.bytes_of_string("A revealed drop")}
+        ).run(sender = admin)
+        scenario.verify(c1.data.metadata["name"]
+                        == sp.bytes_of_string("Revealed"))
+        scenario += c1.update_token_metadata_batch(
+            [sp.record(token_id = 0, metadata = revealed_md)]
+        ).run(sender = alice, valid = False)
+        scenario += c1.update_token_metadata_batch(
+            [sp.record(token_id = 0, metadata = revealed_md),
+             sp.record(token_id = 42, metadata = revealed_md)]
+        ).run(sender = admin, valid = False)
+        scenario += c1.update_token_metadata_batch(
+            [sp.record(token_id = 0, metadata = revealed_md)]
+        ).run(sender = admin)
+        if config.shared_metadata:
+            scenario.verify(
+                c1.token_meta_data.get_metadata(c1.data.tokens[0])
+                == sp.blake2b(sp.pack(revealed_md)))
+        else:
+            scenario.verify(
+                c1.token_meta_data.get_metadata(c1.data.tokens[0])
+                == revealed_md)
+        if config.store_total_supply:
+            scenario.verify(c1.data.tokens[0].total_supply == 100)
         if config.single_asset:
             return
         scenario.h2("More Token Types")
@@ -804,6 +1512,20 @@ def add_test(config, is_default = True):
                             amount = 200,
                             metadata = tok2_md,
                             token_id = 2).run(sender = admin)
+        if config.shared_metadata:
+            scenario.h3("Shared Metadata")
+            scenario.p("Token 3 has the same metadata as token 1, the map"
+                       + " is stored once.")
+            scenario += c1.mint(address = bob.address,
+                                amount = 5,
+                                metadata = tok1_md,
+                                token_id = 3).run(sender = admin)
+            tok1_hash = sp.blake2b(sp.pack(tok1_md))
+            scenario.verify(c1.data.metadata_maps[tok1_hash] == tok1_md)
+            scenario.verify(
+                c1.token_meta_data.get_metadata(c1.data.tokens[3]) == tok1_hash)
+            scenario.verify(
+                c1.token_meta_data.get_metadata(c1.data.tokens[1]) == tok1_hash)
         scenario.h3("Multi-token Transfer Bob -> Alice")
         scenario += c1.transfer(
             [
@@ -1037,6 +1759,41 @@ def add_test(config, is_default = True):
                 ]).run(sender = op2)
             scenario.table_of_contents()
 
+## A scenario that starts from a snapshot instead of replaying its history.
+def add_snapshot_test(config, snapshot, is_default = True):
+    @sp.add_test(name = config.name + "-snapshot", is_default = is_default)
+    def test():
+        scenario = sp.test_scenario()
+        scenario.h1("FA2 Contract from a Snapshot: " + config.name)
+        admin = sp.test_account("Administrator")
+        alice = sp.test_account("Alice")
+        bob   = sp.test_account("Robert")
+        c1 = FA2(config = config,
+                 metadata = sp.metadata_of_url("https://example.com"),
+                 admin = admin.address,
+                 **storage_of_snapshot(config, snapshot))
+        scenario += c1
+        def balance(owner, token_id):
+            return c1.ledger_value.balance(
+                c1.data.ledger[c1.ledger_key.make(owner, token_id)])
+        scenario.h2("The ledger is restored")
+        for e in snapshot["ledger"]:
+            scenario.verify(
+                balance(sp.address(e["owner"]), e["token_id"]) == e["balance"])
+        scenario.h2("Transfers work on the restored state")
+        first = snapshot["ledger"][0]
+        scenario += c1.transfer(
+            [
+                c1.batch_transfer.item(from_ = sp.address(first["owner"]),
+                                    txs = [
+                                        sp.record(to_ = bob.address,
+                                                  amount = first["balance"],
+                                                  token_id = first["token_id"])
+                                    ])
+            ]).run(sender = admin)
+        scenario.verify(
+            balance(bob.address, first["token_id"]) == first["balance"])
+
 ##
 ## ## Global Environment Parameters
 ##
@@ -1044,15 +1801,18 @@ def add_test(config, is_default = True):
 ## environment variables.
 ## The function `environment_config` creates an `FA2_config` given the
 ## presence and values of a few environment variables.
+## A variable that is set must be `true` or `false`: a typo would otherwise
+## silently build the default configuration.
 def global_parameter(env_var, default):
-    try:
-        if os.environ[env_var] == "true" :
-            return True
-        if os.environ[env_var] == "false" :
-            return False
-        return default
-    except:
+    value = os.environ.get(env_var)
+    if value is None:
         return default
+    if value == "true":
+        return True
+    if value == "false":
+        return False
+    raise Exception("Environment variable %s must be \"true\" or \"false\","
+                    " got %r" % (env_var, value))
 
 def environment_config():
     return FA2_config(
@@ -1065,7 +1825,15 @@ def environment_config():
         support_operator = global_parameter("support_operator", True),
         assume_consecutive_token_ids =
             global_parameter("assume_consecutive_token_ids", True),
+        token_ids_in_big_map =
+            global_parameter("token_ids_in_big_map", False),
+        owner_index = global_parameter("owner_index", False),
+        remove_zero_balances =
+            global_parameter("remove_zero_balances", False),
+        bare_ledger_values = global_parameter("bare_ledger_values", False),
+        shared_metadata = global_parameter("shared_metadata", False),
         store_total_supply = global_parameter("store_total_supply", True),
+        support_permits = global_parameter("support_permits", False),
         lazy_entry_points = global_parameter("lazy_entry_points", False),
         lazy_entry_points_multiple = global_parameter("lazy_entry_points_multiple", False),
     )
@@ -1088,14 +1856,43 @@ if "templates" not in __name__:
                  is_default = not sp.in_browser)
         add_test(FA2_config(assume_consecutive_token_ids = False)
                  , is_default = not sp.in_browser)
+        add_test(FA2_config(assume_consecutive_token_ids = False,
+                            token_ids_in_big_map = True)
+                 , is_default = not sp.in_browser)
         add_test(FA2_config(store_total_supply = False)
                  , is_default = not sp.in_browser)
         add_test(FA2_config(add_mutez_transfer = True)
                  , is_default = not sp.in_browser)
+        add_test(FA2_config(support_permits = True)
+                 , is_default = not sp.in_browser)
+        add_test(FA2_config(owner_index = True)
+                 , is_default = not sp.in_browser)
+        add_test(FA2_config(remove_zero_balances = True, owner_index = True)
+                 , is_default = not sp.in_browser)
+        add_test(FA2_config(bare_ledger_values = True)
+                 , is_default = not sp.in_browser)
+        add_test(FA2_config(shared_metadata = True)
+                 , is_default = not sp.in_browser)
         add_test(FA2_config(lazy_entry_points = True)
                  , is_default = not sp.in_browser)
         add_test(FA2_config(lazy_entry_points_multiple = True)
                  , is_default = not sp.in_browser)
+        add_snapshot_test(FA2_config(),
+                          {
+                              "ledger": [
+                                  {"owner": "tz1M9CMEtsXm3QxA7FmMU2Qh7xzsuGXVbcDr",
+                                   "token_id": 0, "balance": 100},
+                                  {"owner": "tz1bu5nmSkxYWRGU82HHHNcbTq1NciiyhntE",
+                                   "token_id": 1, "balance": 42}
+                              ],
+                              "tokens": [
+                                  {"token_id": 0, "total_supply": 100,
+                                   "metadata": {"name": "546f6b656e30"}},
+                                  {"token_id": 1, "total_supply": 42,
+                                   "metadata": {"name": "546f6b656e31"}}
+                              ]
+                          },
+                          is_default = not sp.in_browser)
 
     sp.add_compilation_target("FA2_comp", FA2(config = environment_config(),
                               metadata = sp.metadata_of_url("https://example.com"),
@@ -0,0 +1,497 @@
+##
+## ## Cost Records of Contract Calls
+##
+## The SmartPy simulator checks the scenarios of `add_test` but does not
+## meter anything, so costs are taken from the receipts of the same calls
+## run with `octez-client` (mockup mode, sandbox or a test network).
+## This tool wraps those calls and keeps one record per transaction:
+##
+## - `config`: the `FA2_config.name` of the contract (given on the command
+##   line), and `entry_point`,
+## - `gas`: consumed gas of the transaction,
+## - `storage_size` and `storage_size_diff` (against the previous call to
+##   the same contract in the records), `paid_storage_size_diff`,
+## - `operations`: the transaction and the internal operations it emitted,
+## - `internal_gas`: the gas consumed by these internal operations,
+## - `wall_time`: seconds spent in the wrapped command (split evenly when
+##   one command makes several transactions),
+## - `items`: the size of the batch of a batched entry point (`--items`,
+##   e.g. the number of tokens of `update_token_metadata_batch`).
+##
+## Records are appended to a JSON-lines file, exported to CSV or JSON, and
+## checked against per-entry-point budgets, e.g.:
+##
+## ```json
+## {
+##   "*": {"*": {"gas": 10000}},
+##   "FA2-nft-no_toknat-tokbigmap-no_totsup": {
+##     "transfer": {"gas": 4000, "paid_storage_size_diff": 67},
+##     "mint": {"operations": 1}
+##   }
+## }
+## ```
+##
+## where `"*"` matches any configuration or entry point (the most specific
+## budget of each metric wins).
+## The budgets of the repository are in `bench_budgets.json` (e.g. the
+## auction entry points of the marketplace, whose cost must not grow with the
+## number of bids).
+##
+## Usage:
+##
+##     python bench.py record -o results.jsonl --config FA2-nft -- \
+##         octez-client --mode mockup transfer 0 from alice to fa2 \
+##         --entrypoint transfer --arg '…' --burn-cap 1
+##     python bench.py record -o results.jsonl --config FA2-nft \
+##         --receipts receipts.txt
+##     python bench.py export results.jsonl --csv results.csv
+##     python bench.py check results.jsonl bench_budgets.json
+##     python bench.py baseline --model -o bench_baseline.json
+##     python bench.py baseline results.jsonl -o bench_baseline.json --update
+##     python bench.py compare results.jsonl bench_baseline.json \
+##         --tolerance gas=0.05
+##     python bench.py per-item results.jsonl -o gas_per_item.json \
+##         --gas-limit 1040000
+##
+import argparse
+import csv
+import json
+import subprocess
+import sys
+import time
+
+import storage_model
+from storage_model import parse_receipts
+
+fields = ["config", "entry_point", "destination", "gas", "storage_size",
+          "storage_size_diff", "paid_storage_size_diff", "operations",
+          "wall_time", "items", "internal_gas"]
+
+def records_of_receipts(config, text, wall_time = None, previous = None,
+                        items = None):
+    """One record per transaction of the receipts in `text`.
+
+    `previous` maps contract addresses to their last known storage size
+    (it is updated), to compute `storage_size_diff`."""
+    if previous is None:
+        previous = {}
+    transactions = parse_receipts(text)
+    records = []
+    for t in transactions:
+        destination = t.get("destination")
+        size = t.get("storage_size")
+        diff = None
+        if size is not None and destination in previous:
+            diff = size - previous[destination]
+        if size is not None:
+            previous[destination] = size
+        records.append({
+            "config": config,
+            "entry_point": t["entry_point"],
+            "destination": destination,
+            "gas": t.get("consumed_gas"),
+            "storage_size": size,
+            "storage_size_diff": diff,
+            "paid_storage_size_diff": t.get("paid_storage_size_diff", 0),
+            "operations": 1 + t["internal_operations"],
+            "wall_time": (wall_time / len(transactions)
+                          if wall_time is not None else None),
+            "items": items,
+            "internal_gas": t.get("internal_gas", 0),
+        })
+    return records
+
+def run(config, command, previous = None, items = None):
+    "Run `command` (a list), return its records and its output."
+    start = time.perf_counter()
+    result = subprocess.run(command, stdout = subprocess.PIPE,
+                            stderr = subprocess.PIPE, universal_newlines = True)
+    wall_time = time.perf_counter() - start
+    if result.returncode != 0:
+        raise Exception("Command failed (%d): %s\n%s"
+                        % (result.returncode, " ".join(command), result.stderr))
+    return (records_of_receipts(config, result.stdout, wall_time, previous,
+                                items),
+            result.stdout)
+
+def load(path):
+    try:
+        with open(path) as f:
+            return [json.loads(l) for l in f if l.strip()]
+    except FileNotFoundError:
+        return []
+
+def append(path, records):
+    with open(path, "a") as f:
+        for r in records:
+            f.write(json.dumps(r, sort_keys = True) + "\n")
+
+def last_storage_sizes(records):
+    previous = {}
+    for r in records:
+        if r.get("storage_size") is not None:
+            previous[r["destination"]] = r["storage_size"]
+    return previous
+
+def export_csv(records, path):
+    with open(path, "w", newline = "") as f:
+        writer = csv.DictWriter(f, fieldnames = fields)
+        writer.writeheader()
+        for r in records:
+            writer.writerow(dict((k, r.get(k)) for k in fields))
+
+def export_json(records, path):
+    with open(path, "w") as f:
+        json.dump(records, f, indent = 1, sort_keys = True)
+
+##
+## ### Budgets
+##
+def budget_of(budgets, config, entry_point):
+    "The limits applying to one call, the most specific ones first."
+    limits = {}
+    for c in ("*", config):
+        for e in ("*", entry_point):
+            limits.update(budgets.get(c, {}).get(e, {}))
+    return limits
+
+def check(records, budgets):
+    "The list of `(record, metric, value, limit)` exceeding their budget."
+    violations = []
+    for r in records:
+        for metric, limit in sorted(budget_of(budgets, r["config"],
+                                              r["entry_point"]).items()):
+            value = r.get(metric)
+            if value is not None and value > limit:
+                violations.append((r, metric, value, limit))
+    return violations
+
+##
+## ### Baselines
+##
+## A baseline is the mean of each metric per configuration and entry point,
+## the same nesting as the budgets:
+## `{config_name: {entry_point: {metric: mean}}}`, kept in the repository
+## (`bench_baseline.json`) and refreshed when a regression is accepted.
+## Wall time depends on the machine and is not part of it.
+baseline_metrics = ["gas", "storage_size_diff", "paid_storage_size_diff",
+                    "operations"]
+
+## Relative increases allowed by `compare`, storage and operations are
+## deterministic, gas moves a little with the protocol.
+default_tolerances = {
+    "gas": 0.02,
+    "storage_size_diff": 0.0,
+    "paid_storage_size_diff": 0.0,
+    "operations": 0.0,
+}
+
+def baseline(records):
+    grouped = {}
+    for r in records:
+        grouped.setdefault(r["config"], {}).setdefault(
+            r["entry_point"], []).append(r)
+    result = {}
+    for config, entry_points in grouped.items():
+        for entry_point, rs in entry_points.items():
+            means = {}
+            for metric in baseline_metrics:
+                values = [r[metric] for r in rs if r.get(metric) is not None]
+                if values:
+                    means[metric] = sum(values) / len(values)
+            result.setdefault(config, {})[entry_point] = means
+    return result
+
+## Storage and operations do not need a measurement: `model_baseline` gives
+## their upper bounds per call from `storage_model.per_operation` (e.g. a
+## `transfer` to a new owner, the first `mint` of an address), which
+## `compare` only flags when a measured mean goes above them. Gas comes from
+## receipts only: `baseline --update` replaces a modelled configuration
+## with its measured one.
+model_entry_points = {
+    "mint": 1,
+    "transfer": 1,
+    "update_operators": 1,
+}
+marketplace_entry_points = {
+    "offer_bot_for_sale": 1,
+    # The payment of the seller (default royalties are empty):
+    "purchase_bot_at_sale_price": 2,
+    "start_auction": 1,
+    "bid": 1,
+    "settle": 2,
+    "withdraw_refund": 2,
+}
+
+def model_configs():
+    "The configurations of `bench_baseline.json`."
+    return [storage_model.Storage_config(),
+            storage_model.Storage_config(non_fungible = True),
+            storage_model.Storage_config.cryptobot(),
+            storage_model.Storage_config(non_fungible = True,
+                                         store_total_supply = False,
+                                         assume_consecutive_token_ids = False,
+                                         marketplace = True)]
+
+def model_baseline(configs):
+    result = {}
+    for config in configs:
+        entry_points = dict(model_entry_points)
+        if config.marketplace:
+            entry_points.update(marketplace_entry_points)
+        result[config.name()] = dict(
+            (entry_point, {
+                "paid_storage_size_diff":
+                    storage_model.per_operation(config, entry_point),
+                "operations": operations})
+            for entry_point, operations in entry_points.items())
+    return result
+
+def compare(current, reference, tolerances = None):
+    """Compare two baselines, returns rows
+    `(config, entry_point, metric, reference, current, delta, status)` where
+    `status` is one of `ok`, `better`, `REGRESSION`, `new` or `missing`."""
+    limits = dict(default_tolerances)
+    limits.update(tolerances or {})
+    rows = []
+    for config in sorted(set(current) | set(reference)):
+        cur = current.get(config, {})
+        ref = reference.get(config, {})
+        for entry_point in sorted(set(cur) | set(ref)):
+            if entry_point not in ref:
+                rows.append((config, entry_point, None, None, None, None, "new"))
+                continue
+            if entry_point not in cur:
+                rows.append((config, entry_point, None, None, None, None,
+                             "missing"))
+                continue
+            for metric in baseline_metrics:
+                a = ref[entry_point].get(metric)
+                b = cur[entry_point].get(metric)
+                if a is None or b is None:
+                    continue
+                delta = b - a
+                allowed = abs(a) * limits.get(metric, 0.0)
+                if delta > allowed:
+                    status = "REGRESSION"
+                elif delta < -allowed:
+                    status = "better"
+                else:
+                    status = "ok"
+                rows.append((config, entry_point, metric, a, b, delta, status))
+    return rows
+
+def show_comparison(rows, verbose = False):
+    lines = ["%-40s %-28s %-24s %10s %10s %10s %s"
+             % ("config", "entry point", "metric", "baseline", "current",
+                "delta", "")]
+    for config, entry_point, metric, a, b, delta, status in rows:
+        if status == "ok" and not verbose:
+            continue
+        if metric is None:
+            lines.append("%-40s %-28s %-24s %10s %10s %10s %s"
+                         % (config, entry_point, "", "", "", "", status))
+        else:
+            lines.append("%-40s %-28s %-24s %10.1f %10.1f %+10.1f %s"
+                         % (config, entry_point, metric, a, b, delta, status))
+    return "\n".join(lines)
+
+##
+## ### Cost per Item of Batched Entry Points
+##
+## Calls of a batched entry point recorded with different `items` give the
+## gas of the call as `base + per_item * (items - 1)` (least squares), in
+## the table format of `replay.Gas_model`.
+## The gas of a call includes its internal operations (e.g. the payouts of
+## `mutez_transfer_batch`), all of them count against the gas limit of
+## the operation.
+def per_item(records):
+    grouped = {}
+    for r in records:
+        if r.get("items") is not None and r.get("gas") is not None:
+            gas = r["gas"] + (r.get("internal_gas") or 0)
+            grouped.setdefault((r["config"], r["entry_point"]), []).append(
+                (r["items"] - 1, gas))
+    result = {}
+    for (config, entry_point), points in sorted(grouped.items()):
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / n
+        mean_y = sum(y for _, y in points) / n
+        variance = sum((x - mean_x) ** 2 for x, _ in points)
+        if variance == 0:
+            # A single batch size, nothing to fit.
+            continue
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+        result.setdefault(config, {})[entry_point] = {
+            "base": mean_y - slope * mean_x,
+            "per_item": slope,
+        }
+    return result
+
+def items_within(cost, gas_limit):
+    "The largest batch within `gas_limit` for a `per_item` cost."
+    if cost["base"] > gas_limit:
+        return 0
+    if cost["per_item"] <= 0:
+        return None
+    return 1 + int((gas_limit - cost["base"]) // cost["per_item"])
+
+def summary(records):
+    "`(config, entry_point, calls, mean gas, max gas, max paid storage)` rows."
+    grouped = {}
+    for r in records:
+        grouped.setdefault((r["config"], r["entry_point"]), []).append(r)
+    rows = []
+    for (config, entry_point), rs in sorted(grouped.items()):
+        gas = [r["gas"] for r in rs if r.get("gas") is not None]
+        rows.append((config, entry_point, len(rs),
+                     sum(gas) / len(gas) if gas else None,
+                     max(gas) if gas else None,
+                     max(r.get("paid_storage_size_diff") or 0 for r in rs)))
+    return rows
+
+def show_summary(records):
+    lines = ["%-40s %-28s %6s %10s %10s %6s"
+             % ("config", "entry point", "calls", "gas", "max gas", "paid")]
+    for config, entry_point, calls, mean, top, paid in summary(records):
+        lines.append("%-40s %-28s %6d %10s %10s %6d"
+                     % (config, entry_point, calls,
+                        "-" if mean is None else "%.1f" % mean,
+                        "-" if top is None else "%.1f" % top, paid))
+    return "\n".join(lines)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Record, export and check the costs of contract calls.")
+    commands = parser.add_subparsers(dest = "command")
+    record = commands.add_parser("record")
+    record.add_argument("-o", "--output", required = True,
+                        help = "JSON-lines file the records are appended to.")
+    record.add_argument("--config", required = True,
+                        help = "FA2_config.name of the called contract.")
+    record.add_argument("--receipts", nargs = "*", default = [],
+                        help = "Saved octez-client outputs.")
+    record.add_argument("--items", type = int,
+                        help = "Batch size of the recorded calls.")
+    record.add_argument("run", nargs = argparse.REMAINDER,
+                        help = "Command to run and time, after `--`.")
+    export = commands.add_parser("export")
+    export.add_argument("records")
+    export.add_argument("--csv")
+    export.add_argument("--json")
+    check_parser = commands.add_parser("check")
+    check_parser.add_argument("records")
+    check_parser.add_argument("budgets")
+    baseline_parser = commands.add_parser("baseline")
+    baseline_parser.add_argument("records", nargs = "?")
+    baseline_parser.add_argument("-o", "--output", required = True)
+    baseline_parser.add_argument("--model", action = "store_true",
+                                 help = "Storage and operations of the"
+                                 " storage model, without records.")
+    baseline_parser.add_argument("--update", action = "store_true",
+                                 help = "Only replace the configurations"
+                                 " present in the records.")
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("records")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("--tolerance", nargs = "*", default = [],
+                                metavar = "METRIC=RATIO",
+                                help = "Allowed relative increase, e.g."
+                                " gas=0.05 (default: %s)."
+                                % ", ".join("%s=%s" % kv for kv in
+                                            sorted(default_tolerances.items())))
+    compare_parser.add_argument("--verbose", action = "store_true",
+                                help = "Also show unchanged metrics.")
+    per_item_parser = commands.add_parser("per-item")
+    per_item_parser.add_argument("records")
+    per_item_parser.add_argument("-o", "--output")
+    per_item_parser.add_argument("--gas-limit", type = float,
+                                 default = 1040000,
+                                 help = "Gas limit of an operation.")
+    args = parser.parse_args(argv)
+    if args.command == "record":
+        previous = last_storage_sizes(load(args.output))
+        records = []
+        for path in args.receipts:
+            with open(path) as f:
+                records += records_of_receipts(args.config, f.read(),
+                                               previous = previous,
+                                               items = args.items)
+        command = args.run[1:] if args.run[:1] == ["--"] else args.run
+        if command:
+            new, output = run(args.config, command, previous, args.items)
+            sys.stdout.write(output)
+            records += new
+        append(args.output, records)
+        print("%s: %d records added" % (args.output, len(records)))
+        return 0
+    if args.command == "export":
+        records = load(args.records)
+        if args.csv:
+            export_csv(records, args.csv)
+        if args.json:
+            export_json(records, args.json)
+        print(show_summary(records))
+        return 0
+    if args.command == "check":
+        records = load(args.records)
+        with open(args.budgets) as f:
+            budgets = json.load(f)
+        violations = check(records, budgets)
+        for r, metric, value, limit in violations:
+            print("%s %s: %s = %s > %s" % (r["config"], r["entry_point"],
+                                           metric, value, limit))
+        print("%d calls, %d over budget" % (len(records), len(violations)))
+        return 1 if violations else 0
+    if args.command == "baseline":
+        if args.model:
+            result = model_baseline(model_configs())
+        elif args.records is None:
+            parser.error("baseline needs records or --model")
+        else:
+            result = baseline(load(args.records))
+        if args.update:
+            with open(args.output) as f:
+                previous = json.load(f)
+            previous.update(result)
+            result = previous
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent = 1, sort_keys = True)
+        print("%s: %d configurations" % (args.output, len(result)))
+        return 0
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            reference = json.load(f)
+        tolerances = {}
+        for t in args.tolerance:
+            metric, ratio = t.split("=")
+            if metric not in baseline_metrics:
+                parser.error("Unknown metric: " + metric)
+            tolerances[metric] = float(ratio)
+        # Only compare the configurations that were measured:
+        current = baseline(load(args.records))
+        reference = dict((c, v) for c, v in reference.items() if c in current)
+        rows = compare(current, reference, tolerances)
+        print(show_comparison(rows, args.verbose))
+        regressions = [r for r in rows if r[6] == "REGRESSION"]
+        print("%d regressions" % len(regressions))
+        return 1 if regressions else 0
+    if args.command == "per-item":
+        result = per_item(load(args.records))
+        for config, entry_points in sorted(result.items()):
+            for entry_point, cost in sorted(entry_points.items()):
+                fit = items_within(cost, args.gas_limit)
+                print("%-40s %-28s base %10.1f per item %10.1f, %s items"
+                      " within %d gas"
+                      % (config, entry_point, cost["base"], cost["per_item"],
+                         "any number of" if fit is None else fit,
+                         args.gas_limit))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent = 1, sort_keys = True)
+        return 0
+    parser.print_help()
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+##
+## ## Building Many Configurations from One Manifest
+##
+## A deployment needs the compiled contract of several `FA2_config`s.
+## Instead of one run of `FA2_template.py` per set of environment
+## variables (`environment_config`), a manifest names the configurations:
+##
+## ```json
+## {
+##   "FA2-nft": {"admin": "tz1M9CMEtsXm3QxA7FmMU2Qh7xzsuGXVbcDr",
+##               "metadata": "ipfs://QmRLicUooP6g88NYo8e59rhLJByywha1bASMEB9ysh5AYM",
+##               "non_fungible": true, "assume_consecutive_token_ids": false,
+##               "token_ids_in_big_map": true, "store_total_supply": false},
+##   "FA2-permits": {"admin": "tz1M9CMEtsXm3QxA7FmMU2Qh7xzsuGXVbcDr",
+##                   "metadata": "https://example.com/fa2-permits.json",
+##                   "support_permits": true}
+## }
+## ```
+##
+## where each entry holds the `admin` and `metadata` (URL) of the contract,
+## both required, and `FA2_config` options (booleans).
+##
+## The manifest is checked before anything is built, by `manifest_errors`
+## (also used by `build_targets.py`): option names are read from the
+## signature of `FA2_config` in `FA2_template.py`, values must be booleans.
+## `build_targets.py` then constructs every `FA2_config` before it registers
+## any target, so the combinations that `FA2_config` itself rejects fail the
+## build; `--check` runs that step too, in a SmartPy process that compiles
+## nothing.
+## The configurations are then split in `--jobs` groups, each group is
+## compiled by one SmartPy process running `build_targets.py` (the template
+## is loaded once per process), the processes run in parallel.
+## The artifacts of each configuration end up in `OUT/<name>/` and
+## `OUT/build_report.json` records, per configuration, its group, the time
+## of its process and the sizes of its compiled contract and storage, or the
+## error of its process: all the groups run to the end and the report is
+## written before a failed build raises.
+## With `--jobs` at least the number of configurations, each process builds
+## a single one and its time is the time of that configuration.
+##
+## Usage:
+##
+##     python build_all.py build_manifest.json -o build --jobs 4 \
+##         --smartpy ~/smartpy-cli/SmartPy.sh
+##     python build_all.py build_manifest.json --check
+##
+import argparse
+import ast
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import micheline as m
+
+contract_keys = ["admin", "metadata"]
+
+def config_options(template = "FA2_template.py"):
+    """The option names of `FA2_config`, without importing SmartPy (the
+    template as a whole is not Python syntax, only the signature is read)."""
+    with open(template) as f:
+        text = f.read()
+    match = re.search(r"^class FA2_config:\s*\n\s*(def __init__\(.*?\):)",
+                      text, re.MULTILINE | re.DOTALL)
+    if match is None:
+        raise Exception("No FA2_config.__init__ in " + template)
+    function = ast.parse(match.group(1) + " pass").body[0]
+    return [a.arg for a in function.args.args[1:]]
+
+def manifest_errors(manifest, options, names = None):
+    """The errors of the configurations `names` (default: all) of
+    `manifest`, for the `FA2_config` option names `options`."""
+    if not isinstance(manifest, dict) or not manifest:
+        return ["expected a non-empty object of configurations"]
+    errors = []
+    for name in list(manifest) if names is None else names:
+        if name not in manifest:
+            errors.append("%s: not in the manifest" % name)
+            continue
+        entry = manifest[name]
+        if not re.match(r"^[A-Za-z0-9_.-]+$", name):
+            errors.append("%r: invalid configuration name" % name)
+        if not isinstance(entry, dict):
+            errors.append("%s: expected an object of options" % name)
+            continue
+        for key in contract_keys:
+            if key not in entry:
+                errors.append("%s: missing %s" % (name, key))
+        for key, value in entry.items():
+            if key in contract_keys:
+                if not isinstance(value, str):
+                    errors.append("%s: %s must be a string" % (name, key))
+            elif key not in options:
+                errors.append("%s: unknown option %s" % (name, key))
+            elif not isinstance(value, bool):
+                errors.append("%s: %s must be true or false" % (name, key))
+    return errors
+
+def load_manifest(path, options):
+    "The manifest as a `dict`, or an exception listing all its errors."
+    with open(path) as f:
+        manifest = json.load(f)
+    errors = manifest_errors(manifest, options)
+    if errors:
+        raise Exception("Invalid build manifest %s:\n  %s"
+                        % (path, "\n  ".join(errors)))
+    return manifest
+
+def groups(names, jobs):
+    "Split `names` in at most `jobs` groups of similar sizes."
+    jobs = max(1, min(jobs, len(names)))
+    return [names[i::jobs] for i in range(jobs)]
+
+def run_targets(smartpy, manifest_path, names, directory, check = False):
+    """Run `build_targets.py` in SmartPy for the configurations `names`,
+    return `(seconds, result)`; with `check` no target is registered."""
+    env = dict(os.environ,
+               FA2_MANIFEST = os.path.abspath(manifest_path),
+               FA2_BUILD_CONFIGS = ",".join(names))
+    if check:
+        env["FA2_BUILD_CHECK"] = "true"
+    start = time.perf_counter()
+    try:
+        result = subprocess.run([smartpy, "compile", "build_targets.py",
+                                 directory],
+                                env = env, stdout = subprocess.PIPE,
+                                stderr = subprocess.STDOUT,
+                                universal_newlines = True)
+    except FileNotFoundError:
+        raise Exception("SmartPy CLI not found: %s (see --smartpy)" % smartpy)
+    return time.perf_counter() - start, result
+
+def build_group(smartpy, manifest_path, names, out, index):
+    """Compile the configurations `names` in one SmartPy process, return
+    `(seconds, error)` where `error` is `None` if the process succeeded."""
+    directory = os.path.join(out, ".group_%d" % index)
+    seconds, result = run_targets(smartpy, manifest_path, names, directory)
+    if result.returncode != 0:
+        shutil.rmtree(directory, ignore_errors = True)
+        return seconds, ("Build of %s failed (%d):\n%s"
+                         % (", ".join(names), result.returncode,
+                            result.stdout))
+    for name in names:
+        target = os.path.join(out, name)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        source = os.path.join(directory, name)
+        if os.path.isdir(source):
+            shutil.move(source, target)
+    shutil.rmtree(directory, ignore_errors = True)
+    return seconds, None
+
+def artifact_sizes(directory):
+    "Sizes in bytes of the compiled contract and storage in `directory`."
+    sizes = {}
+    if not os.path.isdir(directory):
+        return sizes
+    for file in sorted(os.listdir(directory)):
+        for kind in ("contract", "storage"):
+            if file.endswith("_%s.json" % kind):
+                with open(os.path.join(directory, file)) as f:
+                    sizes[kind + "_bytes"] = m.size(json.load(f))
+    return sizes
+
+def build(manifest_path, out, smartpy = "SmartPy.sh", jobs = 1,
+          template = "FA2_template.py"):
+    manifest = load_manifest(manifest_path, config_options(template))
+    os.makedirs(out, exist_ok = True)
+    parts = groups(list(manifest), jobs)
+    report = {}
+    with ThreadPoolExecutor(max_workers = len(parts)) as pool:
+        futures = [pool.submit(build_group, smartpy, manifest_path, names,
+                               out, i)
+                   for i, names in enumerate(parts)]
+        errors = []
+        for i, (names, future) in enumerate(zip(parts, futures)):
+            try:
+                seconds, error = future.result()
+            except Exception as e:
+                seconds, error = None, str(e)
+            if error is not None:
+                errors.append(error)
+            for name in names:
+                report[name] = dict(group = i, group_configs = len(names),
+                                    seconds = seconds)
+                if error is None:
+                    report[name].update(
+                        artifact_sizes(os.path.join(out, name)))
+                else:
+                    report[name]["error"] = error
+    path = os.path.join(out, "build_report.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent = 1, sort_keys = True)
+    if errors:
+        raise Exception("%d of %d groups failed (see %s):\n%s"
+                        % (len(errors), len(parts), path, "\n".join(errors)))
+    return report
+
+def check(manifest_path, smartpy = "SmartPy.sh", template = "FA2_template.py"):
+    """Check the manifest, then construct its `FA2_config`s in SmartPy
+    (`build_targets.py` without targets); return the manifest."""
+    manifest = load_manifest(manifest_path, config_options(template))
+    with tempfile.TemporaryDirectory() as directory:
+        _, result = run_targets(smartpy, manifest_path, list(manifest),
+                                directory, check = True)
+    if result.returncode != 0:
+        raise Exception("Invalid build manifest %s:\n%s"
+                        % (manifest_path, result.stdout))
+    return manifest
+
+def show(report):
+    lines = ["%-40s %5s %9s %10s %10s" % ("configuration", "group", "time",
+                                          "contract", "storage")]
+    for name, r in sorted(report.items()):
+        lines.append("%-40s %5d %9s %10s %10s"
+                     % (name, r["group"],
+                        "-" if r["seconds"] is None
+                        else "%.2fs" % r["seconds"],
+                        r.get("contract_bytes", "-"),
+                        r.get("storage_bytes", "-")))
+    return "\n".join(lines)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Compile the FA2 configurations of a manifest.")
+    parser.add_argument("manifest")
+    parser.add_argument("-o", "--output", default = "build")
+    parser.add_argument("--jobs", type = int, default = 1,
+                        help = "Number of SmartPy processes.")
+    parser.add_argument("--smartpy", default = "SmartPy.sh",
+                        help = "Path of the SmartPy CLI.")
+    parser.add_argument("--template", default = "FA2_template.py")
+    parser.add_argument("--check", action = "store_true",
+                        help = "Only check the manifest (and its"
+                        " configurations, with SmartPy).")
+    args = parser.parse_args(argv)
+    if args.check:
+        manifest = check(args.manifest, args.smartpy, args.template)
+        print("%s: %d configurations ok" % (args.manifest, len(manifest)))
+        return 0
+    report = build(args.manifest, args.output, args.smartpy, args.jobs,
+                   args.template)
+    print(show(report))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
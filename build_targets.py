@@ -0,0 +1,64 @@
+# The compilation targets of a build manifest (see `build_all.py`): the
+# FA2 template is imported once and every selected configuration of the
+# manifest becomes a compilation target of this single script.
+#
+#     FA2_MANIFEST=build_manifest.json SmartPy.sh compile build_targets.py out/
+#
+# `FA2_BUILD_CONFIGS` (comma-separated names) restricts the build to some
+# configurations of the manifest, `build_all.py` uses it to split the
+# manifest across processes. With `FA2_BUILD_CHECK=true` the configurations
+# are only checked (`build_all.py --check`), no target is registered.
+
+import inspect
+import json
+import os
+
+import smartpy as sp
+
+# The local template, or its pinned copy (see `template_cache.py`):
+template_cache = sp.import_script_from_url("file:template_cache.py",
+                                           name = "template_cache")
+FA2 = sp.import_script_from_url(template_cache.template_url(),
+                                name = "templates/FA2_template")
+
+# The checks of the manifest, shared with the builds of many processes:
+build_all = sp.import_script_from_url("file:build_all.py", name = "build_all")
+
+def config_options():
+    parameters = inspect.signature(FA2.FA2_config.__init__).parameters
+    return [p for p in parameters if p != "self"]
+
+def load_targets(path, selected = None):
+    """`[(name, config, admin, metadata)]` for the configurations of the
+    manifest; all of them are checked before any is built."""
+    with open(path) as f:
+        manifest = json.load(f)
+    errors = build_all.manifest_errors(manifest, config_options(), selected)
+    if errors:
+        raise Exception("Invalid build manifest %s:\n  %s"
+                        % (path, "\n  ".join(errors)))
+    targets = []
+    for name in list(manifest) if selected is None else selected:
+        entry = manifest[name]
+        kwargs = {key: value for key, value in entry.items()
+                  if key not in build_all.contract_keys}
+        try:
+            config = FA2.FA2_config(**kwargs)
+        except Exception as e:
+            errors.append("%s: %s" % (name, e))
+            continue
+        targets.append((name, config, entry["admin"], entry["metadata"]))
+    if errors:
+        raise Exception("Invalid build manifest %s:\n  %s"
+                        % (path, "\n  ".join(errors)))
+    return targets
+
+selected = os.environ.get("FA2_BUILD_CONFIGS")
+targets = load_targets(os.environ.get("FA2_MANIFEST", "build_manifest.json"),
+                       selected.split(",") if selected else None)
+if os.environ.get("FA2_BUILD_CHECK") == "true":
+    targets = []
+for name, config, admin, metadata in targets:
+    sp.add_compilation_target(name, FA2.FA2(config = config,
+                                            metadata = sp.metadata_of_url(metadata),
+                                            admin = sp.address(admin)))
@@ -0,0 +1,195 @@
+# Many Cryptobot-like collections in a single FA2 contract: a new
+# collection is an entry-point call instead of an origination of the
+# whole FA2 code.
+
+import smartpy as sp
+
+# Same import as `cryptobot_marketplace.py`: the local template (or its
+# pinned copy), without its own tests.
+template_cache = sp.import_script_from_url("file:template_cache.py",
+                                           name = "template_cache")
+FA2 = sp.import_script_from_url(template_cache.template_url(),
+                                name = "templates/FA2_template")
+
+class Collection:
+    """
+    type collection = {
+        key = nat : {
+            admin = address,
+            max_supply = nat,
+            max_per_address = nat,
+            minted = nat,
+            metadata = map(string, bytes)
+        }
+    }
+
+    Token ids are namespaced by collection: the `n`-th token minted in
+    collection `c` has the id `c * Collections.span + n`.
+    """
+
+    def get_value_type():
+        return sp.TRecord(
+            admin = sp.TAddress,
+            max_supply = sp.TNat,
+            max_per_address = sp.TNat,
+            minted = sp.TNat,
+            metadata = sp.TMap(sp.TString, sp.TBytes)
+        )
+
+class Collections(FA2.FA2):
+    # Room for the token ids of one collection.
+    span = 1000000
+
+    def __init__(self, config, metadata, admin, **extra_storage):
+        if config.assume_consecutive_token_ids:
+            raise Exception(
+                "Collections need assume_consecutive_token_ids = False")
+        storage = dict(
+            collections = sp.big_map(tkey = sp.TNat, tvalue = Collection.get_value_type()),
+            # Number of tokens minted by an address in a collection
+            minters = sp.big_map(tkey = sp.TPair(sp.TNat, sp.TAddress), tvalue = sp.TNat),
+            next_collection_id = sp.nat(0))
+        storage.update(extra_storage)
+        FA2.FA2.__init__(self, config, metadata, admin, **storage)
+
+    def verify_collection_admin(self, collection_id):
+        sp.verify(self.data.collections.contains(collection_id), "COLLECTION NOT FOUND")
+        sp.verify(self.data.collections[collection_id].admin == sp.sender, "NOT COLLECTION ADMIN")
+
+    @sp.entry_point
+    def create_collection(self, params):
+
+        sp.verify( ~self.is_paused() , "CONTRACT IS PAUSED")
+
+        sp.set_type(params.max_supply, sp.TNat)
+        sp.set_type(params.max_per_address, sp.TNat)
+        sp.set_type(params.metadata, sp.TMap(sp.TString, sp.TBytes))
+
+        sp.verify((params.max_supply > 0) & (params.max_supply <= self.span), "INVALID MAX SUPPLY")
+
+        # The creator administers the collection
+        self.data.collections[self.data.next_collection_id] = sp.record(
+            admin = sp.sender,
+            max_supply = params.max_supply,
+            max_per_address = params.max_per_address,
+            minted = 0,
+            metadata = params.metadata)
+        self.data.next_collection_id += 1
+
+    @sp.entry_point
+    def set_collection_admin(self, params):
+
+        sp.set_type(params.collection_id, sp.TNat)
+        sp.set_type(params.admin, sp.TAddress)
+
+        self.verify_collection_admin(params.collection_id)
+        self.data.collections[params.collection_id].admin = params.admin
+
+    @sp.entry_point
+    def set_collection_metadata(self, params):
+
+        sp.set_type(params.collection_id, sp.TNat)
+        sp.set_type(params.metadata, sp.TMap(sp.TString, sp.TBytes))
+
+        self.verify_collection_admin(params.collection_id)
+        self.data.collections[params.collection_id].metadata = params.metadata
+
+    @sp.entry_point
+    def mint(self, params):
+
+        sp.verify( ~self.is_paused() , "CONTRACT IS PAUSED")
+
+        sp.set_type(params.collection_id, sp.TNat)
+        sp.set_type(params.address, sp.TAddress)
+
+        sp.verify(self.data.collections.contains(params.collection_id), "COLLECTION NOT FOUND")
+        collection = sp.local("collection", self.data.collections[params.collection_id])
+
+        # Like the 10,000 limit of the Cryptobots, per collection
+        sp.verify(collection.value.minted < collection.value.max_supply, "COLLECTION CREATION LIMIT EXCEEDED")
+
+        # The collection admin mints for anyone, other addresses mint for
+        # themselves within the per-address quota
+        sp.if collection.value.admin != sp.sender:
+            sp.verify(params.address == sp.sender, "NOT COLLECTION ADMIN")
+            minter = sp.pair(params.collection_id, sp.sender)
+            minted = self.data.minters.get(minter, sp.nat(0))
+            sp.verify(minted < collection.value.max_per_address, "COLLECTION MINTING LIMIT REACHED")
+            self.data.minters[minter] = minted + 1
+
+        token_id = sp.local("token_id", params.collection_id * self.span + collection.value.minted)
+        collection.value.minted += 1
+        self.data.collections[params.collection_id] = collection.value
+
+        self.token_id_set.add(self.data.all_tokens, token_id.value)
+        self.data.ledger[self.ledger_key.make(params.address, token_id.value)] = self.ledger_value.make(1)
+        if self.config.owner_index:
+            self.owner_index.add(self.data.owner_tokens, params.address, token_id.value)
+        self.data.tokens[token_id.value] = self.token_meta_data.make(
+            amount = 1,
+            metadata = self.intern_metadata(params.metadata))
+
+if "templates" not in __name__:
+    @sp.add_test(name = "Cryptobot collections")
+    def test():
+        scenario = sp.test_scenario()
+        scenario.h1("Cryptobot collections")
+
+        scenario.table_of_contents()
+
+        scenario.h2("Accounts")
+        admin = sp.test_account("Admin")
+        alice = sp.test_account("Alice")
+        bob = sp.test_account("Bob")
+        carol = sp.test_account("Carol")
+
+        scenario.show([admin, alice, bob, carol])
+
+        scenario.h2("Contract")
+        c1 = Collections(config = FA2.FA2_config(non_fungible = True, assume_consecutive_token_ids = False, token_ids_in_big_map = True, store_total_supply = False),
+                         metadata = sp.metadata_of_url("ipfs://QmRLicUooP6g88NYo8e59rhLJByywha1bASMEB9ysh5AYM"),
+                         admin = admin.address)
+        scenario += c1
+
+        scenario.h2("Creating collections")
+        scenario += c1.create_collection(max_supply = 0, max_per_address = 5, metadata = {}).run(sender = alice, valid = False)
+        scenario += c1.create_collection(max_supply = 3, max_per_address = 1,
+                                         metadata = {'': sp.bytes_of_string('ipfs://alice')}).run(sender = alice)
+        scenario += c1.create_collection(max_supply = 10000, max_per_address = 5,
+                                         metadata = {'': sp.bytes_of_string('ipfs://bob')}).run(sender = bob)
+        scenario.verify(c1.data.collections[1].admin == bob.address)
+
+        scenario.h2("Minting")
+        md = {'': sp.bytes_of_string('')}
+        scenario += c1.mint(collection_id = 0, address = carol.address, metadata = md).run(sender = carol)
+        scenario.p("Carol's quota in collection 0 is used up, not in collection 1.")
+        scenario += c1.mint(collection_id = 0, address = carol.address, metadata = md).run(sender = carol, valid = False)
+        scenario += c1.mint(collection_id = 1, address = carol.address, metadata = md).run(sender = carol)
+        scenario.verify(c1.data.ledger[c1.ledger_key.make(carol.address, 0)].balance == 1)
+        scenario.verify(c1.data.ledger[c1.ledger_key.make(carol.address, Collections.span)].balance == 1)
+        scenario.p("Only the collection admin mints for others, and as much as it wants.")
+        scenario += c1.mint(collection_id = 0, address = bob.address, metadata = md).run(sender = carol, valid = False)
+        scenario += c1.mint(collection_id = 0, address = bob.address, metadata = md).run(sender = alice)
+        scenario += c1.mint(collection_id = 0, address = bob.address, metadata = md).run(sender = alice)
+        scenario.p("Collection 0 is full.")
+        scenario += c1.mint(collection_id = 0, address = alice.address, metadata = md).run(sender = alice, valid = False)
+        scenario += c1.mint(collection_id = 2, address = alice.address, metadata = md).run(sender = alice, valid = False)
+        scenario.verify(c1.token_id_set.cardinal(c1.data.all_tokens) == 4)
+
+        scenario.h2("Tokens of all collections are FA2 tokens")
+        scenario += c1.transfer(
+                [
+                    c1.batch_transfer.item(from_ = carol.address,
+                                        txs = [
+                                            sp.record(to_ = alice.address,
+                                                      amount = 1,
+                                                      token_id = Collections.span)])
+                ]).run(sender = carol)
+        scenario.verify(c1.data.ledger[c1.ledger_key.make(alice.address, Collections.span)].balance == 1)
+
+        scenario.h2("Administration of a collection")
+        scenario += c1.set_collection_metadata(collection_id = 1, metadata = {}).run(sender = alice, valid = False)
+        scenario += c1.set_collection_admin(collection_id = 1, admin = carol.address).run(sender = bob)
+        scenario += c1.set_collection_metadata(collection_id = 1, metadata = {}).run(sender = carol)
+        scenario += c1.set_pause(True).run(sender = admin)
+        scenario += c1.create_collection(max_supply = 1, max_per_address = 1, metadata = {}).run(sender = bob, valid = False)
@@ -0,0 +1,301 @@
+##
+## ## Differential Fuzzer for the Marketplace Implementations
+##
+## Generates random call sequences, runs each of them against the Python
+## models of `marketplace_model.py` and reports the first call after which
+## the implementations disagree: one accepts and another one rejects, the
+## emitted operations differ, or the (normalized) storage differs.
+## Error messages are expected to differ between implementations and are
+## only shown, not compared.
+##
+## The diverging sequence is shrunk (calls are removed as long as the
+## divergence remains) to make the report readable.
+##
+## Calls are drawn among the entry points that all the variants have: the
+## auctions, collection bids and royalties of `cryptobot_marketplace` are
+## only compared between its variants.
+## Known divergences (see below) are not reported unless `--strict`.
+## The timestamp of the `i`-th call is `i`.
+## `balance_of` while paused fails in some implementations only, which is
+## found at once: `--without balance_of` leaves it out.
+##
+## Usage:
+##
+##     python marketplace_fuzz.py --runs 1000 --steps 40 --seed 1 \
+##         --without balance_of
+##     python marketplace_fuzz.py --variants cryptobot_marketplace \
+##         cryptobot_marketplace_rm_zero --steps 200
+##     python marketplace_fuzz.py --variants new_cryptobot_marketplace \
+##         deployed_cryptobot_marketplace --without balance_of
+##
+import argparse
+import copy
+import random
+import sys
+
+import marketplace_model
+
+admin = "admin"
+users = ["alice", "bob", "carol"]
+prices = [0, 100, 1000]
+shares = [{}, {"carol": 500}, {"carol": 500, "admin": 250}]
+
+# Entry points with their weights (some are drawn twice):
+weighted_entry_points = [
+    "mint", "mint", "offer_bot_for_sale", "withdraw_bot_from_sale",
+    "purchase_bot_at_sale_price", "purchase_bot_at_sale_price",
+    "transfer", "transfer", "balance_of", "set_pause",
+    "start_auction", "start_auction", "bid", "bid", "settle",
+    "withdraw_refund", "place_collection_bid", "accept_collection_bid",
+    "cancel_collection_bid", "set_default_royalties", "set_token_royalties",
+    "claim_royalties"]
+
+def random_call(rng, entry_points, minters, auctioned = (), placed = 0):
+    """A random `(entry_point, params, sender, amount)` among
+    `entry_points`; `minters` are the senders of the mints so far, ids are
+    drawn around their number so that both existing and missing tokens
+    are hit, and the calls that need the owner of a bot are mostly sent by
+    its minter. Bids and settlements are mostly on the `auctioned` ids (of
+    the previous `start_auction` calls), collection bid ids are drawn
+    around the number of bids `placed`."""
+    minted = len(minters)
+    sender = rng.choice(users + [admin])
+    token_id = rng.randrange(minted + 2)
+    entry_point = rng.choice(entry_points)
+    if (entry_point in ("offer_bot_for_sale", "withdraw_bot_from_sale",
+                        "start_auction")
+        and token_id < minted and rng.random() < 0.7):
+        sender = minters[token_id]
+    amount = 0
+    bid_id = rng.randrange(placed + 1)
+    if entry_point == "mint":
+        params = (b"bot-%d" % minted,)
+    elif entry_point == "offer_bot_for_sale":
+        params = (token_id, rng.choice(prices))
+    elif entry_point == "withdraw_bot_from_sale":
+        params = (token_id,)
+    elif entry_point == "purchase_bot_at_sale_price":
+        params = (token_id,)
+        amount = rng.choice(prices)
+    elif entry_point == "transfer":
+        from_ = sender if rng.random() < 0.8 else rng.choice(users)
+        txs = [(rng.choice(users), rng.randrange(minted + 2),
+                rng.choice([0, 1, 1, 2]))
+               for _ in range(rng.randrange(1, 3))]
+        params = ([(from_, txs)],)
+    elif entry_point == "balance_of":
+        params = ([(rng.choice(users), token_id)],)
+    elif entry_point == "start_auction":
+        params = (token_id, rng.choice(prices), rng.randrange(20))
+    elif entry_point in ("bid", "settle"):
+        if auctioned and rng.random() < 0.8:
+            token_id = rng.choice(auctioned[-3:])
+        params = (token_id,)
+        if entry_point == "bid":
+            amount = rng.choice(prices + [2000])
+    elif entry_point == "place_collection_bid":
+        price, quantity = rng.choice(prices), rng.randrange(3)
+        params = (price, quantity)
+        amount = price * quantity if rng.random() < 0.9 else 1
+    elif entry_point == "accept_collection_bid":
+        token_ids = [rng.randrange(minted + 2) for _ in range(rng.randrange(3))]
+        if token_ids and token_ids[0] < minted and rng.random() < 0.7:
+            sender = minters[token_ids[0]]
+        params = (bid_id, token_ids)
+    elif entry_point == "cancel_collection_bid":
+        params = (bid_id,)
+    elif entry_point == "set_default_royalties":
+        params = (rng.choice(shares + [{"carol": 10001}]),)
+    elif entry_point == "set_token_royalties":
+        params = (token_id, rng.choice(shares + [None]))
+    elif entry_point in ("withdraw_refund", "claim_royalties"):
+        params = ()
+    else:
+        # Unpausing is more useful than pausing for long sequences:
+        params = (rng.random() < 0.3,)
+    return (entry_point, params, sender, amount)
+
+def random_sequence(rng, steps, entry_points = weighted_entry_points):
+    calls = []
+    minters = []
+    auctioned = []
+    placed = 0
+    for _ in range(steps):
+        call = random_call(rng, entry_points, minters, auctioned, placed)
+        if call[0] == "mint":
+            minters.append(call[2])
+        if call[0] == "start_auction":
+            auctioned.append(call[1][0])
+        if call[0] == "place_collection_bid":
+            placed += 1
+        calls.append(call)
+    return calls
+
+##
+## ### Known Divergences
+##
+## Differences between the implementations that are known and kept: a
+## diverging call is run again without the parts of its parameters that
+## they describe (cumulatively) and, if that removes the divergence, the
+## sequence goes on from the states after the reduced call.
+def without_zero_amounts(call, tokens):
+    entry_point, params, sender, amount = call
+    if entry_point != "transfer":
+        return call
+    batch = [(from_, [tx for tx in txs if tx[2] > 0])
+             for from_, txs in params[0]]
+    return (entry_point, (batch,), sender, amount)
+
+def without_undefined_tokens(call, tokens):
+    entry_point, params, sender, amount = call
+    if entry_point == "transfer":
+        params = ([(from_, [tx for tx in txs if tx[1] in tokens])
+                   for from_, txs in params[0]],)
+    elif entry_point == "balance_of":
+        params = ([r for r in params[0] if r[1] in tokens],)
+    return (entry_point, params, sender, amount)
+
+known_divergences = [
+    ("zero-amount transactions (the FA2 template checks their sender and"
+     " token and only withdraws the bot from sale for its owner; the other"
+     " implementations accept them from anyone and withdraw the bot)",
+     without_zero_amounts),
+    ("undefined token ids in transfer and balance_of (FA2_TOKEN_UNDEFINED"
+     " in the FA2 template only)", without_undefined_tokens),
+]
+
+def storage_of(outcome):
+    return outcome[3]
+
+def same_storage(a, b):
+    "Fields that only some of the models have are not compared."
+    return all(a[field] == b[field] for field in a if field in b)
+
+def diverges(outcomes):
+    reference = outcomes[0]
+    for outcome in outcomes[1:]:
+        if ((outcome[1] is None) != (reference[1] is None)
+            or outcome[2] != reference[2]
+            or not same_storage(reference[3], outcome[3])):
+            return True
+    return False
+
+def apply_call(instances, call, now):
+    entry_point, params, sender, amount = call
+    outcomes = []
+    for instance in instances:
+        error, operations = instance.call(entry_point, params, sender, amount,
+                                          now = now)
+        outcomes.append((instance.name, error, operations, instance.storage()))
+    return outcomes
+
+def run(variants, calls, without = (), strict = False, known = None):
+    """Run `calls` against fresh instances of each variant, returns `None` or
+    `(index, outcomes)` for the first diverging call; the known divergences
+    met on the way are counted in `known` (reason -> calls)."""
+    instances = [variant(admin) for variant in variants]
+    for index, call in enumerate(calls):
+        if call[0] in without:
+            continue
+        states = [instance.copy_state() for instance in instances]
+        outcomes = apply_call(instances, call, index)
+        if not diverges(outcomes):
+            continue
+        if strict:
+            return index, outcomes
+        reduced = call
+        for reason, reduce in known_divergences:
+            for instance, state in zip(instances, states):
+                instance.restore_state(copy.deepcopy(state))
+            reduced = reduce(reduced, instances[0].tokens)
+            if not diverges(apply_call(instances, reduced, index)):
+                if known is not None:
+                    known[reason] = known.get(reason, 0) + 1
+                break
+        else:
+            return index, outcomes
+    return None
+
+def shrink(variants, calls, without = (), strict = False):
+    "Greedily drop calls while the sequence still diverges."
+    calls = list(calls)
+    progress = True
+    while progress:
+        progress = False
+        for i in reversed(range(len(calls))):
+            candidate = calls[:i] + calls[i + 1:]
+            if run(variants, candidate, without, strict) is not None:
+                calls = candidate
+                progress = True
+    return calls
+
+def storage_diff(reference, other):
+    lines = []
+    for field in reference:
+        if field not in other:
+            continue
+        a, b = reference[field], other[field]
+        if a == b:
+            continue
+        if isinstance(a, dict):
+            for key in sorted(set(a) | set(b), key = repr):
+                if a.get(key) != b.get(key):
+                    lines.append("    %s[%r]: %r != %r"
+                                 % (field, key, a.get(key), b.get(key)))
+        else:
+            lines.append("    %s: %r != %r" % (field, a, b))
+    return lines
+
+def report(calls, index, outcomes):
+    lines = ["Sequence:"]
+    for i, (entry_point, params, sender, amount) in enumerate(calls[:index + 1]):
+        lines.append("  %s%2d. %s%r sender=%s amount=%d"
+                     % ("=>" if i == index else "  ", i, entry_point, params,
+                        sender, amount))
+    reference = outcomes[0]
+    lines.append("Outcomes of the last call:")
+    for name, error, operations, storage in outcomes:
+        lines.append("  %-32s %s %s" % (name, "FAIL " + error if error else "ok",
+                                        operations if operations else ""))
+        if not same_storage(reference[3], storage):
+            lines.append("    storage differs from %s:" % reference[0])
+            lines.extend(storage_diff(reference[3], storage))
+    return "\n".join(lines)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Differential fuzzing of the marketplace implementations.")
+    parser.add_argument("--variants", nargs = "+",
+                        default = [m.name for m in marketplace_model.models])
+    parser.add_argument("--without", nargs = "*", default = [],
+                        help = "Entry points to leave out of the sequences.")
+    parser.add_argument("--runs", type = int, default = 1000)
+    parser.add_argument("--steps", type = int, default = 40)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--no-shrink", action = "store_true")
+    parser.add_argument("--strict", action = "store_true",
+                        help = "Report the known divergences too.")
+    args = parser.parse_args(argv)
+    variants = [marketplace_model.model_of_name(n) for n in args.variants]
+    entry_points = [e for e in weighted_entry_points
+                    if all(e in variant.entry_points for variant in variants)]
+    rng = random.Random(args.seed)
+    known = {}
+    for run_index in range(args.runs):
+        calls = random_sequence(rng, args.steps, entry_points)
+        divergence = run(variants, calls, args.without, args.strict, known)
+        if divergence is None:
+            continue
+        if not args.no_shrink:
+            calls = shrink(variants, calls, args.without, args.strict)
+            divergence = run(variants, calls, args.without, args.strict)
+        print("Divergence found in run %d (seed %d):" % (run_index, args.seed))
+        print(report(calls, *divergence))
+        return 1
+    print("No divergence in %d runs of %d calls." % (args.runs, args.steps))
+    for reason, count in sorted(known.items()):
+        print("Known divergence in %d calls: %s" % (count, reason))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
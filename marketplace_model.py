@@ -0,0 +1,543 @@
+##
+## ## Python Models of the Marketplace Contracts
+##
+## Fast, pure-Python models of the four marketplace implementations of this
+## repository, written to follow the SmartPy code line by line (including
+## the order of the checks):
+##
+## - `Cryptobot_model`: `cryptobot_marketplace.Cryptobot` (built on the FA2
+##   template with `non_fungible = True`,
+##   `assume_consecutive_token_ids = False`, `store_total_supply = False`),
+##   and `Cryptobot_rm_zero_model`, the same with `remove_zero_balances`,
+## - `CryptobotsFA2_model`: `new_cryptobot_marketplace.CryptobotsFA2`,
+## - `Deployed_model`: `deployed_cryptobot_marketplace.CryptobotsFA2`,
+## - `V2_model`: `nft_cryptobots_marketplace_v2.CryptobotsFA2`.
+##
+## All models expose the same normalized entry points so that the same call
+## sequence can be run against each of them (cf. `marketplace_fuzz.py`):
+##
+## - `mint(metadata)`, the token-id is the next one (`len(all_tokens)`),
+## - `offer_bot_for_sale(token_id, sale_price)`,
+## - `withdraw_bot_from_sale(token_id)`,
+## - `purchase_bot_at_sale_price(token_id)`,
+## - `transfer(batch)` with `batch = [(from_, [(to_, token_id, amount)])]`,
+## - `balance_of(requests)` with `requests = [(owner, token_id)]`,
+## - `set_pause(paused)`.
+##
+## `Cryptobot_model` also has the entry points that only `Cryptobot` has
+## (auctions, collection bids and royalties, cf. its section); `burn`,
+## `burn_batch`, operators and permits are not modelled.
+##
+## A failing call raises `Failure` and leaves the state untouched, like a
+## `FAILWITH` does.
+##
+import copy
+
+class Failure(Exception):
+    pass
+
+def verify(condition, message):
+    if not condition:
+        raise Failure(message)
+
+def get_item(m, key):
+    "Reading a missing key of a (big-)map fails in SmartPy."
+    if key not in m:
+        raise Failure("Get-item:missing key")
+    return m[key]
+
+def as_nat(n):
+    verify(n >= 0, "Asnat")
+    return n
+
+class Marketplace_model:
+    name = None
+    entry_points = ["mint", "offer_bot_for_sale", "withdraw_bot_from_sale",
+                    "purchase_bot_at_sale_price", "transfer", "balance_of",
+                    "set_pause"]
+    state_fields = ["paused", "ledger", "tokens", "offer", "initial_hodlers",
+                    "all_tokens"]
+
+    def __init__(self, admin):
+        self.admin = admin
+        self.paused = False
+        self.ledger = {}
+        self.tokens = {}
+        self.offer = {}
+        self.initial_hodlers = {}
+        self.all_tokens = set()
+
+    def copy_state(self):
+        return copy.deepcopy([getattr(self, field)
+                              for field in self.state_fields])
+
+    def restore_state(self, state):
+        for field, value in zip(self.state_fields, state):
+            setattr(self, field, value)
+
+    def call(self, entry_point, params, sender, amount = 0, rollback = True,
+             now = 0):
+        """Run one call; returns `(error, operations)` where `error` is
+        `None` on success and operations are `(destination, mutez)` pairs.
+        `now` is the timestamp of the block, in seconds.
+
+        The rollback copies the whole state, replays of long histories of
+        applied operations can do without it (a failing call may then leave
+        a partial update, like a batch transfer failing half-way)."""
+        if entry_point not in self.entry_points:
+            raise Exception("Unknown entry point: " + entry_point)
+        state = self.copy_state() if rollback else None
+        self.sender = sender
+        self.amount = amount
+        self.now = now
+        self.operations = []
+        try:
+            getattr(self, entry_point)(*params)
+            return None, self.operations
+        except Failure as e:
+            if rollback:
+                self.restore_state(state)
+            return str(e), []
+
+    def storage(self):
+        """Normalized view of the storage, comparable across models; a
+        missing ledger entry and an entry at zero are the same balance."""
+        return {
+            "paused": self.paused,
+            "ledger": dict((user, balance)
+                           for user, balance in self.ledger.items()
+                           if balance > 0),
+            "tokens": dict(self.tokens),
+            "offer": dict(self.offer),
+            "initial_hodlers": dict(self.initial_hodlers),
+            "all_tokens": sorted(self.all_tokens),
+        }
+
+    def is_paused(self):
+        return self.paused
+
+    def send(self, destination, amount):
+        self.operations.append((destination, amount))
+
+##
+## ### `new_cryptobot_marketplace.CryptobotsFA2` and its Variants
+##
+class CryptobotsFA2_model(Marketplace_model):
+    name = "new_cryptobot_marketplace"
+    buyer_balance_is_incremented = True
+    balance_of_checks_pause = False
+    admin_error = "WrongCondition"
+
+    def set_pause(self, paused):
+        verify(self.sender == self.admin, self.admin_error)
+        self.paused = paused
+
+    def mint(self, metadata):
+        verify(not self.is_paused(), "CRYPTOBOT_CONTRACT_IS_PAUSED")
+        verify(len(self.all_tokens) < 10000, "CRYPTOBOT_CREATION_LIMIT_EXCEEDED")
+        token_id = len(self.all_tokens)
+        if self.sender in self.initial_hodlers:
+            if self.initial_hodlers[self.sender] < 5:
+                self.initial_hodlers[self.sender] += 1
+            else:
+                raise Failure("CRYPTOBOT_CREATION_LIMIT_EXCEEDED")
+        else:
+            self.initial_hodlers[self.sender] = 1
+        verify(token_id not in self.all_tokens,
+               "CRYPTOBOT_CANT_MINT_SAME_TOKEN_TWICE")
+        self.ledger[(self.sender, token_id)] = 1
+        self.tokens[token_id] = metadata
+        self.all_tokens.add(token_id)
+
+    def transfer(self, batch):
+        verify(not self.is_paused(), "CRYPTOBOT_CONTRACT_IS_PAUSED")
+        for from_, txs in batch:
+            for to_, token_id, amount in txs:
+                if amount > 0:
+                    from_user = (from_, token_id)
+                    to_user = (to_, token_id)
+                    verify(self.ledger.get(from_user, 0) >= amount,
+                           "FA2_INSUFFICIENT_BALANCE")
+                    verify(self.sender == from_, "FA2_NOT_OWNER")
+                    self.ledger[from_user] = as_nat(
+                        get_item(self.ledger, from_user) - amount)
+                    self.ledger[to_user] = self.ledger.get(to_user, 0) + amount
+                if token_id in self.offer:
+                    del self.offer[token_id]
+
+    def offer_bot_for_sale(self, token_id, sale_price):
+        verify(not self.is_paused(), "CRYPTOBOT_CONTRACT_IS_PAUSED")
+        from_user = (self.sender, token_id)
+        verify(token_id in self.all_tokens, "FA2_TOKEN_UNDEFINED")
+        verify(sale_price > 0, "CRYPTOBOT_MIN_VALUE_SHOULD_BE_MORE_THAN_ZERO")
+        verify(from_user in self.ledger, "FA2_NOT_OWNER")
+        verify(self.ledger.get(from_user, 0) >= 1, "FA2_INSUFFICIENT_BALANCE")
+        self.offer[token_id] = (self.sender, sale_price)
+
+    def withdraw_bot_from_sale(self, token_id):
+        verify(not self.is_paused(), "CRYPTOBOT_CONTRACT_IS_PAUSED")
+        from_user = (self.sender, token_id)
+        verify(token_id in self.all_tokens, "FA2_TOKEN_UNDEFINED")
+        verify(token_id in self.offer, "FA2_TOKEN_UNDEFINED")
+        verify(from_user in self.ledger, "FA2_NOT_OWNER")
+        verify(self.ledger.get(from_user, 0) >= 1, "FA2_INSUFFICIENT_BALANCE")
+        del self.offer[token_id]
+
+    def purchase_bot_at_sale_price(self, token_id):
+        verify(not self.is_paused(), "CRYPTOBOT_CONTRACT_IS_PAUSED")
+        verify(token_id in self.all_tokens, "FA2_TOKEN_UNDEFINED")
+        verify(token_id in self.offer, "FA2_TOKEN_UNDEFINED")
+        seller_address, sale_value = self.offer[token_id]
+        verify(sale_value == self.amount, "CRYPTOBOT_INCORRECT_PURCHASE_VALUE")
+        seller = (seller_address, token_id)
+        buyer = (self.sender, token_id)
+        self.ledger[seller] = as_nat(get_item(self.ledger, seller) - 1)
+        if self.buyer_balance_is_incremented and buyer in self.ledger:
+            self.ledger[buyer] += 1
+        else:
+            self.ledger[buyer] = 1
+        self.send(seller_address, self.amount)
+        del self.offer[token_id]
+
+    def balance_of(self, requests):
+        if self.balance_of_checks_pause:
+            verify(not self.is_paused(), "CRYPTOBOT_CONTRACT_IS_PAUSED")
+        responses = [((owner, token_id), self.ledger.get((owner, token_id), 0))
+                     for owner, token_id in requests]
+        self.send("callback", 0)
+        return responses
+
+class Deployed_model(CryptobotsFA2_model):
+    name = "deployed_cryptobot_marketplace"
+    buyer_balance_is_incremented = False
+    balance_of_checks_pause = True
+    admin_error = "FA2_NOT_OWNER"
+
+class V2_model(CryptobotsFA2_model):
+    name = "nft_cryptobots_marketplace_v2"
+    buyer_balance_is_incremented = False
+    balance_of_checks_pause = False
+    admin_error = "FA2_NOT_OWNER"
+
+##
+## ### `cryptobot_marketplace.Cryptobot`
+##
+## The FA2-template based marketplace takes explicit `address`, `amount` and
+## `token_id` in `mint`; the normalized `mint` mints the next token-id to the
+## sender, like the other implementations.
+##
+## Its own entry points take the fields of their SmartPy parameters, in
+## order:
+##
+## - `start_auction(token_id, reserve_price, duration)`, `bid(token_id)`,
+##   `settle(token_id)`, `withdraw_refund()`,
+## - `place_collection_bid(price, quantity)`,
+##   `accept_collection_bid(bid_id, token_ids)`,
+##   `cancel_collection_bid(bid_id)`,
+## - `set_default_royalties(shares)`, `set_token_royalties(token_id,
+##   shares)` (`None` to go back to the default) and `claim_royalties()`.
+##
+## An auction is `[seller, reserve_price, end_time, highest_bid,
+## highest_bidder]`, a collection bid `[buyer, price, quantity]`.
+class Cryptobot_model(Marketplace_model):
+    name = "cryptobot_marketplace"
+    entry_points = Marketplace_model.entry_points + [
+        "start_auction", "bid", "withdraw_refund", "settle",
+        "place_collection_bid", "accept_collection_bid",
+        "cancel_collection_bid", "set_default_royalties",
+        "set_token_royalties", "claim_royalties"]
+    # Fields of `state_fields` that the other models do not have:
+    extra_state_fields = ["default_royalties", "token_royalties",
+                          "royalty_balances", "auction", "pending_refunds",
+                          "collection_bids", "next_collection_bid_id"]
+    state_fields = Marketplace_model.state_fields + extra_state_fields
+    remove_zero_balances = False
+    accrue_royalties = False
+    total_shares = 10000
+
+    def __init__(self, admin):
+        Marketplace_model.__init__(self, admin)
+        self.default_royalties = {}
+        self.token_royalties = {}
+        self.royalty_balances = {}
+        self.auction = {}
+        self.pending_refunds = {}
+        self.collection_bids = {}
+        self.next_collection_bid_id = 0
+
+    def storage(self):
+        storage = Marketplace_model.storage(self)
+        for field in self.extra_state_fields:
+            storage[field] = copy.deepcopy(getattr(self, field))
+        return storage
+
+    # `FA2_core.ledger_balance`, `debit` and `credit`:
+    def ledger_balance(self, user):
+        if self.remove_zero_balances:
+            return self.ledger.get(user, 0)
+        return get_item(self.ledger, user)
+
+    def debit(self, user, amount):
+        balance = get_item(self.ledger, user)
+        if self.remove_zero_balances and balance == amount:
+            del self.ledger[user]
+        else:
+            self.ledger[user] = as_nat(balance - amount)
+
+    def credit(self, user, amount):
+        self.ledger[user] = self.ledger.get(user, 0) + amount
+
+    def set_pause(self, paused):
+        verify(self.sender == self.admin, "WrongCondition")
+        self.paused = paused
+
+    def mint(self, metadata):
+        self.mint_token(self.sender, 1, len(self.all_tokens), metadata)
+
+    def mint_token(self, address, amount, token_id, metadata):
+        verify(not self.is_paused(), "CONTRACT IS PAUSED")
+        verify(len(self.all_tokens) < 10000,
+               "3D Cryptobot NFT creation limit exceeded")
+        if self.sender in self.initial_hodlers:
+            if self.initial_hodlers[self.sender] < 5:
+                self.initial_hodlers[self.sender] += 1
+            else:
+                raise Failure("Cryptobot minting limit reached")
+        else:
+            self.initial_hodlers[self.sender] = 1
+        verify(amount == 1, "NFT-asset: amount <> 1")
+        verify(token_id not in self.all_tokens,
+               "NFT-asset: cannot mint twice same token")
+        user = (address, token_id)
+        self.all_tokens.add(token_id)
+        self.credit(user, amount)
+        if token_id not in self.tokens:
+            self.tokens[token_id] = metadata
+
+    def check_owner(self, owner, token_id):
+        user = (owner, token_id)
+        verify(user in self.ledger, "NOT OWNER OF NFT TOKEN ID")
+        verify(self.ledger[user] == 1, "FA2_INSUFFICIENT_BALANCE")
+
+    def offer_bot_for_sale(self, token_id, sale_price):
+        verify(not self.is_paused(), "CONTRACT IS PAUSED")
+        verify(token_id in self.all_tokens, "TOKEN ID NOT FOUND")
+        verify(sale_price > 0, "MIN VALUE SHOULD BE MORE THAN ZERO")
+        verify(token_id not in self.auction, "NFT TOKEN ID IS ON AUCTION")
+        self.check_owner(self.sender, token_id)
+        self.offer[token_id] = (self.sender, sale_price)
+
+    def withdraw_bot_from_sale(self, token_id):
+        verify(not self.is_paused(), "CONTRACT IS PAUSED")
+        verify(token_id in self.all_tokens, "TOKEN ID NOT FOUND")
+        verify(token_id in self.offer,
+               "NFT TOKEN ID NOT AVAILABLE FOR WITHDRWAL")
+        self.check_owner(self.sender, token_id)
+        del self.offer[token_id]
+
+    def purchase_bot_at_sale_price(self, token_id):
+        verify(not self.is_paused(), "CONTRACT IS PAUSED")
+        verify(token_id in self.all_tokens, "TOKEN ID NOT FOUND")
+        verify(token_id in self.offer, "NFT TOKEN ID NOT AVAILABLE FOR SALE")
+        seller, sale_value = self.offer[token_id]
+        self.check_owner(seller, token_id)
+        verify(sale_value == self.amount, "INCORRECT AMOUNT")
+        self.transfer_bot(seller, self.sender, token_id)
+        self.pay_sale(token_id, seller, self.amount)
+        del self.offer[token_id]
+
+    def transfer_bot(self, seller, buyer, token_id):
+        self.debit((seller, token_id), 1)
+        self.credit((buyer, token_id), 1)
+
+    def transfer(self, batch):
+        verify(not self.is_paused(), "CONTRACT IS PAUSED")
+        for from_, txs in batch:
+            for to_, token_id, amount in txs:
+                verify(from_ == self.sender, "FA2_NOT_OWNER")
+                verify(token_id in self.tokens, "FA2_TOKEN_UNDEFINED")
+                if amount > 0:
+                    verify(token_id not in self.auction,
+                           "NFT TOKEN ID IS ON AUCTION")
+                    from_user = (from_, token_id)
+                    verify(self.ledger_balance(from_user) >= amount,
+                           "FA2_INSUFFICIENT_BALANCE")
+                    self.debit(from_user, amount)
+                    self.credit((to_, token_id), amount)
+                # With `remove_zero_balances` a seller who just sent the bot
+                # is not in the ledger anymore:
+                was_owner = (from_, token_id) in self.ledger
+                if self.remove_zero_balances:
+                    was_owner = amount > 0 or was_owner
+                if was_owner and token_id in self.offer:
+                    del self.offer[token_id]
+
+    def balance_of(self, requests):
+        # `FA2_core.balance_of`:
+        verify(not self.is_paused(), "WrongCondition")
+        responses = []
+        for owner, token_id in requests:
+            verify(token_id in self.tokens, "FA2_TOKEN_UNDEFINED")
+            responses.append(((owner, token_id),
+                              self.ledger.get((owner, token_id), 0)))
+        self.send("callback", 0)
+        return responses
+
+    ##
+    ## #### Royalties
+    ##
+    ## Maps are iterated in the order of their keys, as in Michelson.
+    def pay_sale(self, token_id, seller, sale_value):
+        royalties = self.pay_royalties(token_id, sale_value)
+        if sale_value > royalties:
+            self.send(seller, sale_value - royalties)
+
+    def pay_royalties(self, token_id, sale_value, payouts = None):
+        shares = self.token_royalties.get(token_id, self.default_royalties)
+        total = 0
+        for recipient, share in sorted(shares.items()):
+            royalty = sale_value * share // self.total_shares
+            if royalty > 0:
+                total += royalty
+                if payouts is not None:
+                    payouts[recipient] = payouts.get(recipient, 0) + royalty
+                else:
+                    self.pay_royalty(recipient, royalty)
+        return total
+
+    def pay_royalty(self, recipient, amount):
+        if self.accrue_royalties:
+            self.royalty_balances[recipient] = (
+                self.royalty_balances.get(recipient, 0) + amount)
+        else:
+            self.send(recipient, amount)
+
+    def check_royalties(self, shares):
+        verify(sum(shares.values()) <= self.total_shares,
+               "ROYALTIES EXCEED SALE VALUE")
+
+    def set_default_royalties(self, shares):
+        verify(self.sender == self.admin, "INVALID_ADMIN_ADDRESS")
+        self.check_royalties(shares)
+        self.default_royalties = dict(shares)
+
+    def set_token_royalties(self, token_id, shares):
+        verify(self.sender == self.admin, "INVALID_ADMIN_ADDRESS")
+        if shares is not None:
+            self.check_royalties(shares)
+            self.token_royalties[token_id] = dict(shares)
+        elif token_id in self.token_royalties:
+            del self.token_royalties[token_id]
+
+    def claim_royalties(self):
+        verify(self.sender in self.royalty_balances, "NO ROYALTIES TO CLAIM")
+        self.send(self.sender, self.royalty_balances[self.sender])
+        del self.royalty_balances[self.sender]
+
+    ##
+    ## #### Auctions
+    ##
+    def start_auction(self, token_id, reserve_price, duration):
+        verify(not self.is_paused(), "CONTRACT IS PAUSED")
+        verify(token_id in self.all_tokens, "TOKEN ID NOT FOUND")
+        verify(token_id not in self.auction, "NFT TOKEN ID IS ON AUCTION")
+        verify(token_id not in self.offer, "NFT TOKEN ID IS ON SALE")
+        verify(reserve_price > 0, "MIN VALUE SHOULD BE MORE THAN ZERO")
+        verify(duration > 0, "INVALID AUCTION DURATION")
+        self.check_owner(self.sender, token_id)
+        self.auction[token_id] = [self.sender, reserve_price,
+                                  self.now + duration, 0, None]
+
+    def bid(self, token_id):
+        verify(not self.is_paused(), "CONTRACT IS PAUSED")
+        verify(token_id in self.auction, "NFT TOKEN ID NOT ON AUCTION")
+        auction = self.auction[token_id]
+        seller, reserve_price, end_time, highest_bid, highest_bidder = auction
+        verify(self.now < end_time, "AUCTION IS OVER")
+        verify(self.sender != seller, "SELLER CANNOT BID")
+        verify(self.amount >= reserve_price, "BID BELOW RESERVE PRICE")
+        verify(self.amount > highest_bid, "BID TOO LOW")
+        if highest_bidder is not None:
+            self.pending_refunds[highest_bidder] = (
+                self.pending_refunds.get(highest_bidder, 0) + highest_bid)
+        auction[3] = self.amount
+        auction[4] = self.sender
+
+    def withdraw_refund(self):
+        verify(self.sender in self.pending_refunds, "NO REFUND TO WITHDRAW")
+        self.send(self.sender, self.pending_refunds[self.sender])
+        del self.pending_refunds[self.sender]
+
+    def settle(self, token_id):
+        verify(not self.is_paused(), "CONTRACT IS PAUSED")
+        verify(token_id in self.auction, "NFT TOKEN ID NOT ON AUCTION")
+        seller, _, end_time, highest_bid, highest_bidder = self.auction[token_id]
+        verify(self.now >= end_time, "AUCTION IS NOT OVER")
+        if highest_bidder is not None:
+            self.transfer_bot(seller, highest_bidder, token_id)
+            self.pay_sale(token_id, seller, highest_bid)
+        del self.auction[token_id]
+
+    ##
+    ## #### Collection Bids
+    ##
+    def place_collection_bid(self, price, quantity):
+        verify(not self.is_paused(), "CONTRACT IS PAUSED")
+        verify(price > 0, "MIN VALUE SHOULD BE MORE THAN ZERO")
+        verify(quantity > 0, "INVALID QUANTITY")
+        verify(self.amount == price * quantity, "INCORRECT AMOUNT")
+        self.collection_bids[self.next_collection_bid_id] = [
+            self.sender, price, quantity]
+        self.next_collection_bid_id += 1
+
+    def accept_collection_bid(self, bid_id, token_ids):
+        verify(not self.is_paused(), "CONTRACT IS PAUSED")
+        verify(bid_id in self.collection_bids, "COLLECTION BID NOT FOUND")
+        buyer, price, quantity = self.collection_bids[bid_id]
+        verify(self.sender != buyer, "CANNOT ACCEPT OWN COLLECTION BID")
+        filled = len(token_ids)
+        verify(filled > 0, "NO TOKEN TO SELL")
+        verify(filled <= quantity, "COLLECTION BID QUANTITY EXCEEDED")
+        royalties = 0
+        payouts = {}
+        sold = set()
+        for token_id in token_ids:
+            verify(token_id not in sold, "DUPLICATE TOKEN ID")
+            sold.add(token_id)
+            verify(token_id not in self.auction, "NFT TOKEN ID IS ON AUCTION")
+            self.check_owner(self.sender, token_id)
+            self.transfer_bot(self.sender, buyer, token_id)
+            if token_id in self.offer:
+                del self.offer[token_id]
+            royalties += self.pay_royalties(token_id, price, payouts)
+        for recipient, amount in sorted(payouts.items()):
+            self.pay_royalty(recipient, amount)
+        proceeds = price * filled
+        if proceeds > royalties:
+            self.send(self.sender, proceeds - royalties)
+        if quantity == filled:
+            del self.collection_bids[bid_id]
+        else:
+            self.collection_bids[bid_id] = [buyer, price,
+                                            as_nat(quantity - filled)]
+
+    def cancel_collection_bid(self, bid_id):
+        verify(bid_id in self.collection_bids, "COLLECTION BID NOT FOUND")
+        buyer, price, quantity = self.collection_bids[bid_id]
+        verify(buyer == self.sender, "NOT OWNER OF COLLECTION BID")
+        self.send(buyer, price * quantity)
+        del self.collection_bids[bid_id]
+
+class Cryptobot_rm_zero_model(Cryptobot_model):
+    "`Cryptobot` with `remove_zero_balances = True`."
+    name = "cryptobot_marketplace_rm_zero"
+    remove_zero_balances = True
+
+models = [Cryptobot_model, Cryptobot_rm_zero_model, CryptobotsFA2_model,
+          Deployed_model, V2_model]
+
+def model_of_name(name):
+    for model in models:
+        if model.name == name:
+            return model
+    raise Exception("Unknown marketplace model: " + name)
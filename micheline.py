@@ -0,0 +1,484 @@
+##
+## ## Micheline Values in Pure Python
+##
+## The off-chain tools of this repository (storage projections, snapshots,
+## parameter forging, …) need to reason about Michelson values without
+## running SmartPy.
+## This module works on the JSON representation of Micheline that SmartPy
+## writes next to its compiled outputs (`*.json`) and that the Tezos node
+## uses in its RPCs:
+##
+## - `{"int": "42"}`, `{"string": "abc"}`, `{"bytes": "00ff"}`,
+## - `{"prim": "Pair", "args": [...], "annots": [...]}`,
+## - Python lists for sequences.
+##
+## The binary encoding is the one used by the protocol for storage
+## accounting and by `PACK` (without the `0x05` prefix).
+##
+import hashlib
+import re
+
+## Primitive codes of the data constructors, this is all we need to encode
+## storage values and entry-point parameters.
+data_prims = {
+    "False" : 0x03,
+    "Elt"   : 0x04,
+    "Left"  : 0x05,
+    "None"  : 0x06,
+    "Pair"  : 0x07,
+    "Right" : 0x08,
+    "Some"  : 0x09,
+    "True"  : 0x0a,
+    "Unit"  : 0x0b,
+}
+
+def zarith(n):
+    "Binary encoding of a (signed) Micheline integer."
+    n = int(n)
+    negative = n < 0
+    n = abs(n)
+    first = n & 0x3f
+    n >>= 6
+    out = bytearray([first | (0x40 if negative else 0) | (0x80 if n else 0)])
+    while n:
+        byte = n & 0x7f
+        n >>= 7
+        out.append(byte | (0x80 if n else 0))
+    return bytes(out)
+
+def zarith_size(n):
+    n = abs(int(n)) >> 6
+    size = 1
+    while n:
+        n >>= 7
+        size += 1
+    return size
+
+def _length(b):
+    return len(b).to_bytes(4, "big")
+
+def encode(node):
+    "Binary encoding of a Micheline data expression."
+    if isinstance(node, list):
+        body = b"".join(encode(x) for x in node)
+        return b"\x02" + _length(body) + body
+    if "int" in node:
+        return b"\x00" + zarith(node["int"])
+    if "string" in node:
+        s = node["string"].encode("utf-8")
+        return b"\x01" + _length(s) + s
+    if "bytes" in node:
+        b = bytes.fromhex(node["bytes"])
+        return b"\x0a" + _length(b) + b
+    prim = bytes([data_prims[node["prim"]]])
+    args = node.get("args", [])
+    annots = node.get("annots", [])
+    if len(args) <= 2 and not annots:
+        return (bytes([0x03 + 2 * len(args)]) + prim
+                + b"".join(encode(a) for a in args))
+    if len(args) <= 2:
+        a = " ".join(annots).encode("utf-8")
+        return (bytes([0x04 + 2 * len(args)]) + prim
+                + b"".join(encode(x) for x in args) + _length(a) + a)
+    body = b"".join(encode(x) for x in args)
+    a = " ".join(annots).encode("utf-8")
+    return b"\x09" + prim + _length(body) + body + _length(a) + a
+
+def size(node):
+    """Size in bytes of the binary encoding of `node`.
+
+    Unlike `encode` this also works for code (instructions and types) since
+    the primitive codes themselves do not matter, they are always one byte.
+    """
+    if isinstance(node, list):
+        return 5 + sum(size(x) for x in node)
+    if "int" in node:
+        return 1 + zarith_size(node["int"])
+    if "string" in node:
+        return 5 + len(node["string"].encode("utf-8"))
+    if "bytes" in node:
+        return 5 + len(node["bytes"]) // 2
+    args = node.get("args", [])
+    annots = node.get("annots", [])
+    total = 2 + sum(size(a) for a in args)
+    if annots:
+        total += 4 + len(" ".join(annots).encode("utf-8"))
+    if len(args) > 2:
+        total += 4
+        if not annots:
+            total += 4
+    return total
+
+def pack(node):
+    "What Michelson's `PACK` returns for an already-optimized `node`."
+    return b"\x05" + encode(node)
+
+def decode(b):
+    "Inverse of `encode`."
+    node, offset = _decode(b, 0)
+    if offset != len(b):
+        raise ValueError("Trailing bytes after Micheline expression")
+    return node
+
+def unpack(b):
+    """Inverse of `pack`; the `0x05` prefix cannot be dropped by `decode`
+    since it is also the tag of a primitive with one argument (`Some`,
+    `Left`, …)."""
+    if b[:1] != b"\x05":
+        raise ValueError("Packed values start with 0x05")
+    return decode(b[1:])
+
+prim_names = dict((v, k) for k, v in data_prims.items())
+
+def _decode(b, i):
+    tag = b[i]
+    i += 1
+    if tag == 0x00:
+        shift = 6
+        first = b[i]
+        n = first & 0x3f
+        i += 1
+        byte = first
+        while byte & 0x80:
+            byte = b[i]
+            i += 1
+            n |= (byte & 0x7f) << shift
+            shift += 7
+        return {"int": str(-n if first & 0x40 else n)}, i
+    if tag in (0x01, 0x02, 0x0a):
+        length = int.from_bytes(b[i:i + 4], "big")
+        i += 4
+        body = b[i:i + length]
+        end = i + length
+        if tag == 0x01:
+            return {"string": body.decode("utf-8")}, end
+        if tag == 0x0a:
+            return {"bytes": body.hex()}, end
+        items = []
+        while i < end:
+            item, i = _decode(b, i)
+            items.append(item)
+        return items, end
+    prim = prim_names[b[i]]
+    i += 1
+    node = {"prim": prim}
+    if tag == 0x09:
+        length = int.from_bytes(b[i:i + 4], "big")
+        i += 4
+        end = i + length
+        args = []
+        while i < end:
+            arg, i = _decode(b, i)
+            args.append(arg)
+        has_annots = True
+    else:
+        args = []
+        for _ in range((tag - 0x03) // 2):
+            arg, i = _decode(b, i)
+            args.append(arg)
+        has_annots = (tag - 0x03) % 2 == 1
+    if args:
+        node["args"] = args
+    if has_annots:
+        length = int.from_bytes(b[i:i + 4], "big")
+        i += 4
+        annots = b[i:i + length].decode("utf-8")
+        i += length
+        if annots:
+            node["annots"] = annots.split(" ")
+    return node, i
+
+##
+## ### Addresses
+##
+## Storage values are kept in *optimized* form, i.e. addresses are 22 bytes.
+base58_alphabet = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+address_prefixes = {
+    "tz1": (bytes([6, 161, 159]), b"\x00\x00"),
+    "tz2": (bytes([6, 161, 161]), b"\x00\x01"),
+    "tz3": (bytes([6, 161, 164]), b"\x00\x02"),
+    "KT1": (bytes([2, 90, 121]), b"\x01"),
+}
+
+def b58check_decode(s):
+    n = 0
+    for c in s:
+        n = n * 58 + base58_alphabet.index(c)
+    raw = n.to_bytes((n.bit_length() + 7) // 8, "big")
+    raw = b"\x00" * (len(s) - len(s.lstrip("1"))) + raw
+    payload, checksum = raw[:-4], raw[-4:]
+    digest = hashlib.sha256(hashlib.sha256(payload).digest()).digest()
+    if digest[:4] != checksum:
+        raise ValueError("Invalid base58check checksum: " + s)
+    return payload
+
+def b58check_encode(payload):
+    raw = payload + hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+    n = int.from_bytes(raw, "big")
+    out = ""
+    while n:
+        n, r = divmod(n, 58)
+        out = base58_alphabet[r] + out
+    return "1" * (len(raw) - len(raw.lstrip(b"\x00"))) + out
+
+def address_bytes(address):
+    "The 22-byte optimized form of a `tz1/tz2/tz3/KT1` address."
+    prefix, tag = address_prefixes[address[:3]]
+    payload = b58check_decode(address)
+    if payload[:len(prefix)] != prefix or len(payload) != len(prefix) + 20:
+        raise ValueError("Invalid address: " + address)
+    digest = payload[len(prefix):]
+    if address.startswith("KT1"):
+        return tag + digest + b"\x00"
+    return tag + digest
+
+def address_of_bytes(b):
+    "Inverse of `address_bytes`."
+    if isinstance(b, str):
+        b = bytes.fromhex(b)
+    if b[0] == 0x01:
+        prefix = address_prefixes["KT1"][0]
+        return b58check_encode(prefix + b[1:21])
+    for name, (prefix, tag) in address_prefixes.items():
+        if tag == b[:2]:
+            return b58check_encode(prefix + b[2:22])
+    raise ValueError("Unknown address tag: " + b.hex())
+
+def address_of_node(node):
+    "Read an address given in readable (string) or optimized (bytes) form."
+    if "string" in node:
+        return node["string"]
+    return address_of_bytes(node["bytes"])
+
+##
+## ### Builders
+##
+## Small helpers to build values the way SmartPy lays them out.
+def nat(n):
+    return {"int": str(int(n))}
+
+int_ = nat
+mutez = nat
+
+def string(s):
+    return {"string": s}
+
+def bytes_(b):
+    if isinstance(b, str):
+        b = b.encode("utf-8")
+    return {"bytes": bytes(b).hex()}
+
+def address(a):
+    return {"bytes": address_bytes(a).hex()}
+
+def bool_(b):
+    return {"prim": "True" if b else "False"}
+
+unit = {"prim": "Unit"}
+
+def pair(*items):
+    "Right-comb of nested `Pair`s."
+    if len(items) == 1:
+        return items[0]
+    return {"prim": "Pair", "args": [items[0], pair(*items[1:])]}
+
+def default_layout(fields):
+    """SmartPy's default record layout: fields sorted by name and split as
+    a balanced binary tree."""
+    fields = sorted(fields)
+    def tree(l):
+        if len(l) == 1:
+            return l[0]
+        n = len(l) // 2
+        return (tree(l[:n]), tree(l[n:]))
+    return tree(fields)
+
+def record(values, layout = None):
+    """Lay out a `dict` of field values as nested pairs.
+
+    `layout` uses the same tuple notation as SmartPy's `.layout(...)`, the
+    default is `default_layout(values)`.
+    """
+    if layout is None:
+        layout = default_layout(list(values))
+    if isinstance(layout, str):
+        return values[layout]
+    left, right = layout
+    return {"prim": "Pair", "args": [record(values, left), record(values, right)]}
+
+def unrecord(node, layout):
+    "Inverse of `record`: map field names to the sub-expressions of `node`."
+    if isinstance(layout, str):
+        return {layout: node}
+    result = unrecord(node["args"][0], layout[0])
+    result.update(unrecord(node["args"][1], layout[1]))
+    return result
+
+def elt(k, v):
+    return {"prim": "Elt", "args": [k, v]}
+
+def map_(items):
+    "`items` are `(key, value)` Micheline pairs, already sorted by key."
+    return [elt(k, v) for k, v in items]
+
+def some(v):
+    return {"prim": "Some", "args": [v]}
+
+none = {"prim": "None"}
+
+def left(v):
+    return {"prim": "Left", "args": [v]}
+
+def right(v):
+    return {"prim": "Right", "args": [v]}
+
+##
+## ### Michelson Text
+##
+## A parser for the concrete syntax of `.tz` files (what SmartPy writes as
+## `*_contract.tz` and `*_storage.tz`), it returns the same JSON
+## representation as above.
+
+_token = re.compile(r"""
+      (?P<space>\s+|\#[^\n]*|/\*.*?\*/)
+    | (?P<string>"(?:\\.|[^"\\])*")
+    | (?P<bytes>0x[0-9a-fA-F]*)
+    | (?P<int>-?[0-9]+)
+    | (?P<annot>[@:%][A-Za-z0-9_.%@]*)
+    | (?P<prim>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<punct>[{}();])
+""", re.VERBOSE | re.DOTALL)
+
+def _tokens(text):
+    tokens = []
+    i = 0
+    while i < len(text):
+        match = _token.match(text, i)
+        if match is None:
+            raise ValueError("Cannot parse Michelson at offset %d: %r"
+                             % (i, text[i:i + 20]))
+        i = match.end()
+        if match.lastgroup != "space":
+            tokens.append((match.lastgroup, match.group()))
+    return tokens
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = _tokens(text)
+        self.i = 0
+
+    def peek(self):
+        if self.i < len(self.tokens):
+            return self.tokens[self.i]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.i += 1
+        return token
+
+    def expect(self, value):
+        kind, v = self.next()
+        if v != value:
+            raise ValueError("Expected %r, got %r" % (value, v))
+
+    def atom(self):
+        kind, v = self.next()
+        if kind == "int":
+            return {"int": v}
+        if kind == "string":
+            return {"string": bytes(v[1:-1], "utf-8").decode("unicode_escape")}
+        if kind == "bytes":
+            return {"bytes": v[2:]}
+        if v == "{":
+            return self.sequence("}")
+        if v == "(":
+            node = self.application()
+            self.expect(")")
+            return node
+        if kind == "prim":
+            return {"prim": v}
+        raise ValueError("Unexpected token %r" % v)
+
+    def application(self):
+        kind, v = self.peek()
+        if kind != "prim":
+            return self.atom()
+        self.next()
+        node = {"prim": v}
+        annots = []
+        while self.peek()[0] == "annot":
+            annots.append(self.next()[1])
+        args = []
+        while self.peek()[1] not in (";", "}", ")", None):
+            args.append(self.atom())
+        if args:
+            node["args"] = args
+        if annots:
+            node["annots"] = annots
+        return node
+
+    def sequence(self, closing):
+        items = []
+        while self.peek()[1] != closing:
+            if self.peek()[1] == ";":
+                self.next()
+                continue
+            items.append(self.application())
+        self.next()
+        return items
+
+def parse(text):
+    """Parse a Michelson expression, or a whole script (`parameter …;
+    storage …; code …`) which is returned as a sequence."""
+    parser = _Parser(text)
+    if parser.peek()[1] == "{" or parser.peek()[0] != "prim":
+        node = parser.atom()
+        if parser.peek()[1] is not None:
+            raise ValueError("Trailing tokens after Michelson expression")
+        return node
+    items = parser.sequence(None)
+    if len(items) == 1 and items[0].get("prim") not in ("parameter", "storage",
+                                                        "code", "view"):
+        return items[0]
+    return items
+
+##
+## ### Tests
+##
+## Run with `python -m pytest -q micheline.py`.
+def test_pack_known_values():
+    # Packed values as returned by a node (`PACK`, e.g. with
+    # `octez-client hash data … of type …`):
+    assert pack(nat(64)).hex() == "05008001"
+    assert pack(int_(-1)).hex() == "050041"
+    assert pack(string("abc")).hex() == "050100000003616263"
+    assert pack(pair(nat(1), nat(2))).hex() == "05070700010002"
+    assert pack(unit).hex() == "05030b"
+    # The bootstrap1 account of the sandboxes:
+    assert (pack(address("tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx")).hex()
+            == "050a00000016000002298c03ed7d454a101eb7022bc95f7e5f41ac78")
+
+def test_encode_decode_round_trip():
+    values = [
+        nat(0), nat(2 ** 70), int_(-12345), string(""), string("élan"),
+        bytes_(b"\x00\xff"), unit, bool_(True), bool_(False),
+        some(nat(3)), left(string("a")), right(unit),
+        pair(nat(1), string("b"), bytes_(b"c")),
+        record({"owner": address("tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx"),
+                "token_id": nat(7), "amount": nat(1)}),
+        map_([(string("k"), bytes_(b"v")), (string("l"), bytes_(b""))]),
+        [], [nat(1), [nat(2)]],
+        {"prim": "Pair", "args": [nat(1), nat(2)], "annots": ["%a"]},
+        {"prim": "Pair", "args": [nat(1), nat(2), nat(3)]},
+    ]
+    for value in values:
+        assert decode(encode(value)) == value
+        assert unpack(pack(value)) == value
+        assert size(value) == len(encode(value))
+
+def test_parse():
+    assert parse('Pair 1 (Some "a")') == pair(nat(1), some(string("a")))
+    assert (parse('{ Elt "k" 0x00ff ; Elt "l" Unit }')
+            == map_([(string("k"), bytes_(b"\x00\xff")), (string("l"), unit)]))
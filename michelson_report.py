@@ -0,0 +1,313 @@
+##
+## ## Code-Size Report of Compiled Contracts
+##
+## The code of a contract is paid once at origination (like any storage
+## byte) and read and type-checked at every call, so each entry point
+## added to the `FA2` hierarchy or to the marketplaces has a cost for all
+## the others.
+## This tool reads the output of the SmartPy compiler (`*_contract.tz` or
+## `*_contract.json`) and attributes Michelson instructions and bytes to:
+##
+## - each entry point: the branch of the `IF_LEFT` dispatch tree that
+##   matches its leaf of the `or` parameter type,
+## - the shared lambdas (`sp.global_lambda`, …) pushed before the dispatch,
+## - the rest (prologue, dispatch itself, epilogue).
+##
+## It also looks for duplicated code: runs of instructions that appear
+## more than once in the script (e.g. the expansions of `ledger_key.make`
+## or of `is_administrator`) and could become a lambda or a shared helper.
+##
+## With `lazy_entry_points`, the entry points are stored as lambdas in the
+## storage, pass the `*_storage.tz` file with `--storage` to list them too.
+##
+## Usage:
+##
+##     python michelson_report.py out/step_000_cont_0_contract.tz
+##     python michelson_report.py out/step_000_cont_0_contract.json \
+##         --duplicates 30 --min-bytes 12 --json
+##
+import argparse
+import json
+import sys
+
+import micheline as m
+
+def load(path):
+    with open(path) as f:
+        text = f.read()
+    if path.endswith(".json"):
+        return json.loads(text)
+    return m.parse(text)
+
+def script_section(script, name):
+    for node in script:
+        if isinstance(node, dict) and node.get("prim") == name:
+            return node["args"][0]
+    raise ValueError("No %s section in the script" % name)
+
+def is_instruction(node):
+    # Instructions are all upper-case, types are lower-case and data
+    # constructors capitalized:
+    return (isinstance(node, dict) and "prim" in node
+            and node["prim"].upper() == node["prim"])
+
+def instructions(node):
+    "Number of instructions in `node`, including nested ones."
+    if isinstance(node, list):
+        return sum(instructions(x) for x in node)
+    if "prim" not in node:
+        return 0
+    return (1 if is_instruction(node) else 0) + sum(
+        instructions(a) for a in node.get("args", []))
+
+def field_annot(node):
+    for a in node.get("annots", []):
+        if a.startswith("%"):
+            return a[1:]
+    return None
+
+def _first_if_left(code):
+    for i, instr in enumerate(code):
+        if isinstance(instr, dict) and instr.get("prim") == "IF_LEFT":
+            return i
+    return None
+
+def entry_points(parameter, code):
+    """Map entry-point names to their code by following the `or` type of
+    `parameter` down the `IF_LEFT` tree of `code`; returns the list of
+    `(name, code)` and the index of the dispatch in `code`."""
+    result = []
+    def walk(t, branch):
+        if t.get("prim") == "or" and field_annot(t) is None:
+            i = _first_if_left(branch)
+            if i is not None:
+                left, right = branch[i]["args"]
+                walk(t["args"][0], left)
+                walk(t["args"][1], right)
+                return
+        result.append((field_annot(t) or "default", branch))
+    i = _first_if_left(code)
+    if parameter.get("prim") == "or" and i is not None:
+        left, right = code[i]["args"]
+        walk(parameter["args"][0], left)
+        walk(parameter["args"][1], right)
+    else:
+        i = None
+        result.append((field_annot(parameter) or "default", code))
+    return result, i
+
+def shared_lambdas(code, dispatch):
+    "The `LAMBDA`s pushed before the dispatch."
+    end = len(code) if dispatch is None else dispatch
+    return [("lambda_%d" % n, instr)
+            for n, instr in enumerate(i for i in code[:end]
+                                      if isinstance(i, dict)
+                                      and i.get("prim") == "LAMBDA")]
+
+def lazy_lambdas(storage):
+    "The code values held in the storage, e.g. lazy entry points."
+    found = []
+    def walk(node):
+        if isinstance(node, list):
+            for x in node:
+                walk(x)
+        elif node.get("prim") == "Elt":
+            key, value = node["args"]
+            if (isinstance(value, list) and value
+                    and all(is_instruction(x) for x in value)):
+                found.append(("lazy_%s" % key.get("int", "?"), value))
+            else:
+                walk(value)
+        else:
+            for a in node.get("args", []):
+                walk(a)
+    walk(storage)
+    return found
+
+##
+## ### Duplicated Code
+##
+## Every node gets an integer id such that structurally equal nodes have
+## the same id, then every run of up to `max_length` consecutive
+## instructions of every sequence is counted.
+class _Index:
+    def __init__(self):
+        self.ids = {}
+        self.sizes = {}
+        self.nodes = {}
+
+    def intern(self, node):
+        if isinstance(node, list):
+            key = ("seq",) + tuple(self.intern(x) for x in node)
+        elif "prim" in node:
+            key = (node["prim"], tuple(self.intern(a) for a in node.get("args", [])),
+                   tuple(node.get("annots", [])))
+        else:
+            key = tuple(sorted(node.items()))
+        if key not in self.ids:
+            self.ids[key] = len(self.ids)
+            self.sizes[self.ids[key]] = m.size(node)
+            self.nodes[self.ids[key]] = node
+        return self.ids[key]
+
+def duplicates(owned_code, min_bytes = 8, max_length = 32, limit = 20):
+    """Runs of instructions found at least twice.
+
+    `owned_code` is a list of `(owner, code)`, the result is a list of
+    `(bytes, count, owners, instructions)` sorted by the bytes that
+    factoring the run would save, runs contained in a better one are
+    skipped."""
+    index = _Index()
+    sequences = []
+    # Position `(sequence, index)` of the instruction holding each sequence:
+    parents = {}
+    def collect(owner, node, parent):
+        if isinstance(node, list):
+            s = len(sequences)
+            sequences.append((owner, [index.intern(x) for x in node], node))
+            parents[s] = parent
+            for k, x in enumerate(node):
+                collect(owner, x, (s, k))
+        elif "prim" in node:
+            for a in node.get("args", []):
+                collect(owner, a, parent)
+    for owner, code in owned_code:
+        collect(owner, code, None)
+    windows = {}
+    for s, (owner, ids, _) in enumerate(sequences):
+        for start in range(len(ids)):
+            for end in range(start + 1, min(len(ids), start + max_length) + 1):
+                windows.setdefault(tuple(ids[start:end]), []).append(
+                    (s, start, owner))
+    candidates = []
+    for key, occurrences in windows.items():
+        if len(occurrences) < 2:
+            continue
+        size = sum(index.sizes[i] for i in key)
+        if size < min_bytes:
+            continue
+        candidates.append(((len(occurrences) - 1) * size, size, key,
+                           occurrences))
+    candidates.sort(key = lambda c: (-c[0], -len(c[2])))
+    covered = set()
+    def is_covered(position):
+        while position is not None:
+            if position in covered:
+                return True
+            position = parents[position[0]]
+        return False
+    result = []
+    for saved, size, key, occurrences in candidates:
+        positions = [(s, start + k) for s, start, _ in occurrences
+                     for k in range(len(key))]
+        if all(is_covered(p) for p in positions):
+            continue
+        covered.update(positions)
+        owners = sorted(set(owner for _, _, owner in occurrences))
+        result.append((size, len(occurrences), owners,
+                       [index.nodes[i] for i in key]))
+        if len(result) >= limit:
+            break
+    return result
+
+##
+## ### Report
+##
+def report(script, storage = None, min_bytes = 8, limit = 20):
+    parameter = script_section(script, "parameter")
+    code = script_section(script, "code")
+    entries, dispatch = entry_points(parameter, code)
+    lambdas = shared_lambdas(code, dispatch)
+    lazy = lazy_lambdas(storage) if storage is not None else []
+    total = m.size(script)
+    code_size = m.size(code)
+    rows = []
+    for kind, items in (("entry point", entries), ("lambda", lambdas),
+                        ("lazy", lazy)):
+        for name, node in items:
+            rows.append({"name": name, "kind": kind,
+                         "instructions": instructions(node),
+                         "bytes": m.size(node)})
+    in_code = sum(r["bytes"] for r in rows if r["kind"] != "lazy")
+    rows.append({"name": "(dispatch, prologue, epilogue)", "kind": "other",
+                 "instructions": instructions(code) - sum(
+                     r["instructions"] for r in rows if r["kind"] != "lazy"),
+                 "bytes": code_size - in_code})
+    owned = entries + lambdas + lazy
+    return {
+        "script_bytes": total,
+        "code_bytes": code_size,
+        "types_bytes": total - code_size,
+        "parts": rows,
+        "duplicates": [
+            {"bytes": size, "count": count, "owners": owners,
+             "code": code}
+            for size, count, owners, code
+            in duplicates(owned, min_bytes = min_bytes, limit = limit)],
+    }
+
+def to_michelson(node):
+    "Compact concrete syntax, enough to recognize a piece of code."
+    if isinstance(node, list):
+        if not node:
+            return "{}"
+        return "{ " + "; ".join(to_michelson(x) for x in node) + " }"
+    if "int" in node:
+        return node["int"]
+    if "string" in node:
+        return json.dumps(node["string"])
+    if "bytes" in node:
+        return "0x" + node["bytes"]
+    parts = [node["prim"]] + node.get("annots", [])
+    for a in node.get("args", []):
+        s = to_michelson(a)
+        if isinstance(a, dict) and a.get("args"):
+            s = "(" + s + ")"
+        parts.append(s)
+    return " ".join(parts)
+
+def show(result, width = 100):
+    lines = ["script: %d bytes (code %d, types %d)"
+             % (result["script_bytes"], result["code_bytes"],
+                result["types_bytes"]),
+             "",
+             "%-40s %-12s %8s %8s %6s" % ("part", "kind", "instrs", "bytes",
+                                          "%code")]
+    for r in sorted(result["parts"], key = lambda r: -r["bytes"]):
+        lines.append("%-40s %-12s %8d %8d %5.1f%%"
+                     % (r["name"], r["kind"], r["instructions"], r["bytes"],
+                        100.0 * r["bytes"] / result["code_bytes"]))
+    if result["duplicates"]:
+        lines += ["", "Duplicated code (bytes x occurrences):"]
+    for d in result["duplicates"]:
+        code = to_michelson(d["code"])
+        if len(code) > width:
+            code = code[:width - 3] + "..."
+        lines.append("  %4d x %-3d in %s" % (d["bytes"], d["count"],
+                                             ", ".join(d["owners"])))
+        lines.append("      " + code)
+    return "\n".join(lines)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Code size per entry point of a compiled contract.")
+    parser.add_argument("contract", help = "*_contract.tz or *_contract.json")
+    parser.add_argument("--storage", help = "*_storage.tz or *_storage.json"
+                        " (for lazy entry points)")
+    parser.add_argument("--min-bytes", type = int, default = 8,
+                        help = "Smallest duplicated run to report.")
+    parser.add_argument("--duplicates", type = int, default = 20,
+                        help = "Number of duplicated runs to report.")
+    parser.add_argument("--json", action = "store_true")
+    args = parser.parse_args(argv)
+    storage = load(args.storage) if args.storage else None
+    result = report(load(args.contract), storage,
+                    min_bytes = args.min_bytes, limit = args.duplicates)
+    if args.json:
+        print(json.dumps(result, indent = 1))
+    else:
+        print(show(result))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+##
+## ## Off-Chain Views Evaluated Locally
+##
+## The TZIP-16 off-chain views of `FA2` (`get_balance`, `token_metadata`,
+## `does_token_exist`, `count_tokens`, `is_operator`, `total_supply`) are
+## pure functions of the storage; running their Michelson code against a
+## node for every API request is a full script execution each time.
+## This module answers them from an indexed copy of the storage (a snapshot
+## as written by `scenario_snapshot.py`), with an LRU cache in front.
+##
+## The evaluator follows the SmartPy definitions of the views, including
+## their failures (`FA2_TOKEN_UNDEFINED`, missing ledger entries, …) which
+## are raised as `View_error`.
+## To check it against the compiled views, `scenario` writes a SmartPy
+## script that restores the same snapshot with `storage_of_snapshot`,
+## evaluates each off-chain view of the contract in the scenario
+## (`scenario.compute(c1.get_balance(…))`) and verifies that it is the
+## answer of the evaluator, for a sample of queries.
+## `offchain_views_scenario.py` is one such script, for a snapshot of 12
+## tokens synthesized with
+## `scenario_snapshot.py synthesize --tokens 12 --owners 3 --cryptobot`.
+##
+## Queries are JSON lines `{"view": "get_balance", "params": {"owner":
+## "tz1…", "token_id": 3}}`; `params` is the token id for `token_metadata`,
+## `does_token_exist` and `total_supply`, and absent for `count_tokens`.
+##
+## Usage:
+##
+##     python offchain_views.py query snapshot.json --cryptobot \
+##         --queries queries.jsonl
+##     python offchain_views.py bench snapshot.json --cryptobot --sample 100000
+##     python offchain_views.py scenario snapshot.json --cryptobot \
+##         --sample 200 -o offchain_views_scenario.py
+##
+import argparse
+import functools
+import json
+import random
+import sys
+import time
+
+import scenario_snapshot
+import storage_model
+
+views = ["get_balance", "token_metadata", "does_token_exist",
+         "count_tokens", "is_operator", "total_supply"]
+
+class View_error(Exception):
+    "The view fails (`sp.failwith`, missing key, …) with this message."
+    pass
+
+class Evaluator:
+    def __init__(self, config, snapshot, cache_size = 65536):
+        self.config = config
+        self.ledger = {}
+        for e in snapshot["ledger"]:
+            if config.remove_zero_balances and e["balance"] == 0:
+                continue
+            self.ledger[self.ledger_key(e["owner"], e["token_id"])] = e["balance"]
+        self.tokens = dict((t["token_id"], (t["total_supply"], t["metadata"]))
+                           for t in snapshot["tokens"])
+        self.operators = set((o["owner"], o["operator"], o["token_id"])
+                             for o in snapshot.get("operators", []))
+        # Each evaluator has its own cache, it is dropped with the snapshot:
+        self._cached = functools.lru_cache(maxsize = cache_size)(self._evaluate)
+
+    def ledger_key(self, owner, token_id):
+        if self.config.single_asset:
+            return owner
+        return (owner, token_id)
+
+    def _token(self, token_id):
+        if token_id not in self.tokens:
+            raise View_error("FA2_TOKEN_UNDEFINED")
+        return self.tokens[token_id]
+
+    def _evaluate(self, view, params):
+        # Results and errors are both cached: `(error, result)`.
+        try:
+            return None, getattr(self, "_" + view)(params)
+        except View_error as e:
+            return str(e), None
+
+    def _get_balance(self, params):
+        owner, token_id = params
+        self._token(token_id)
+        key = self.ledger_key(owner, token_id)
+        if key in self.ledger:
+            return self.ledger[key]
+        if self.config.remove_zero_balances:
+            return 0
+        raise View_error("missing ledger entry")
+
+    def _token_metadata(self, token_id):
+        return (token_id, self._token(token_id)[1])
+
+    def _does_token_exist(self, token_id):
+        return token_id in self.tokens
+
+    def _count_tokens(self, params):
+        return len(self.tokens)
+
+    def _is_operator(self, params):
+        return params in self.operators
+
+    def _total_supply(self, token_id):
+        if not self.config.store_total_supply:
+            return "total-supply not supported"
+        return self._token(token_id)[0]
+
+    def call(self, view, params = None):
+        """The result of `view`; `params` is hashable: a token id,
+        `(owner, token_id)` for `get_balance` or `(owner, operator,
+        token_id)` for `is_operator`."""
+        if view not in views:
+            raise ValueError("Unknown view: " + view)
+        error, result = self._cached(view, params)
+        if error is not None:
+            raise View_error(error)
+        return result
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+def params_of_json(view, params):
+    "The hashable `params` of `Evaluator.call` from a JSON query."
+    if view == "get_balance":
+        return (params["owner"], int(params["token_id"]))
+    if view == "is_operator":
+        return (params["owner"], params["operator"], int(params["token_id"]))
+    if view == "count_tokens":
+        return None
+    return int(params)
+
+def read_queries(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                q = json.loads(line)
+                yield q["view"], params_of_json(q["view"], q.get("params"))
+
+def sample_queries(snapshot, count, seed = 0):
+    """`count` queries over the snapshot, mostly on existing entries (with
+    a skew towards a few hot tokens, as for an API) and some missing."""
+    rng = random.Random(seed)
+    owners = sorted(set(e["owner"] for e in snapshot["ledger"]))
+    token_ids = sorted(t["token_id"] for t in snapshot["tokens"])
+    hot = token_ids[:max(1, len(token_ids) // 100)]
+    missing = (max(token_ids) + 1) if token_ids else 0
+    queries = []
+    for _ in range(count):
+        view = rng.choice(views)
+        r = rng.random()
+        if r < 0.1:
+            token_id = missing
+        elif r < 0.6:
+            token_id = rng.choice(hot)
+        else:
+            token_id = rng.choice(token_ids)
+        if view == "get_balance":
+            if rng.random() < 0.5 and snapshot["ledger"]:
+                e = rng.choice(snapshot["ledger"])
+                params = (e["owner"], e["token_id"])
+            else:
+                params = (rng.choice(owners), token_id)
+        elif view == "is_operator":
+            params = (rng.choice(owners), rng.choice(owners), token_id)
+        elif view == "count_tokens":
+            params = None
+        else:
+            params = token_id
+        queries.append((view, params))
+    return queries
+
+##
+## ### Verification Against the Compiled Views
+##
+## The expected values are written as SmartPy expressions.
+def smartpy_value(view, result):
+    if view == "token_metadata":
+        token_id, metadata = result
+        return ("sp.pair(sp.nat(%d), sp.map(l = {%s}, tkey = sp.TString,"
+                " tvalue = sp.TBytes))"
+                % (token_id, ", ".join("%s: sp.bytes(%s)"
+                                       % (json.dumps(k), json.dumps("0x" + v))
+                                       for k, v in sorted(metadata.items()))))
+    if isinstance(result, bool):
+        return repr(result)
+    if isinstance(result, str):
+        return json.dumps(result)
+    return "sp.nat(%d)" % result
+
+def smartpy_call(view, params):
+    if view == "get_balance":
+        return ("c1.get_balance(sp.record(owner = sp.address(%s),"
+                " token_id = sp.nat(%d)))" % (json.dumps(params[0]), params[1]))
+    if view == "is_operator":
+        return ("c1.is_operator(sp.record(owner = sp.address(%s),"
+                " operator = sp.address(%s), token_id = sp.nat(%d)))"
+                % (json.dumps(params[0]), json.dumps(params[1]), params[2]))
+    if view == "count_tokens":
+        return "c1.count_tokens()"
+    return "c1.%s(sp.nat(%d))" % (view, params)
+
+def fa2_config_arguments(config):
+    return ", ".join("%s = %r" % (k, getattr(config, k))
+                     for k in ["readable", "single_asset", "non_fungible",
+                               "store_total_supply",
+                               "assume_consecutive_token_ids",
+                               "token_ids_in_big_map", "remove_zero_balances",
+                               "shared_metadata"])
+
+def scenario(config, snapshot, queries, evaluator):
+    """A SmartPy script checking the answers of `evaluator` against the
+    views of an `FA2` contract restored from `snapshot`; failing queries
+    are only counted (a view cannot be expected to fail in a scenario)."""
+    lines = [
+        "# Generated by offchain_views.py, do not edit.",
+        "import smartpy as sp",
+        "",
+        "FA2 = sp.import_script_from_url(\"file:FA2_template.py\",",
+        "                                name = \"templates/FA2_template\")",
+        "",
+        "snapshot = %s" % json.dumps(snapshot, sort_keys = True),
+        "",
+        "@sp.add_test(name = \"Off-chain views evaluated locally\")",
+        "def test():",
+        "    config = FA2.FA2_config(%s)" % fa2_config_arguments(config),
+        "    scenario = sp.test_scenario()",
+        "    scenario.h1(\"Off-chain views evaluated locally\")",
+        "    c1 = FA2.FA2(config = config,",
+        "                 metadata = sp.metadata_of_url(\"https://example.com\"),",
+        "                 admin = sp.test_account(\"Administrator\").address,",
+        "                 **FA2.storage_of_snapshot(config, snapshot))",
+        "    scenario += c1",
+    ]
+    checked = failing = 0
+    for view, params in queries:
+        try:
+            result = evaluator.call(view, params)
+        except View_error:
+            failing += 1
+            continue
+        lines.append("    result = scenario.compute(%s)" % smartpy_call(view, params))
+        lines.append("    scenario.verify_equal(result, %s)"
+                     % smartpy_value(view, result))
+        checked += 1
+    lines.append("    scenario.p(\"%d queries checked, %d failing ones"
+                 " skipped.\")" % (checked, failing))
+    return "\n".join(lines) + "\n", checked, failing
+
+def bench(evaluator, queries):
+    "Queries per second of `evaluator` over `queries`."
+    start = time.perf_counter()
+    errors = 0
+    for view, params in queries:
+        try:
+            evaluator.call(view, params)
+        except View_error:
+            errors += 1
+    elapsed = time.perf_counter() - start
+    return len(queries) / elapsed if elapsed > 0 else float("inf"), errors
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Evaluate the FA2 off-chain views over a snapshot.")
+    parser.add_argument("command", choices = ["query", "bench", "scenario"])
+    parser.add_argument("snapshot", help = "As written by scenario_snapshot.py.")
+    parser.add_argument("--queries", help = "Queries as JSON lines (default:"
+                        " a sample over the snapshot).")
+    parser.add_argument("--sample", type = int, default = 1000)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--cache-size", type = int, default = 65536)
+    parser.add_argument("-o", "--output", help = "SmartPy script (scenario).")
+    parser.add_argument("--cryptobot", action = "store_true",
+                        help = "Use the configuration of the Cryptobot marketplace.")
+    parser.add_argument("--marketplace", action = "store_true")
+    parser.add_argument("--no-readable", action = "store_true")
+    parser.add_argument("--single-asset", action = "store_true")
+    parser.add_argument("--no-totsup", action = "store_true")
+    parser.add_argument("--no-toknat", action = "store_true")
+    parser.add_argument("--tokbigmap", action = "store_true")
+    parser.add_argument("--rm-zero", action = "store_true")
+    parser.add_argument("--shared-metadata", action = "store_true")
+    args = parser.parse_args(argv)
+    config = storage_model.config_of_args(args)
+    snapshot = scenario_snapshot.load(args.snapshot)
+    evaluator = Evaluator(config, snapshot, args.cache_size)
+    if args.queries:
+        queries = list(read_queries(args.queries))
+    else:
+        queries = sample_queries(snapshot, args.sample, args.seed)
+    if args.command == "query":
+        for view, params in queries:
+            try:
+                answer = {"result": evaluator.call(view, params)}
+            except View_error as e:
+                answer = {"error": str(e)}
+            answer.update(view = view, params = params)
+            print(json.dumps(answer, sort_keys = True))
+        return 0
+    if args.command == "bench":
+        uncached = Evaluator(config, snapshot, cache_size = 0)
+        for name, e in (("no cache", uncached), ("LRU cache", evaluator)):
+            qps, errors = bench(e, queries)
+            print("%-10s %12.0f queries/s (%d failing)" % (name, qps, errors))
+        print(evaluator.cache_info())
+        return 0
+    if args.output is None:
+        parser.error("scenario needs -o")
+    text, checked, failing = scenario(config, snapshot, queries, evaluator)
+    with open(args.output, "w") as f:
+        f.write(text)
+    print("%s: %d queries checked, %d failing ones skipped"
+          % (args.output, checked, failing))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
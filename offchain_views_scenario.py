@@ -0,0 +1,71 @@
+# Generated by offchain_views.py, do not edit.
+import smartpy as sp
+
+FA2 = sp.import_script_from_url("file:FA2_template.py",
+                                name = "templates/FA2_template")
+
+snapshot = {"initial_hodlers": {"tz1aynMmQndzM4pznrnZexAckpn5Eff2XedF": 4, "tz1e1kDPXSYR8wnYHFddLpsaJsoBxiUfiKSp": 4, "tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1": 4}, "ledger": [{"balance": 1, "owner": "tz1e1kDPXSYR8wnYHFddLpsaJsoBxiUfiKSp", "token_id": 0}, {"balance": 1, "owner": "tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1", "token_id": 1}, {"balance": 1, "owner": "tz1aynMmQndzM4pznrnZexAckpn5Eff2XedF", "token_id": 2}, {"balance": 1, "owner": "tz1e1kDPXSYR8wnYHFddLpsaJsoBxiUfiKSp", "token_id": 3}, {"balance": 1, "owner": "tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1", "token_id": 4}, {"balance": 1, "owner": "tz1aynMmQndzM4pznrnZexAckpn5Eff2XedF", "token_id": 5}, {"balance": 1, "owner": "tz1e1kDPXSYR8wnYHFddLpsaJsoBxiUfiKSp", "token_id": 6}, {"balance": 1, "owner": "tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1", "token_id": 7}, {"balance": 1, "owner": "tz1aynMmQndzM4pznrnZexAckpn5Eff2XedF", "token_id": 8}, {"balance": 1, "owner": "tz1e1kDPXSYR8wnYHFddLpsaJsoBxiUfiKSp", "token_id": 9}, {"balance": 1, "owner": "tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1", "token_id": 10}, {"balance": 1, "owner": "tz1aynMmQndzM4pznrnZexAckpn5Eff2XedF", "token_id": 11}], "offer": [], "operators": [], "tokens": [{"metadata": {"": "697066733a2f2f516d524c6963556f6f50366738384e596f3865353972684c4a427979776861316241534d4542397973683541594d"}, "token_id": 0, "total_supply": 1}, {"metadata": {"": "697066733a2f2f516d524c6963556f6f50366738384e596f3865353972684c4a427979776861316241534d4542397973683541594d"}, "token_id": 1, "total_supply": 1}, {"metadata": {"": "697066733a2f2f516d524c6963556f6f50366738384e596f3865353972684c4a427979776861316241534d4542397973683541594d"}, "token_id": 2, "total_supply": 1}, {"metadata": {"": "697066733a2f2f516d524c6963556f6f50366738384e596f3865353972684c4a427979776861316241534d4542397973683541594d"}, "token_id": 3, "total_supply": 1}, {"metadata": {"": "697066733a2f2f516d524c6963556f6f50366738384e596f3865353972684c4a427979776861316241534d4542397973683541594d"}, "token_id": 4, "total_supply": 1}, {"metadata": {"": "697066733a2f2f516d524c6963556f6f50366738384e596f3865353972684c4a427979776861316241534d4542397973683541594d"}, "token_id": 5, "total_supply": 1}, {"metadata": {"": "697066733a2f2f516d524c6963556f6f50366738384e596f3865353972684c4a427979776861316241534d4542397973683541594d"}, "token_id": 6, "total_supply": 1}, {"metadata": {"": "697066733a2f2f516d524c6963556f6f50366738384e596f3865353972684c4a427979776861316241534d4542397973683541594d"}, "token_id": 7, "total_supply": 1}, {"metadata": {"": "697066733a2f2f516d524c6963556f6f50366738384e596f3865353972684c4a427979776861316241534d4542397973683541594d"}, "token_id": 8, "total_supply": 1}, {"metadata": {"": "697066733a2f2f516d524c6963556f6f50366738384e596f3865353972684c4a427979776861316241534d4542397973683541594d"}, "token_id": 9, "total_supply": 1}, {"metadata": {"": "697066733a2f2f516d524c6963556f6f50366738384e596f3865353972684c4a427979776861316241534d4542397973683541594d"}, "token_id": 10, "total_supply": 1}, {"metadata": {"": "697066733a2f2f516d524c6963556f6f50366738384e596f3865353972684c4a427979776861316241534d4542397973683541594d"}, "token_id": 11, "total_supply": 1}]}
+
+@sp.add_test(name = "Off-chain views evaluated locally")
+def test():
+    config = FA2.FA2_config(readable = True, single_asset = False, non_fungible = True, store_total_supply = False, assume_consecutive_token_ids = False, token_ids_in_big_map = True, remove_zero_balances = False, shared_metadata = False)
+    scenario = sp.test_scenario()
+    scenario.h1("Off-chain views evaluated locally")
+    c1 = FA2.FA2(config = config,
+                 metadata = sp.metadata_of_url("https://example.com"),
+                 admin = sp.test_account("Administrator").address,
+                 **FA2.storage_of_snapshot(config, snapshot))
+    scenario += c1
+    result = scenario.compute(c1.count_tokens())
+    scenario.verify_equal(result, sp.nat(12))
+    result = scenario.compute(c1.get_balance(sp.record(owner = sp.address("tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1"), token_id = sp.nat(4))))
+    scenario.verify_equal(result, sp.nat(1))
+    result = scenario.compute(c1.count_tokens())
+    scenario.verify_equal(result, sp.nat(12))
+    result = scenario.compute(c1.is_operator(sp.record(owner = sp.address("tz1aynMmQndzM4pznrnZexAckpn5Eff2XedF"), operator = sp.address("tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1"), token_id = sp.nat(0))))
+    scenario.verify_equal(result, False)
+    result = scenario.compute(c1.does_token_exist(sp.nat(8)))
+    scenario.verify_equal(result, True)
+    result = scenario.compute(c1.total_supply(sp.nat(2)))
+    scenario.verify_equal(result, "total-supply not supported")
+    result = scenario.compute(c1.does_token_exist(sp.nat(12)))
+    scenario.verify_equal(result, False)
+    result = scenario.compute(c1.get_balance(sp.record(owner = sp.address("tz1aynMmQndzM4pznrnZexAckpn5Eff2XedF"), token_id = sp.nat(8))))
+    scenario.verify_equal(result, sp.nat(1))
+    result = scenario.compute(c1.is_operator(sp.record(owner = sp.address("tz1aynMmQndzM4pznrnZexAckpn5Eff2XedF"), operator = sp.address("tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1"), token_id = sp.nat(0))))
+    scenario.verify_equal(result, False)
+    result = scenario.compute(c1.total_supply(sp.nat(9)))
+    scenario.verify_equal(result, "total-supply not supported")
+    result = scenario.compute(c1.count_tokens())
+    scenario.verify_equal(result, sp.nat(12))
+    result = scenario.compute(c1.token_metadata(sp.nat(11)))
+    scenario.verify_equal(result, sp.pair(sp.nat(11), sp.map(l = {"": sp.bytes("0x697066733a2f2f516d524c6963556f6f50366738384e596f3865353972684c4a427979776861316241534d4542397973683541594d")}, tkey = sp.TString, tvalue = sp.TBytes)))
+    result = scenario.compute(c1.get_balance(sp.record(owner = sp.address("tz1aynMmQndzM4pznrnZexAckpn5Eff2XedF"), token_id = sp.nat(2))))
+    scenario.verify_equal(result, sp.nat(1))
+    result = scenario.compute(c1.is_operator(sp.record(owner = sp.address("tz1e1kDPXSYR8wnYHFddLpsaJsoBxiUfiKSp"), operator = sp.address("tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1"), token_id = sp.nat(0))))
+    scenario.verify_equal(result, False)
+    result = scenario.compute(c1.count_tokens())
+    scenario.verify_equal(result, sp.nat(12))
+    result = scenario.compute(c1.total_supply(sp.nat(0)))
+    scenario.verify_equal(result, "total-supply not supported")
+    result = scenario.compute(c1.is_operator(sp.record(owner = sp.address("tz1e1kDPXSYR8wnYHFddLpsaJsoBxiUfiKSp"), operator = sp.address("tz1aynMmQndzM4pznrnZexAckpn5Eff2XedF"), token_id = sp.nat(0))))
+    scenario.verify_equal(result, False)
+    result = scenario.compute(c1.is_operator(sp.record(owner = sp.address("tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1"), operator = sp.address("tz1aynMmQndzM4pznrnZexAckpn5Eff2XedF"), token_id = sp.nat(5))))
+    scenario.verify_equal(result, False)
+    result = scenario.compute(c1.does_token_exist(sp.nat(0)))
+    scenario.verify_equal(result, True)
+    result = scenario.compute(c1.get_balance(sp.record(owner = sp.address("tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1"), token_id = sp.nat(1))))
+    scenario.verify_equal(result, sp.nat(1))
+    result = scenario.compute(c1.get_balance(sp.record(owner = sp.address("tz1aynMmQndzM4pznrnZexAckpn5Eff2XedF"), token_id = sp.nat(2))))
+    scenario.verify_equal(result, sp.nat(1))
+    result = scenario.compute(c1.is_operator(sp.record(owner = sp.address("tz1aynMmQndzM4pznrnZexAckpn5Eff2XedF"), operator = sp.address("tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1"), token_id = sp.nat(0))))
+    scenario.verify_equal(result, False)
+    result = scenario.compute(c1.is_operator(sp.record(owner = sp.address("tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1"), operator = sp.address("tz1e1kDPXSYR8wnYHFddLpsaJsoBxiUfiKSp"), token_id = sp.nat(6))))
+    scenario.verify_equal(result, False)
+    result = scenario.compute(c1.count_tokens())
+    scenario.verify_equal(result, sp.nat(12))
+    result = scenario.compute(c1.get_balance(sp.record(owner = sp.address("tz1fpaktzVPTzLcUDmTH9eZYTgXRvDd17DP1"), token_id = sp.nat(10))))
+    scenario.verify_equal(result, sp.nat(1))
+    result = scenario.compute(c1.does_token_exist(sp.nat(3)))
+    scenario.verify_equal(result, True)
+    scenario.p("26 queries checked, 4 failing ones skipped.")
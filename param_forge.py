@@ -0,0 +1,369 @@
+##
+## ## Forging `transfer` and `update_operators` Parameters
+##
+## A backend sending tokens for many users builds the arguments of the
+## FA2 entry points and forges them into the binary Micheline of the
+## operation.
+## This module writes that binary directly, for the types of
+## `Batch_transfer.get_transfer_type` and `Operator_param.get_type`:
+##
+## - `transfer`: a list of `(from_, txs)` with each `tx` laid out as
+##   `("to_", ("token_id", "amount"))` with `force_layouts` (the default of
+##   `FA2_config`), otherwise in SmartPy's default layout
+##   `("amount", ("to_", "token_id"))`,
+## - `update_operators`: a list of `Left` (`add_operator`) or `Right`
+##   (`remove_operator`) of `("owner", ("operator", "token_id"))`, or
+##   `("operator", ("owner", "token_id"))` without `force_layouts`.
+##
+## Batches are written as a stream: the items go through a spooled
+## temporary file (the length of a Micheline sequence comes before its
+## items), so memory stays bounded for millions of transfers.
+##
+## Addresses are written in readable form (strings) like the parameters
+## compiled by SmartPy, or in optimized form (22 bytes) with `optimized`.
+## `param_hash` is the hash a `permit` (TZIP-17) expects for one transfer
+## item, i.e. the `blake2b` of its `PACK`, which uses the optimized form.
+##
+## `check` is the golden test: it reads the parameters that SmartPy wrote
+## for the calls of a scenario (`step_NNN_cont_N_params.json` or `.tz`),
+## forges the same values again and compares the bytes.
+## The tests of `FA2_template.py` call `transfer` and `update_operators` in
+## both layouts: `SmartPy.sh test FA2_template.py out/` writes them in
+## `out/FA2/` and `out/FA2-no_layout/`, and `check` reads the layout of a
+## file from the name of its test (`-no_layout`) unless it is given.
+##
+## Transfers are given as JSON lines `{"from_": "tz1…", "txs": [{"to_":
+## "tz1…", "token_id": 0, "amount": 1}]}`, operator updates as
+## `{"add_operator": {"owner": "tz1…", "operator": "KT1…", "token_id": 0}}`
+## (or `remove_operator`).
+##
+## Usage:
+##
+##     python param_forge.py transfer transfers.jsonl -o transfer.bin
+##     python param_forge.py update_operators updates.jsonl --hex
+##     python param_forge.py param_hash transfers.jsonl
+##     python param_forge.py check out/*/step_*_params.json
+##     python param_forge.py check out/step_*_params.tz --no-force-layouts
+##     python param_forge.py bench --count 100000
+##
+import argparse
+import hashlib
+import io
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+import micheline as m
+
+def tx_layout(force_layouts = True):
+    if force_layouts:
+        return ("to_", ("token_id", "amount"))
+    return m.default_layout(["to_", "token_id", "amount"])
+
+def operator_layout(force_layouts = True):
+    if force_layouts:
+        return ("owner", ("operator", "token_id"))
+    return m.default_layout(["owner", "operator", "token_id"])
+
+transfer_layout = ("from_", "txs")
+
+# Binary headers of `Pair a b`, `Left a` and `Right a` without annotations:
+_pair = b"\x07\x07"
+_left = b"\x05\x05"
+_right = b"\x05\x08"
+
+def _comb(layout, fields):
+    "The binary `Pair` tree of `layout` over already encoded `fields`."
+    if isinstance(layout, str):
+        return fields[layout]
+    return _pair + _comb(layout[0], fields) + _comb(layout[1], fields)
+
+def _nat(n):
+    n = int(n)
+    if n < 0:
+        raise ValueError("Negative nat: %d" % n)
+    return b"\x00" + m.zarith(n)
+
+class Forger:
+    def __init__(self, force_layouts = True, optimized = False,
+                 spool_size = 1 << 22):
+        self.tx_layout = tx_layout(force_layouts)
+        self.operator_layout = operator_layout(force_layouts)
+        self.optimized = optimized
+        # Sequences larger than this are spooled to disk:
+        self.spool_size = spool_size
+        # The same few addresses come back in every batch:
+        self.addresses = {}
+
+    def address(self, address):
+        result = self.addresses.get(address)
+        if result is None:
+            if self.optimized:
+                result = m.encode({"bytes": m.address_bytes(address).hex()})
+            else:
+                m.address_bytes(address) # Validates the checksum.
+                result = m.encode({"string": address})
+            self.addresses[address] = result
+        return result
+
+    def tx(self, to_, token_id, amount):
+        return _comb(self.tx_layout, {"to_": self.address(to_),
+                                      "token_id": _nat(token_id),
+                                      "amount": _nat(amount)})
+
+    def operator(self, owner, operator, token_id):
+        return _comb(self.operator_layout, {"owner": self.address(owner),
+                                            "operator": self.address(operator),
+                                            "token_id": _nat(token_id)})
+
+    def sequence(self, items, out):
+        "Write the Micheline sequence of the encoded `items` (an iterable)."
+        with tempfile.SpooledTemporaryFile(self.spool_size) as body:
+            length = 0
+            for item in items:
+                body.write(item)
+                length += len(item)
+            out.write(b"\x02" + length.to_bytes(4, "big"))
+            body.seek(0)
+            shutil.copyfileobj(body, out)
+        return 5 + length
+
+    def transfer_item(self, from_, txs, out):
+        "`txs` is an iterable of `(to_, token_id, amount)`."
+        out.write(_pair + self.address(from_))
+        return 2 + len(self.address(from_)) + self.sequence(
+            (self.tx(*tx) for tx in txs), out)
+
+    def transfer(self, transfers, out):
+        """Write the argument of `transfer`: `transfers` is an iterable of
+        `(from_, txs)`, each `txs` an iterable of `(to_, token_id, amount)`;
+        both are consumed once, in order."""
+        # The `txs` of one `from_` can be large too: each is spooled on its
+        # own, then appended to the outer sequence.
+        with tempfile.SpooledTemporaryFile(self.spool_size) as body:
+            length = 0
+            for from_, txs in transfers:
+                length += self.transfer_item(from_, txs, body)
+            out.write(b"\x02" + length.to_bytes(4, "big"))
+            body.seek(0)
+            shutil.copyfileobj(body, out)
+        return 5 + length
+
+    def update_operators(self, updates, out):
+        """Write the argument of `update_operators`: `updates` is an iterable
+        of `(kind, owner, operator, token_id)` with `kind` either
+        `"add_operator"` or `"remove_operator"`."""
+        def items():
+            for kind, owner, operator, token_id in updates:
+                if kind == "add_operator":
+                    head = _left
+                elif kind == "remove_operator":
+                    head = _right
+                else:
+                    raise ValueError("Unknown operator update: " + kind)
+                yield head + self.operator(owner, operator, token_id)
+        return self.sequence(items(), out)
+
+def forge(method, values, force_layouts = True, optimized = False):
+    "The bytes of `Forger.transfer` or `Forger.update_operators`."
+    out = io.BytesIO()
+    getattr(Forger(force_layouts, optimized), method)(values, out)
+    return out.getvalue()
+
+def param_hash(from_, txs, force_layouts = True):
+    "The `blake2b` of the packed transfer item, as signed for a permit."
+    out = io.BytesIO(b"\x05")
+    out.seek(1)
+    Forger(force_layouts, optimized = True).transfer_item(from_, txs, out)
+    return hashlib.blake2b(out.getvalue(), digest_size = 32).digest()
+
+##
+## ### JSON Input
+##
+def transfers_of_json(lines):
+    for line in lines:
+        if line.strip():
+            t = json.loads(line)
+            yield t["from_"], ((tx["to_"], tx["token_id"], tx["amount"])
+                               for tx in t["txs"])
+
+def updates_of_json(lines):
+    for line in lines:
+        if line.strip():
+            u = json.loads(line)
+            (kind, p), = u.items()
+            yield kind, p["owner"], p["operator"], p["token_id"]
+
+##
+## ### Golden Test Against SmartPy
+##
+## SmartPy writes each call of a scenario as a Micheline value, the values
+## are read back into Python with the layouts of the configuration, then
+## forged again.
+def _load_params(path):
+    with open(path) as f:
+        text = f.read()
+    if path.endswith(".json"):
+        return json.loads(text)
+    return m.parse(text)
+
+def _is_address(node):
+    return isinstance(node, dict) and ("string" in node or "bytes" in node)
+
+def entry_point_of_params(node):
+    """`"transfer"`, `"update_operators"` or `None` from the shape of the
+    argument (an empty list is ambiguous, it is `None`)."""
+    if not isinstance(node, list) or not node:
+        return None
+    first = node[0]
+    if not isinstance(first, dict):
+        return None
+    if first.get("prim") == "Pair" and len(first.get("args", [])) == 2:
+        from_, txs = first["args"]
+        if _is_address(from_) and isinstance(txs, list):
+            return "transfer"
+    if first.get("prim") in ("Left", "Right"):
+        return "update_operators"
+    return None
+
+def _int(node):
+    return int(node["int"])
+
+def values_of_params(entry_point, node, force_layouts = True):
+    "The input of `Forger.transfer` or `Forger.update_operators`."
+    if entry_point == "transfer":
+        layout = tx_layout(force_layouts)
+        result = []
+        for item in node:
+            from_, txs = item["args"]
+            fields = [m.unrecord(tx, layout) for tx in txs]
+            result.append((m.address_of_node(from_),
+                           [(m.address_of_node(f["to_"]), _int(f["token_id"]),
+                             _int(f["amount"])) for f in fields]))
+        return result
+    layout = operator_layout(force_layouts)
+    result = []
+    for item in node:
+        kind = ("add_operator" if item["prim"] == "Left"
+                else "remove_operator")
+        f = m.unrecord(item["args"][0], layout)
+        result.append((kind, m.address_of_node(f["owner"]),
+                       m.address_of_node(f["operator"]), _int(f["token_id"])))
+    return result
+
+def _optimized(node):
+    # SmartPy writes all the addresses of a value in the same form:
+    if isinstance(node, list):
+        return any(_optimized(x) for x in node)
+    if "bytes" in node:
+        return True
+    return any(_optimized(a) for a in node.get("args", []))
+
+def check(path, force_layouts = None):
+    """`(entry_point, ok)` for the parameters in `path`, `entry_point` is
+    `None` for the calls of other entry points; by default the layout is
+    the one of the test of `path` (see above)."""
+    if force_layouts is None:
+        force_layouts = "-no_layout" not in path
+    node = _load_params(path)
+    entry_point = entry_point_of_params(node)
+    if entry_point is None:
+        return None, True
+    values = values_of_params(entry_point, node, force_layouts)
+    forged = forge(entry_point, values, force_layouts, _optimized(node))
+    return entry_point, forged == m.encode(node)
+
+##
+## ### Throughput
+##
+def sample_transfers(count, per_sender = 10):
+    "`count` transfers from test addresses, `per_sender` per `from_`."
+    addresses = [m.b58check_encode(m.address_prefixes["tz1"][0]
+                                   + hashlib.blake2b(b"%d" % i,
+                                                     digest_size = 20).digest())
+                 for i in range(100)]
+    for start in range(0, count, per_sender):
+        n = min(per_sender, count - start)
+        yield (addresses[start // per_sender % len(addresses)],
+               ((addresses[(start + i) % len(addresses)], (start + i) % 10000, 1)
+                for i in range(n)))
+
+def bench(count, force_layouts = True, optimized = False):
+    "Transfers (`tx`s) forged per second and the size of the result."
+    out = io.BytesIO()
+    start = time.perf_counter()
+    size = Forger(force_layouts, optimized).transfer(sample_transfers(count),
+                                                     out)
+    elapsed = time.perf_counter() - start
+    return count / elapsed if elapsed > 0 else float("inf"), size
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Forge the arguments of the FA2 transfer and"
+        " update_operators entry points.")
+    parser.add_argument("command", choices = ["transfer", "update_operators",
+                                              "param_hash", "check", "bench"])
+    parser.add_argument("inputs", nargs = "*",
+                        help = "JSON lines (default: stdin), or the SmartPy"
+                        " parameter files for check.")
+    parser.add_argument("-o", "--output", help = "Binary output file.")
+    parser.add_argument("--hex", action = "store_true",
+                        help = "Print the bytes in hexadecimal.")
+    parser.add_argument("--no-force-layouts", action = "store_true",
+                        help = "For contracts built with force_layouts = False.")
+    parser.add_argument("--optimized", action = "store_true",
+                        help = "Write addresses in optimized form.")
+    parser.add_argument("--count", type = int, default = 100000)
+    args = parser.parse_args(argv)
+    force_layouts = not args.no_force_layouts
+    if args.command == "check":
+        failed = 0
+        for path in args.inputs:
+            entry_point, ok = check(path, False if args.no_force_layouts
+                                    else None)
+            if entry_point is None:
+                continue
+            print("%s: %s %s" % (path, entry_point, "ok" if ok else "MISMATCH"))
+            failed += not ok
+        return 1 if failed else 0
+    if args.command == "bench":
+        for optimized in (False, True):
+            rate, size = bench(args.count, force_layouts, optimized)
+            print("%-9s %10.0f txs/s, %d bytes for %d txs"
+                  % ("optimized" if optimized else "readable", rate, size,
+                     args.count))
+        return 0
+    def lines():
+        if not args.inputs:
+            yield from sys.stdin
+        for path in args.inputs:
+            with open(path) as f:
+                yield from f
+    if args.command == "param_hash":
+        for from_, txs in transfers_of_json(lines()):
+            print(param_hash(from_, txs, force_layouts).hex())
+        return 0
+    forger = Forger(force_layouts, args.optimized)
+    values = (transfers_of_json(lines()) if args.command == "transfer"
+              else updates_of_json(lines()))
+    if args.output and not args.hex:
+        with open(args.output, "wb") as f:
+            size = getattr(forger, args.command)(values, f)
+        print("%s: %d bytes" % (args.output, size))
+        return 0
+    out = io.BytesIO()
+    getattr(forger, args.command)(values, out)
+    text = out.getvalue().hex() if args.hex else out.getvalue()
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    elif args.hex:
+        print(text)
+    else:
+        sys.stdout.buffer.write(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,421 @@
+##
+## ## Replay of Historical Operations
+##
+## Runs the mainnet history of a marketplace, exported as JSON lines (one
+## operation per line, e.g. from an indexer), through the Python models of
+## `marketplace_model.py`, so that an optimization can be checked against
+## real traffic before it is deployed:
+##
+## ```json
+## {"hash": "oo…", "level": 1400000, "sender": "tz1…", "amount": 0,
+##  "entry_point": "transfer", "status": "applied",
+##  "parameters": [{"from_": "tz1…",
+##                  "txs": [{"to_": "tz1…", "token_id": "3", "amount": "1"}]}]}
+## ```
+##
+## Parameters use the JSON form of indexers (nats as strings are fine):
+## `mint` takes `{"metadata": {"": "<hex>"}}`, the marketplace entry points
+## `{"token_id": …}` (and `"sale_price"` for `offer_bot_for_sale`),
+## `sender` may also be `{"address": "tz1…"}`.
+## The auctions, collection bids and royalties of `cryptobot_marketplace`
+## take the fields of their SmartPy parameters, royalties are maps
+## `{"tz1…": "500"}`; `timestamp` (ISO 8601 or seconds) is the time of
+## the block, which auctions need.
+## Operations whose `status` is not `applied` are skipped, so are the entry
+## points the model does not have (e.g. `update_operators`).
+##
+## The pipeline is made of generators: operations are read, normalized,
+## applied and written one at a time, only the model's state is in memory.
+## Each result line gives the status of the operation in the model, its
+## emitted operations and an estimated gas from a table of costs per entry
+## point (`--gas`, see `Gas_model`), e.g. the `bench.py baseline` of the
+## deployed configuration.
+##
+## Every `--checkpoint-every` operations the state of the model, the
+## position in the input and in the output are saved (atomically) so that
+## an interrupted replay resumes with `--resume`.
+## At the end the storage of the model is written as a snapshot (cf.
+## `scenario_snapshot.py`) that a SmartPy scenario can restore, and the
+## storage held by zero-balance ledger entries (that the
+## `remove_zero_balances` option reclaims) is reported.
+##
+## Usage:
+##
+##     python replay.py history.jsonl --model deployed_cryptobot_marketplace \
+##         --gas bench_baseline.json --config FA2-nft-no_toknat \
+##         -o results.jsonl --storage final.json \
+##         --checkpoint replay.checkpoint --checkpoint-every 100000
+##     python replay.py history.jsonl … --resume
+##
+import argparse
+import datetime
+import itertools
+import json
+import os
+import sys
+
+import marketplace_model
+import storage_model
+
+admin = "admin"
+
+def read_operations(path, start = 0):
+    "The operations of a JSON-lines file, from the `start`-th one."
+    with open(path) as f:
+        for line in itertools.islice(f, start, None):
+            if line.strip():
+                yield json.loads(line)
+            else:
+                yield None
+
+def _address(a):
+    if isinstance(a, dict):
+        return a["address"]
+    return a
+
+def _nat(n):
+    return int(n)
+
+def _shares(m):
+    if m is None:
+        return None
+    return dict((_address(a), _nat(share)) for a, share in m.items())
+
+def _timestamp(t):
+    if t is None:
+        return 0
+    if isinstance(t, str) and not t.isdigit():
+        t = datetime.datetime.fromisoformat(t.replace("Z", "+00:00"))
+        return int(t.timestamp())
+    return int(t)
+
+def normalize(operation):
+    """`(entry_point, params, sender, amount, now)` in the form of the
+    models' normalized entry points, `None` for operations to skip."""
+    if operation is None or operation.get("status", "applied") != "applied":
+        return None
+    entry_point = operation["entry_point"]
+    p = operation.get("parameters")
+    if entry_point == "mint":
+        params = (p["metadata"],)
+    elif entry_point == "offer_bot_for_sale":
+        params = (_nat(p["token_id"]), _nat(p["sale_price"]))
+    elif entry_point in ("withdraw_bot_from_sale", "bot_no_longer_for_sale",
+                         "purchase_bot_at_sale_price"):
+        if entry_point == "bot_no_longer_for_sale":
+            entry_point = "withdraw_bot_from_sale"
+        params = (_nat(p["token_id"]),)
+    elif entry_point == "transfer":
+        params = ([(_address(t["from_"]),
+                    [(_address(tx["to_"]), _nat(tx["token_id"]),
+                      _nat(tx["amount"])) for tx in t["txs"]])
+                   for t in p],)
+    elif entry_point == "set_pause":
+        params = (bool(p),)
+    elif entry_point == "start_auction":
+        params = (_nat(p["token_id"]), _nat(p["reserve_price"]),
+                  int(p["duration"]))
+    elif entry_point in ("bid", "settle"):
+        params = (_nat(p["token_id"]),)
+    elif entry_point in ("withdraw_refund", "claim_royalties"):
+        params = ()
+    elif entry_point == "place_collection_bid":
+        params = (_nat(p["price"]), _nat(p["quantity"]))
+    elif entry_point == "accept_collection_bid":
+        params = (_nat(p["bid_id"]), [_nat(t) for t in p["token_ids"]])
+    elif entry_point == "cancel_collection_bid":
+        params = (_nat(p["bid_id"]),)
+    elif entry_point == "set_default_royalties":
+        params = (_shares(p),)
+    elif entry_point == "set_token_royalties":
+        params = (_nat(p["token_id"]), _shares(p.get("royalties")))
+    else:
+        return None
+    return (entry_point, params, _address(operation["sender"]),
+            _nat(operation.get("amount", 0)),
+            _timestamp(operation.get("timestamp")))
+
+class Gas_model:
+    """Estimated gas of a call from a table of costs per entry point:
+    `{entry_point: gas}` or `{entry_point: {"base": gas, "per_item": gas}}`
+    where items are the transactions of a `transfer` (the base covers the
+    first one).
+    A `bench.py` baseline can be used directly by giving its configuration
+    name."""
+    def __init__(self, table = None):
+        self.table = {}
+        for entry_point, cost in (table or {}).items():
+            if isinstance(cost, dict):
+                base = cost.get("base", cost.get("gas"))
+                self.table[entry_point] = (base, cost.get("per_item", 0))
+            else:
+                self.table[entry_point] = (cost, 0)
+
+    def load(path, config = None):
+        with open(path) as f:
+            table = json.load(f)
+        if config is not None:
+            table = table[config]
+        return Gas_model(table)
+
+    def estimate(self, entry_point, params):
+        if entry_point not in self.table:
+            return None
+        base, per_item = self.table[entry_point]
+        if base is None:
+            return None
+        items = 1
+        if entry_point == "transfer":
+            items = max(1, sum(len(txs) for _, txs in params[0]))
+        return base + per_item * (items - 1)
+
+def apply(model, operations, gas_model, start = 0):
+    "Result records of the `operations`, numbered from `start`."
+    for index, operation in enumerate(operations, start):
+        call = normalize(operation)
+        if call is None or call[0] not in model.entry_points:
+            yield {"index": index, "status": "skipped"}
+            continue
+        entry_point, params, sender, amount, now = call
+        error, emitted = model.call(entry_point, params, sender, amount,
+                                    rollback = False, now = now)
+        yield {
+            "index": index,
+            "hash": operation.get("hash"),
+            "entry_point": entry_point,
+            "status": "ok" if error is None else "rejected",
+            "error": error,
+            "operations": len(emitted),
+            "estimated_gas": (gas_model.estimate(entry_point, params)
+                              if error is None else None),
+        }
+
+##
+## ### State of the Models
+##
+## JSON-friendly form of the state, tuple keys become lists; the maps that
+## only some models have (`extra_state_fields`) are lists of pairs.
+def dump_state(model):
+    state = {
+        "paused": model.paused,
+        "ledger": [[owner, token_id, balance]
+                   for (owner, token_id), balance in model.ledger.items()],
+        "tokens": [[token_id, metadata]
+                   for token_id, metadata in model.tokens.items()],
+        "offer": [[token_id, seller, sale_value]
+                  for token_id, (seller, sale_value) in model.offer.items()],
+        "initial_hodlers": model.initial_hodlers,
+        "all_tokens": sorted(model.all_tokens),
+    }
+    for field in getattr(model, "extra_state_fields", []):
+        value = getattr(model, field)
+        state[field] = list(value.items()) if isinstance(value, dict) else value
+    return state
+
+def load_state(model, state):
+    model.paused = state["paused"]
+    model.ledger = dict(((owner, token_id), balance)
+                        for owner, token_id, balance in state["ledger"])
+    model.tokens = dict((token_id, metadata)
+                        for token_id, metadata in state["tokens"])
+    model.offer = dict((token_id, (seller, sale_value))
+                       for token_id, seller, sale_value in state["offer"])
+    model.initial_hodlers = dict(state["initial_hodlers"])
+    model.all_tokens = set(state["all_tokens"])
+    for field in getattr(model, "extra_state_fields", []):
+        value = state[field]
+        setattr(model, field, dict(value) if isinstance(value, list) else value)
+
+def snapshot(model):
+    "The final storage in the format of `scenario_snapshot.py`."
+    return {
+        "ledger": [{"owner": owner, "token_id": token_id, "balance": balance}
+                   for (owner, token_id), balance in sorted(model.ledger.items())
+                   if balance > 0],
+        "tokens": [{"token_id": token_id, "total_supply": 1,
+                    "metadata": metadata}
+                   for token_id, metadata in sorted(model.tokens.items())],
+        "operators": [],
+        "offer": [{"token_id": token_id, "seller": seller,
+                   "sale_value": sale_value}
+                  for token_id, (seller, sale_value)
+                  in sorted(model.offer.items())],
+        "initial_hodlers": dict(model.initial_hodlers),
+    }
+
+def zero_balances(model):
+    """Number of ledger entries left at a zero balance and the bytes they
+    hold, i.e. what `remove_zero_balances` would not have paid for."""
+    count = sum(1 for balance in model.ledger.values() if balance == 0)
+    config = storage_model.Storage_config.cryptobot()
+    entry = storage_model.entry_cost(storage_model.ledger_value(config, 0))
+    return count, count * entry
+
+def save_checkpoint(path, checkpoint):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+class Stats:
+    def __init__(self, counts = None):
+        # `entry_point -> [ok, rejected, estimated gas]`
+        self.counts = counts or {}
+        self.skipped = 0
+
+    def add(self, result):
+        if result["status"] == "skipped":
+            self.skipped += 1
+            return
+        c = self.counts.setdefault(result["entry_point"], [0, 0, 0])
+        if result["status"] == "ok":
+            c[0] += 1
+            c[2] += result["estimated_gas"] or 0
+        else:
+            c[1] += 1
+
+    def show(self):
+        lines = ["%-28s %10s %10s %14s" % ("entry point", "ok", "rejected",
+                                           "estimated gas")]
+        for entry_point, (ok, rejected, gas) in sorted(self.counts.items()):
+            lines.append("%-28s %10d %10d %14d" % (entry_point, ok, rejected, gas))
+        lines.append("%d operations skipped" % self.skipped)
+        return "\n".join(lines)
+
+def replay(history, model, gas_model, output, checkpoint = None,
+           checkpoint_every = 100000, resume = False):
+    start = 0
+    output_offset = 0
+    stats = Stats()
+    if resume and checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            saved = json.load(f)
+        if saved["model"] != model.name:
+            raise Exception("The checkpoint is for the model " + saved["model"])
+        load_state(model, saved["state"])
+        start = saved["index"]
+        output_offset = saved["output_offset"]
+        stats = Stats(saved["stats"])
+        stats.skipped = saved["skipped"]
+    with open(output, "a") as out:
+        # Drop what was written after the checkpoint:
+        out.truncate(output_offset)
+        out.seek(output_offset)
+        for result in apply(model, read_operations(history, start), gas_model,
+                            start):
+            stats.add(result)
+            if result["status"] != "skipped":
+                out.write(json.dumps(result, sort_keys = True) + "\n")
+            if checkpoint and (result["index"] + 1) % checkpoint_every == 0:
+                out.flush()
+                save_checkpoint(checkpoint, {
+                    "model": model.name,
+                    "index": result["index"] + 1,
+                    "output_offset": out.tell(),
+                    "state": dump_state(model),
+                    "stats": stats.counts,
+                    "skipped": stats.skipped,
+                })
+    return stats
+
+##
+## ### Tests
+##
+## Run with `python -m pytest -q replay.py`.
+def sample_history():
+    "Operations of a short history, with skipped and rejected ones."
+    ops = []
+    for i, sender in enumerate(["tz1a", "tz1b", "tz1a", "tz1c"]):
+        ops.append({"entry_point": "mint", "sender": sender,
+                    "parameters": {"metadata": {"": "%02x" % i}}})
+    ops += [
+        {"entry_point": "offer_bot_for_sale", "sender": "tz1a",
+         "parameters": {"token_id": "0", "sale_price": "1000"}},
+        {"entry_point": "update_operators", "sender": "tz1a",
+         "parameters": []},
+        {"entry_point": "purchase_bot_at_sale_price", "sender": "tz1b",
+         "amount": "1000", "parameters": {"token_id": "0"}},
+        {"entry_point": "transfer", "sender": "tz1b", "status": "failed",
+         "parameters": []},
+        {"entry_point": "transfer", "sender": {"address": "tz1b"},
+         "parameters": [{"from_": "tz1b", "txs": [
+             {"to_": "tz1c", "token_id": "1", "amount": "1"},
+             {"to_": "tz1c", "token_id": "0", "amount": "2"}]}]},
+        {"entry_point": "bot_no_longer_for_sale", "sender": "tz1c",
+         "parameters": {"token_id": "3"}},
+        {"entry_point": "transfer", "sender": "tz1c",
+         "parameters": [{"from_": "tz1c", "txs": [
+             {"to_": "tz1a", "token_id": "3", "amount": "1"}]}]},
+    ]
+    return ops
+
+def test_resume_is_uninterrupted_replay():
+    import tempfile
+    history = sample_history()
+    gas_model = Gas_model({"transfer": {"base": 100, "per_item": 10},
+                           "mint": 200})
+    model_class = marketplace_model.model_of_name("deployed_cryptobot_marketplace")
+    with tempfile.TemporaryDirectory() as tmp:
+        def path(name):
+            return os.path.join(tmp, name)
+        def write_history(name, ops):
+            with open(path(name), "w") as f:
+                for op in ops:
+                    f.write(json.dumps(op) + "\n")
+        write_history("history.jsonl", history)
+        whole = replay(path("history.jsonl"), model_class(admin), gas_model,
+                       path("whole.jsonl"))
+        # Interrupted after 8 operations, with a checkpoint after 6: the
+        # results of the last 2 ones are in the output but not in the
+        # checkpoint.
+        write_history("head.jsonl", history[:8])
+        replay(path("head.jsonl"), model_class(admin), gas_model,
+               path("resumed.jsonl"), path("checkpoint"), 3)
+        model = model_class(admin)
+        resumed = replay(path("history.jsonl"), model, gas_model,
+                         path("resumed.jsonl"), path("checkpoint"), 3,
+                         resume = True)
+        with open(path("whole.jsonl")) as f:
+            expected = f.read()
+        with open(path("resumed.jsonl")) as f:
+            assert f.read() == expected
+    assert resumed.counts == whole.counts
+    assert resumed.skipped == whole.skipped == 2
+    assert model.ledger[("tz1a", 3)] == 1
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Replay historical operations through a marketplace model.")
+    parser.add_argument("history", help = "Operations as JSON lines.")
+    parser.add_argument("--model", default = "deployed_cryptobot_marketplace",
+                        choices = [m.name for m in marketplace_model.models])
+    parser.add_argument("--admin", default = admin)
+    parser.add_argument("--gas", help = "Gas per entry point (JSON).")
+    parser.add_argument("--config",
+                        help = "Configuration to use when --gas is a bench.py"
+                        " baseline.")
+    parser.add_argument("-o", "--output", required = True,
+                        help = "Per-operation results (JSON lines).")
+    parser.add_argument("--storage", help = "Write the final storage snapshot.")
+    parser.add_argument("--checkpoint")
+    parser.add_argument("--checkpoint-every", type = int, default = 100000)
+    parser.add_argument("--resume", action = "store_true")
+    args = parser.parse_args(argv)
+    model = marketplace_model.model_of_name(args.model)(args.admin)
+    gas_model = (Gas_model.load(args.gas, args.config) if args.gas
+                 else Gas_model())
+    if not args.resume and os.path.exists(args.output):
+        os.remove(args.output)
+    stats = replay(args.history, model, gas_model, args.output,
+                   args.checkpoint, args.checkpoint_every, args.resume)
+    if args.storage:
+        with open(args.storage, "w") as f:
+            json.dump(snapshot(model), f, indent = 1, sort_keys = True)
+    print(stats.show())
+    zeros, size = zero_balances(model)
+    print("%d ledger entries at zero balance: %d bytes (%.6f tez)"
+          % (zeros, size, size * storage_model.burn_per_byte_mutez / 1e6))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
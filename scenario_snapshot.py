@@ -0,0 +1,193 @@
+##
+## ## Snapshots of Contract State
+##
+## A snapshot is a JSON file holding the interesting part of the storage of
+## an FA2 contract (and of the `Cryptobot` marketplace):
+##
+## ```json
+## {
+##   "config": "FA2-nft-no_toknat-no_totsup",
+##   "ledger": [{"owner": "tz1…", "token_id": 0, "balance": 1}, …],
+##   "tokens": [{"token_id": 0, "total_supply": 1,
+##               "metadata": {"": "697066733a2f2f…"}}, …],
+##   "operators": [{"owner": "tz1…", "operator": "tz1…", "token_id": 0}, …],
+##   "offer": [{"token_id": 0, "seller": "tz1…", "sale_value": 1000}, …],
+##   "initial_hodlers": {"tz1…": 5, …}
+## }
+## ```
+##
+## Snapshots are either extracted from the storage written by a SmartPy
+## scenario (`step_NNN_cont_N_storage.json`) or synthesized, and restored in
+## a new scenario with `storage_of_snapshot` (in `FA2_template.py` and
+## `cryptobot_marketplace.py`), so a test can start at 5,000 tokens without
+## replaying 5,000 mints.
+##
+## Usage:
+##
+##     python scenario_snapshot.py extract out/step_042_cont_0_storage.json \
+##         --cryptobot -o snapshot.json
+##     python scenario_snapshot.py synthesize --tokens 5000 --owners 500 \
+##         --listed 250 --cryptobot -o snapshot.json
+##
+import argparse
+import hashlib
+import json
+import sys
+
+import micheline as m
+from storage_model import Storage_config
+
+def save(snapshot, path):
+    with open(path, "w") as f:
+        json.dump(snapshot, f, indent = 1, sort_keys = True)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+def storage_fields(config):
+    fields = ["administrator", "all_tokens", "ledger", "metadata",
+              "operators", "paused", "tokens"]
+    if config.marketplace:
+        fields += ["initial_hodlers", "offer"]
+    if config.shared_metadata:
+        fields += ["metadata_maps"]
+    return fields
+
+def _int(node):
+    return int(node["int"])
+
+def _elements(node, name):
+    if not isinstance(node, list):
+        raise Exception(
+            "The %s big-map is only available by id in this storage, use a "
+            "storage written by the SmartPy simulator." % name)
+    return [e["args"] for e in node]
+
+def _key(config, node):
+    if not config.readable:
+        node = m.unpack(bytes.fromhex(node["bytes"]))
+    return node
+
+def from_storage(config, storage):
+    "Build a snapshot from the Micheline (JSON) storage of a contract."
+    fields = m.unrecord(storage, m.default_layout(storage_fields(config)))
+    snapshot = {"ledger": [], "tokens": [], "operators": []}
+    for k, v in _elements(fields["ledger"], "ledger"):
+        k = _key(config, k)
+        if config.single_asset:
+            owner, token_id = k, {"int": "0"}
+        else:
+            owner, token_id = k["args"]
+        snapshot["ledger"].append({"owner": m.address_of_node(owner),
+                                   "token_id": _int(token_id),
+                                   "balance": _int(v)})
+    if config.shared_metadata:
+        metadata_maps = dict((k["bytes"], v) for k, v
+                             in _elements(fields["metadata_maps"],
+                                          "metadata_maps"))
+        metadata_field = "metadata_hash"
+    else:
+        metadata_field = "metadata_map"
+    for k, v in _elements(fields["tokens"], "tokens"):
+        if config.store_total_supply:
+            v = m.unrecord(v, m.default_layout([metadata_field, "total_supply"]))
+            metadata, total_supply = v[metadata_field], _int(v["total_supply"])
+        else:
+            # Not stored, NFTs are the common case:
+            metadata, total_supply = v, 1
+        if config.shared_metadata:
+            metadata = metadata_maps[metadata["bytes"]]
+        snapshot["tokens"].append({
+            "token_id": _int(k),
+            "total_supply": total_supply,
+            "metadata": dict((e["args"][0]["string"], e["args"][1]["bytes"])
+                             for e in metadata)})
+    for k, _ in _elements(fields["operators"], "operators"):
+        k = m.unrecord(_key(config, k), ("owner", ("operator", "token_id")))
+        snapshot["operators"].append({
+            "owner": m.address_of_node(k["owner"]),
+            "operator": m.address_of_node(k["operator"]),
+            "token_id": _int(k["token_id"])})
+    if config.marketplace:
+        snapshot["offer"] = []
+        for k, v in _elements(fields["offer"], "offer"):
+            v = m.unrecord(v, m.default_layout(["is_for_sale", "seller",
+                                                "sale_value"]))
+            snapshot["offer"].append({
+                "token_id": _int(k),
+                "seller": m.address_of_node(v["seller"]),
+                "sale_value": _int(v["sale_value"])})
+        snapshot["initial_hodlers"] = dict(
+            (m.address_of_node(k), _int(v))
+            for k, v in _elements(fields["initial_hodlers"], "initial_hodlers"))
+    return snapshot
+
+def synthetic_address(i):
+    "A valid, deterministic `tz1` address for the `i`-th synthetic owner."
+    digest = hashlib.blake2b(b"owner-%d" % i, digest_size = 20).digest()
+    return m.b58check_encode(m.address_prefixes["tz1"][0] + digest)
+
+def synthesize(config, tokens, owners, listed = 0, sale_value = 1000000,
+               metadata = None):
+    """A collection of `tokens` NFTs (ids `0 … tokens - 1`) spread
+    round-robin over `owners` addresses, the first `listed` ones on sale."""
+    if metadata is None:
+        metadata = dict((k, v.encode("utf-8").hex())
+                        for k, v in config.metadata.items())
+    addresses = [synthetic_address(i) for i in range(owners)]
+    snapshot = {
+        "ledger": [{"owner": addresses[i % owners], "token_id": i, "balance": 1}
+                   for i in range(tokens)],
+        "tokens": [{"token_id": i, "total_supply": 1, "metadata": metadata}
+                   for i in range(tokens)],
+        "operators": [],
+    }
+    if config.marketplace:
+        snapshot["offer"] = [{"token_id": i, "seller": addresses[i % owners],
+                              "sale_value": sale_value}
+                             for i in range(listed)]
+        minted = {}
+        for i in range(tokens):
+            minted[addresses[i % owners]] = minted.get(addresses[i % owners], 0) + 1
+        # The marketplace caps initial mints at 5 per address:
+        snapshot["initial_hodlers"] = dict((a, min(n, 5))
+                                           for a, n in minted.items())
+    return snapshot
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Extract or synthesize FA2 storage snapshots.")
+    parser.add_argument("command", choices = ["extract", "synthesize"])
+    parser.add_argument("storage", nargs = "?",
+                        help = "Micheline JSON storage written by SmartPy.")
+    parser.add_argument("-o", "--output", required = True)
+    parser.add_argument("--cryptobot", action = "store_true",
+                        help = "Use the configuration of the Cryptobot marketplace.")
+    parser.add_argument("--no-readable", action = "store_true")
+    parser.add_argument("--no-totsup", action = "store_true")
+    parser.add_argument("--shared-metadata", action = "store_true")
+    parser.add_argument("--tokens", type = int, default = 5000)
+    parser.add_argument("--owners", type = int, default = 100)
+    parser.add_argument("--listed", type = int, default = 0)
+    args = parser.parse_args(argv)
+    if args.cryptobot:
+        config = Storage_config.cryptobot()
+    else:
+        config = Storage_config(readable = not args.no_readable,
+                                store_total_supply = not args.no_totsup)
+    config.shared_metadata = args.shared_metadata
+    if args.command == "extract":
+        if args.storage is None:
+            parser.error("extract needs a storage file")
+        with open(args.storage) as f:
+            snapshot = from_storage(config, json.load(f))
+    else:
+        snapshot = synthesize(config, args.tokens, args.owners, args.listed)
+    save(snapshot, args.output)
+    print("%s: %d ledger entries, %d tokens"
+          % (args.output, len(snapshot["ledger"]), len(snapshot["tokens"])))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,562 @@
+##
+## ## Storage-Growth Projection Model
+##
+## Storage is paid (burnt) once, when the contract's used storage goes
+## above the highest size ever paid for.
+## This model derives the byte cost of one entry of each big-map of the FA2
+## template and of the `Cryptobot` marketplace from the storage types, and
+## projects the paid storage and burn of a collection for a given activity
+## mix.
+##
+## The per-entry cost of a big-map entry in the protocol is a fixed overhead
+## (the key is stored through its hash) plus the binary size of the value.
+## The values below mirror the SmartPy types:
+##
+## - `Ledger_entry(config).get_type()`: `sp.TRecord(balance = sp.TNat)`
+##   (`Ledger_value.get_type()`), or `sp.TNat` with `bare_ledger_values`;
+##   a one-field record is just a `nat`, so a ledger entry has the same
+##   size with or without `bare_ledger_values`,
+## - `Token_meta_data.get_type()`: `total_supply` and `metadata_map`
+##   or only the metadata map (`store_total_supply = False`),
+## - `Offer.get_value_type()`: `is_for_sale`, `seller`, `sale_value`,
+## - `Operator_set.key_type()`: the value is `Unit`,
+## - `initial_hodlers`: `address -> nat`.
+##
+## Usage:
+##
+##     python storage_model.py costs --marketplace
+##     python storage_model.py project --tokens 10000 --minters 2000 \
+##         --transfers 5000 --sales 3000 --listed 500 --marketplace
+##     python storage_model.py project --cryptobot --tokens 10000 \
+##         --sales 200000 --transfers 50000 --rm-zero
+##     python storage_model.py project --tokens 10000 --shared-metadata \
+##         --distinct-metadata 10 --metadata '{"name": "…", "decimals": "0"}'
+##     python storage_model.py validate receipts.txt --marketplace
+##
+import argparse
+import copy
+import hashlib
+import json
+import re
+import sys
+
+import micheline as m
+
+burn_per_byte_mutez = 250
+big_map_key_overhead = 65
+origination_burn_bytes = 257
+
+## Any implicit account has the same optimized size, we use this one for
+## building sample values.
+sample_address = "tz1M9CMEtsXm3QxA7FmMU2Qh7xzsuGXVbcDr"
+## The end of an auction, as the seconds of a timestamp.
+sample_end_time = 1700000000
+## A TZIP-21 metadata map as minted by the marketplace: a single `""` key
+## pointing to an IPFS URI.
+sample_metadata = {
+    "": "ipfs://QmRLicUooP6g88NYo8e59rhLJByywha1bASMEB9ysh5AYM"
+}
+
+class Storage_config:
+    """The subset of `FA2_config` (and of the marketplace) that changes the
+    storage layout (and `non_fungible`, to rebuild the same `FA2_config`)."""
+    def __init__(self,
+                 readable = True,
+                 non_fungible = False,
+                 single_asset = False,
+                 store_total_supply = True,
+                 assume_consecutive_token_ids = True,
+                 token_ids_in_big_map = False,
+                 remove_zero_balances = False,
+                 shared_metadata = False,
+                 marketplace = False,
+                 metadata = None):
+        self.readable = readable
+        self.non_fungible = non_fungible
+        self.single_asset = single_asset
+        self.store_total_supply = store_total_supply
+        self.assume_consecutive_token_ids = assume_consecutive_token_ids
+        self.token_ids_in_big_map = token_ids_in_big_map
+        self.remove_zero_balances = remove_zero_balances
+        self.shared_metadata = shared_metadata
+        self.marketplace = marketplace
+        self.metadata = sample_metadata if metadata is None else metadata
+
+    def name(self):
+        "The `FA2_config.name` of the configuration (other options default)."
+        name = "FA2"
+        for suffix, enabled in [("-single_asset", self.single_asset),
+                                ("-nft", self.non_fungible),
+                                ("-no_readable", not self.readable),
+                                ("-no_toknat",
+                                 not self.assume_consecutive_token_ids),
+                                ("-tokbigmap", self.token_ids_in_big_map),
+                                ("-no_totsup", not self.store_total_supply),
+                                ("-rm_zero", self.remove_zero_balances),
+                                ("-shared_md", self.shared_metadata)]:
+            if enabled:
+                name += suffix
+        return name
+
+    def cryptobot():
+        "The configuration used by `cryptobot_marketplace.Cryptobot`."
+        return Storage_config(non_fungible = True,
+                              store_total_supply = False,
+                              assume_consecutive_token_ids = False,
+                              token_ids_in_big_map = True,
+                              marketplace = True)
+
+##
+## ### Sample Values
+##
+## The functions below build the Micheline value of one entry, they follow
+## the SmartPy definitions they are named after.
+def ledger_key(config, owner, token_id):
+    if config.single_asset:
+        key = m.address(owner)
+    else:
+        key = m.pair(m.address(owner), m.nat(token_id))
+    if config.readable:
+        return key
+    return m.bytes_(m.pack(key))
+
+def ledger_value(config, balance):
+    # The same with `bare_ledger_values`, see above.
+    return m.nat(balance)
+
+def metadata_map(metadata):
+    return m.map_([(m.string(k), m.bytes_(v)) for k, v in sorted(metadata.items())])
+
+def metadata_hash(metadata):
+    "`sp.blake2b(sp.pack(metadata))`, the key of a map in `metadata_maps`."
+    return hashlib.blake2b(m.pack(metadata_map(metadata)),
+                           digest_size = 32).digest()
+
+def token_value(config, total_supply, metadata):
+    if config.shared_metadata:
+        field, value = "metadata_hash", m.bytes_(metadata_hash(metadata))
+    else:
+        field, value = "metadata_map", metadata_map(metadata)
+    if config.store_total_supply:
+        return m.record({"total_supply": m.nat(total_supply), field: value})
+    return value
+
+def offer_value(config, seller, sale_value):
+    return m.record({"is_for_sale": m.bool_(True),
+                     "seller": m.address(seller),
+                     "sale_value": m.mutez(sale_value)})
+
+def auction_value(config, seller, reserve_price, end_time, highest_bid = 0,
+                  highest_bidder = None):
+    return m.record({"seller": m.address(seller),
+                     "reserve_price": m.mutez(reserve_price),
+                     "end_time": m.int_(end_time),
+                     "highest_bid": m.mutez(highest_bid),
+                     "highest_bidder": (m.none if highest_bidder is None
+                                        else m.some(m.address(highest_bidder)))})
+
+def operator_key(config, owner, operator, token_id):
+    key = m.record({"owner": m.address(owner),
+                    "operator": m.address(operator),
+                    "token_id": m.nat(token_id)},
+                   ("owner", ("operator", "token_id")))
+    if config.readable:
+        return key
+    return m.bytes_(m.pack(key))
+
+def entry_cost(value):
+    "Bytes paid when a new key holding `value` is added to a big-map."
+    return big_map_key_overhead + m.size(value)
+
+def entry_costs(config, token_id = 0, balance = 1, sale_value = 1000000):
+    """Per-entry byte costs for each big-map (and the in-storage token set),
+    as a `dict` of `name -> (key_bytes, value_bytes, paid_bytes)`."""
+    def row(key, value):
+        return (m.size(key), m.size(value), entry_cost(value))
+    costs = {
+        "ledger": row(ledger_key(config, sample_address, token_id),
+                      ledger_value(config, balance)),
+        "tokens": row(m.nat(token_id),
+                      token_value(config, balance, config.metadata)),
+        "operators": row(operator_key(config, sample_address,
+                                      sample_address, token_id),
+                         m.unit),
+    }
+    if config.shared_metadata:
+        costs["metadata_maps"] = row(m.bytes_(metadata_hash(config.metadata)),
+                                     metadata_map(config.metadata))
+    if config.token_ids_in_big_map:
+        costs["all_tokens"] = row(m.nat(token_id), m.unit)
+    elif not config.assume_consecutive_token_ids:
+        # Not a big-map: the set lives in the storage itself.
+        costs["all_tokens"] = (0, m.size(m.nat(token_id)),
+                               m.size(m.nat(token_id)))
+    if config.marketplace:
+        costs["offer"] = row(m.nat(token_id),
+                             offer_value(config, sample_address, sale_value))
+        costs["initial_hodlers"] = row(m.address(sample_address), m.nat(1))
+        costs["auction"] = row(m.nat(token_id),
+                               auction_value(config, sample_address,
+                                             sale_value, sample_end_time,
+                                             sale_value, sample_address))
+        costs["pending_refunds"] = row(m.address(sample_address),
+                                       m.mutez(sale_value))
+    return costs
+
+##
+## ### Projection
+##
+## The activity mix is replayed as counts in a fixed order (mints, then
+## sales, then plain transfers) while keeping track of the used and paid
+## bytes; freed entries (sold offers) lower the used size but not the paid
+## one, so later growth re-uses that room for free.
+class Activity:
+    def __init__(self,
+                 tokens,
+                 minters = None,
+                 transfers = 0,
+                 sales = 0,
+                 listed = 0,
+                 operators = 0,
+                 fresh_receivers = 1.0,
+                 sale_value = 1000000,
+                 distinct_metadata = None):
+        self.tokens = tokens
+        self.minters = tokens if minters is None else minters
+        self.transfers = transfers
+        self.sales = sales
+        self.listed = listed
+        self.operators = operators
+        self.fresh_receivers = fresh_receivers
+        # Fraction of transfers/sales going to an `(owner, token)` pair that
+        # is not in the ledger yet (each one adds a ledger entry).
+        self.sale_value = sale_value
+        # Number of different metadata maps among the tokens (only matters
+        # with `shared_metadata`), all different by default.
+        self.distinct_metadata = (tokens if distinct_metadata is None
+                                  else distinct_metadata)
+
+class Projection:
+    def __init__(self):
+        self.used = {}
+        self.entries = {}
+        self.paid = 0
+
+    def add(self, name, size, count = 1):
+        "Add `count` entries of `size` bytes each to `name`."
+        self.used[name] = self.used.get(name, 0) + size * count
+        self.entries[name] = self.entries.get(name, 0) + count
+        self.paid = max(self.paid, sum(self.used.values()))
+
+    def remove(self, name, size, count = 1):
+        self.used[name] = self.used.get(name, 0) - size * count
+        self.entries[name] = self.entries.get(name, 0) - count
+
+    def burn_mutez(self):
+        return self.paid * burn_per_byte_mutez
+
+def project(config, activity):
+    p = Projection()
+    n = activity.tokens
+    ledger = entry_cost(ledger_value(config, 1))
+    p.add("tokens", entry_cost(token_value(config, 1, config.metadata)), n)
+    p.add("ledger", ledger, n)
+    if config.shared_metadata:
+        p.add("metadata_maps", entry_costs(config)["metadata_maps"][2],
+              activity.distinct_metadata)
+    if config.token_ids_in_big_map:
+        p.add("all_tokens", entry_cost(m.unit), n)
+    elif not config.assume_consecutive_token_ids:
+        # The size of the elements grows with the ids:
+        for i in range(n):
+            p.add("all_tokens", m.size(m.nat(i)))
+    if config.marketplace:
+        p.add("initial_hodlers", entry_cost(m.nat(1)), activity.minters)
+        # Each sale is a listing followed by a purchase:
+        offer = entry_cost(offer_value(config, sample_address,
+                                       activity.sale_value))
+        fresh = 0.0
+        for _ in range(activity.sales):
+            p.add("offer", offer)
+            p.remove("offer", offer)
+            if config.remove_zero_balances:
+                # The seller's entry goes before the buyer's one is added:
+                p.remove("ledger", ledger)
+                p.add("ledger", ledger)
+                continue
+            fresh += activity.fresh_receivers
+            if fresh >= 1:
+                p.add("ledger", ledger)
+                fresh -= 1
+        p.add("offer", offer, activity.listed)
+    if not config.remove_zero_balances:
+        # (otherwise each NFT transfer moves an entry, as for the sales)
+        p.add("ledger", ledger,
+              round(activity.transfers * activity.fresh_receivers))
+    p.add("operators", entry_cost(m.unit), activity.operators)
+    return p
+
+def per_operation(config, entry_point, first = True):
+    """Predicted paid storage of a single call in steady state.
+
+    `first` is for `mint` on the marketplace: the first mint of an address
+    adds an `initial_hodlers` entry, later ones only update it."""
+    costs = entry_costs(config)
+    ledger = costs["ledger"][2]
+    if entry_point == "mint":
+        result = ledger + costs["tokens"][2]
+        if "all_tokens" in costs:
+            result += costs["all_tokens"][2]
+        if config.marketplace and first:
+            result += costs["initial_hodlers"][2]
+        return result
+    if entry_point == "transfer":
+        return ledger
+    if entry_point == "offer_bot_for_sale":
+        return costs["offer"][2]
+    if entry_point == "purchase_bot_at_sale_price":
+        # The freed offer is larger than the new ledger entry:
+        return max(0, ledger - costs["offer"][2])
+    if entry_point == "update_operators":
+        return costs["operators"][2]
+    if entry_point == "start_auction":
+        return entry_cost(auction_value(config, sample_address, 1000000,
+                                        sample_end_time))
+    if entry_point == "bid":
+        # At most: the outbid bidder gets a `pending_refunds` entry and the
+        # first bid adds the bidder (and a larger bid) to the auction.
+        return (costs["pending_refunds"][2] + costs["auction"][1]
+                - m.size(auction_value(config, sample_address, 1000000,
+                                       sample_end_time)))
+    if entry_point == "settle":
+        # The freed auction is larger than the new ledger entry:
+        return max(0, ledger - costs["auction"][2])
+    return 0
+
+##
+## ### Validation Against Measured Results
+##
+## Measurements are `octez-client` receipts (from a sandbox or a test
+## network) of the scenario's calls, or JSON lines with the fields
+## `entry_point`, `paid_storage_size_diff` and optionally `first`.
+receipt_fields = {
+    "destination": re.compile(r"^\s*To: (\S+)"),
+    "entry_point": re.compile(r"^\s*Entrypoint: (\S+)"),
+    "storage_size": re.compile(r"^\s*Storage size: (\d+) bytes"),
+    "paid_storage_size_diff": re.compile(r"^\s*Paid storage size diff: (\d+) bytes"),
+    "consumed_gas": re.compile(r"^\s*Consumed gas: ([\d.]+)"),
+}
+
+def parse_receipts(text):
+    "Extract one record per transaction from `octez-client` receipts."
+    records = []
+    current = None
+    for line in text.splitlines():
+        if re.match(r"^\s*Transaction:", line):
+            current = {"internal_operations": 0}
+            records.append(current)
+            continue
+        if current is None:
+            continue
+        if re.match(r"^\s*Internal (Transaction|Origination|Delegation|Event):", line):
+            current["internal_operations"] += 1
+            current.setdefault("internal_gas", 0.0)
+            continue
+        # The gas of the internal operations also counts against the gas
+        # limit of the operation:
+        match = receipt_fields["consumed_gas"].match(line)
+        if match and "internal_gas" in current:
+            current["internal_gas"] += float(match.group(1))
+            continue
+        for field, regex in receipt_fields.items():
+            match = regex.match(line)
+            if match and field not in current:
+                value = match.group(1)
+                current[field] = (value if field in ("destination", "entry_point")
+                                  else float(value))
+    return [r for r in records if "entry_point" in r]
+
+def read_measurements(path):
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith("{"):
+        return [json.loads(l) for l in text.splitlines() if l.strip()]
+    return parse_receipts(text)
+
+def validate(config, measurements, tolerance = 0.1):
+    """Compare predicted and measured paid storage per entry point.
+
+    Returns `(rows, ok)` where rows are
+    `(entry_point, calls, measured_mean, predicted, relative_error)`."""
+    grouped = {}
+    for r in measurements:
+        key = (r["entry_point"], r.get("first", True))
+        grouped.setdefault(key, []).append(r["paid_storage_size_diff"])
+    rows = []
+    ok = True
+    for (entry_point, first), values in sorted(grouped.items()):
+        measured = sum(values) / len(values)
+        predicted = per_operation(config, entry_point, first)
+        error = (abs(predicted - measured) / measured if measured
+                 else float(predicted != 0))
+        ok = ok and error <= tolerance
+        rows.append((entry_point, len(values), measured, predicted, error))
+    return rows, ok
+
+def config_of_args(args):
+    if args.cryptobot:
+        config = Storage_config.cryptobot()
+        config.remove_zero_balances = args.rm_zero
+        config.shared_metadata = args.shared_metadata
+        return config
+    return Storage_config(readable = not args.no_readable,
+                          single_asset = args.single_asset,
+                          store_total_supply = not args.no_totsup,
+                          assume_consecutive_token_ids = not (args.no_toknat or args.tokbigmap),
+                          token_ids_in_big_map = args.tokbigmap,
+                          remove_zero_balances = args.rm_zero,
+                          shared_metadata = args.shared_metadata,
+                          marketplace = args.marketplace)
+
+##
+## ### Tests
+##
+## Run with `python -m pytest -q storage_model.py`.
+def test_entry_costs():
+    # Paid bytes are the 65 bytes of a new big-map key plus the value
+    # (the key is hashed): a nat below 64 is 2 bytes, 1 tez is 4 bytes
+    # (3 bytes of zarith), an optimized address 27 (tag, length, 22).
+    config = Storage_config.cryptobot()
+    costs = entry_costs(config)
+    assert costs["ledger"][2] == 65 + 2
+    assert costs["pending_refunds"][2] == 65 + 4
+    assert costs["initial_hodlers"] == (27, 2, 65 + 2)
+    # `offer`: 2 `Pair`s, a bool, the seller and the sale value.
+    assert costs["offer"][1] == 2 * 2 + 2 + 27 + 4
+    # `auction`: 4 `Pair`s, the seller, two amounts, the end time (5
+    # bytes of zarith) and `Some` highest bidder.
+    assert costs["auction"][1] == 4 * 2 + 27 + 4 + 4 + 6 + (2 + 27)
+    assert costs["auction"][2] == 65 + 78
+
+receipt_sample = """
+    Transaction:
+      Amount: \ua7690
+      From: tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx
+      To: KT1PWx2mnDueood7fEmfbBDKx1D9BAnnXitn
+      Entrypoint: purchase_bot_at_sale_price
+      This transaction was successfully applied
+      Storage size: 8260 bytes
+      Paid storage size diff: 0 bytes
+      Consumed gas: 3482.731
+      Internal operations:
+        Internal Transaction:
+          Amount: \ua7691
+          From: KT1PWx2mnDueood7fEmfbBDKx1D9BAnnXitn
+          To: tz1gjaF81ZRRvdzjobyfVNsAeSC6PScjfQwN
+          This transaction was successfully applied
+          Consumed gas: 100.000
+    Transaction:
+      Amount: \ua7690
+      From: tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx
+      To: KT1PWx2mnDueood7fEmfbBDKx1D9BAnnXitn
+      Entrypoint: transfer
+      This transaction was successfully applied
+      Storage size: 8327 bytes
+      Paid storage size diff: 67 bytes
+      Consumed gas: 2120.518
+"""
+
+def test_parse_receipts_and_validate():
+    # The layout of `octez-client` receipts, the figures are made up.
+    purchase, transfer = parse_receipts(receipt_sample)
+    assert purchase["entry_point"] == "purchase_bot_at_sale_price"
+    assert purchase["consumed_gas"] == 3482.731
+    assert purchase["internal_operations"] == 1
+    assert purchase["internal_gas"] == 100.0
+    assert transfer["paid_storage_size_diff"] == 67
+    assert transfer["internal_operations"] == 0
+    config = Storage_config.cryptobot()
+    assert validate(config, [purchase, transfer])[1]
+    transfer["paid_storage_size_diff"] = 134
+    assert not validate(config, [purchase, transfer])[1]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Storage-growth projection for FA2 collections.")
+    parser.add_argument("command", choices = ["costs", "project", "validate"])
+    parser.add_argument("measurements", nargs = "?")
+    parser.add_argument("--cryptobot", action = "store_true",
+                        help = "Use the configuration of the Cryptobot marketplace.")
+    parser.add_argument("--marketplace", action = "store_true")
+    parser.add_argument("--no-readable", action = "store_true")
+    parser.add_argument("--single-asset", action = "store_true")
+    parser.add_argument("--no-totsup", action = "store_true")
+    parser.add_argument("--no-toknat", action = "store_true")
+    parser.add_argument("--tokbigmap", action = "store_true",
+                        help = "Token-id set in a big-map (implies --no-toknat).")
+    parser.add_argument("--rm-zero", action = "store_true",
+                        help = "Ledger entries deleted at zero balance"
+                        " (`remove_zero_balances`).")
+    parser.add_argument("--shared-metadata", action = "store_true",
+                        help = "Metadata maps stored once per hash"
+                        " (`shared_metadata`).")
+    parser.add_argument("--distinct-metadata", type = int,
+                        help = "Number of different metadata maps (default:"
+                        " one per token).")
+    parser.add_argument("--metadata", help = "The metadata map of the"
+                        " tokens, as JSON (default: a single IPFS URI).")
+    parser.add_argument("--tokens", type = int, default = 10000)
+    parser.add_argument("--minters", type = int)
+    parser.add_argument("--transfers", type = int, default = 0)
+    parser.add_argument("--sales", type = int, default = 0)
+    parser.add_argument("--listed", type = int, default = 0)
+    parser.add_argument("--operators", type = int, default = 0)
+    parser.add_argument("--tolerance", type = float, default = 0.1)
+    args = parser.parse_args(argv)
+    config = config_of_args(args)
+    if args.metadata:
+        config.metadata = json.loads(args.metadata)
+    if args.command == "costs":
+        print("%-16s %8s %8s %8s" % ("big-map", "key", "value", "paid"))
+        for name, (k, v, paid) in entry_costs(config).items():
+            print("%-16s %8d %8d %8d" % (name, k, v, paid))
+        return 0
+    if args.command == "project":
+        activity = Activity(tokens = args.tokens,
+                            minters = args.minters,
+                            transfers = args.transfers,
+                            sales = args.sales,
+                            listed = args.listed,
+                            operators = args.operators,
+                            distinct_metadata = args.distinct_metadata)
+        p = project(config, activity)
+        print("%-16s %10s %12s" % ("big-map", "entries", "bytes"))
+        for name in sorted(p.used):
+            print("%-16s %10d %12d" % (name, p.entries[name], p.used[name]))
+        print("paid storage: %d bytes (+ %d for the origination)"
+              % (p.paid, origination_burn_bytes))
+        print("burn: %.6f tez" % (p.burn_mutez() / 1e6))
+        options = [o for o in ("remove_zero_balances", "shared_metadata")
+                   if getattr(config, o)]
+        if options:
+            reference = copy.copy(config)
+            for o in options:
+                setattr(reference, o, False)
+            kept = project(reference, activity)
+            print("saved by %s: %d bytes (%.6f tez)"
+                  % (" and ".join(options), kept.paid - p.paid,
+                     (kept.burn_mutez() - p.burn_mutez()) / 1e6))
+        return 0
+    if args.measurements is None:
+        parser.error("validate needs a measurements file")
+    rows, ok = validate(config, read_measurements(args.measurements),
+                        args.tolerance)
+    print("%-28s %6s %10s %10s %7s" % ("entry-point", "calls", "measured",
+                                       "predicted", "error"))
+    for entry_point, calls, measured, predicted, error in rows:
+        print("%-28s %6d %10.1f %10d %6.1f%%" % (entry_point, calls, measured,
+                                                predicted, 100 * error))
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
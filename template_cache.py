@@ -0,0 +1,158 @@
+##
+## ## Pinned Copies of the FA2 Template
+##
+## The marketplaces import `FA2_template.py` from this repository (they
+## need its options, e.g. `token_ids_in_big_map` or `owner_index`, an
+## upstream template cannot replace it).
+## With `FA2_TEMPLATE=file:PATH` and `FA2_TEMPLATE_SHA256` they import a
+## pinned copy of it instead, e.g. the template of a released commit of
+## this repository: `template_url` checks the hash of the copy right
+## before the import and fails on a mismatch or a missing hash.
+## This tool keeps such copies: a template is fetched once, checked against
+## its expected SHA-256 and stored in a cache directory under its hash,
+## later builds only re-check the hash of the cached file, offline.
+##
+## `measure` times a build command (e.g. the SmartPy test of a marketplace)
+## once per template, to compare startup times, e.g. of the local file and
+## of a pinned copy.
+##
+## Usage:
+##
+##     python template_cache.py verify FA2_template.py
+##     python template_cache.py fetch file:FA2_template.py --sha256 3f5c…
+##     FA2_TEMPLATE=file:.template_cache/3f5c….py FA2_TEMPLATE_SHA256=3f5c… \
+##         SmartPy.sh test cryptobot_marketplace.py /tmp/out
+##     python template_cache.py measure --runs 5 \
+##         --mode local=file:FA2_template.py \
+##         --mode pinned=file:.template_cache/3f5c….py \
+##         -- SmartPy.sh test cryptobot_marketplace.py /tmp/out
+##
+import argparse
+import hashlib
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+default_cache = ".template_cache"
+
+def sha256_of(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def verify(path, sha256):
+    actual = sha256_of(path)
+    if actual != sha256:
+        raise Exception("%s: SHA-256 %s, expected %s" % (path, actual, sha256))
+
+def cached_path(sha256, cache = default_cache):
+    return os.path.join(cache, sha256 + ".py")
+
+def fetch(url, sha256, cache = default_cache):
+    """The path of the pinned copy of `url`, downloaded only when it is not
+    in the cache yet; the content must have the hash `sha256`."""
+    path = cached_path(sha256, cache)
+    if url.startswith("file:"):
+        url = "file://" + os.path.abspath(path_of_url(url))
+    if os.path.exists(path):
+        verify(path, sha256)
+        return path
+    with urllib.request.urlopen(url) as response:
+        content = response.read()
+    actual = hashlib.sha256(content).hexdigest()
+    if actual != sha256:
+        raise Exception("%s: SHA-256 %s, expected %s" % (url, actual, sha256))
+    os.makedirs(cache, exist_ok = True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(content)
+    os.replace(tmp, path)
+    return path
+
+def path_of_url(url):
+    if not url.startswith("file:"):
+        raise Exception("FA2_TEMPLATE must be a file: URL (a pinned copy),"
+                        " got %s" % url)
+    return url[len("file:"):]
+
+def template_url(environ = os.environ):
+    """The URL of the FA2 template for `sp.import_script_from_url`: the
+    local file, or the pinned copy of `FA2_TEMPLATE` once its hash is
+    checked against `FA2_TEMPLATE_SHA256`."""
+    url = environ.get("FA2_TEMPLATE")
+    if url is None:
+        return "file:FA2_template.py"
+    sha256 = environ.get("FA2_TEMPLATE_SHA256")
+    if sha256 is None:
+        raise Exception("FA2_TEMPLATE needs FA2_TEMPLATE_SHA256")
+    verify(path_of_url(url), sha256)
+    return url
+
+def measure(command, modes, runs = 3):
+    """`{mode: [seconds, …]}` for `runs` runs of `command` per mode, with
+    `FA2_TEMPLATE` set to the URL of the mode (and its hash)."""
+    result = {}
+    for name, url in modes:
+        env = dict(os.environ, FA2_TEMPLATE = url,
+                   FA2_TEMPLATE_SHA256 = sha256_of(path_of_url(url)))
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            completed = subprocess.run(command, env = env,
+                                       stdout = subprocess.DEVNULL,
+                                       stderr = subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+            if completed.returncode != 0:
+                raise Exception("%s failed with the %s template (exit %d)"
+                                % (" ".join(command), name,
+                                   completed.returncode))
+        result[name] = times
+    return result
+
+def show(measurements):
+    lines = ["%-12s %8s %8s %8s" % ("template", "min", "mean", "max")]
+    for name, times in measurements.items():
+        lines.append("%-12s %7.2fs %7.2fs %7.2fs"
+                     % (name, min(times), sum(times) / len(times), max(times)))
+    return "\n".join(lines)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Pinned, hash-verified copies of the FA2 template.")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    p = commands.add_parser("fetch", help = "Fetch (once) and pin a template.")
+    p.add_argument("url")
+    p.add_argument("--sha256", required = True)
+    p.add_argument("--cache", default = default_cache)
+    p = commands.add_parser("verify", help = "Check the hash of a template.")
+    p.add_argument("path")
+    p.add_argument("--sha256", help = "Print the hash when not given.")
+    p = commands.add_parser("measure", help = "Time a build per template.")
+    p.add_argument("--mode", action = "append", default = [],
+                   help = "name=url (default: local=file:FA2_template.py).")
+    p.add_argument("--runs", type = int, default = 3)
+    p.add_argument("run", nargs = argparse.REMAINDER,
+                   help = "-- command to time")
+    args = parser.parse_args(argv)
+    if args.command == "fetch":
+        path = fetch(args.url, args.sha256, args.cache)
+        print("FA2_TEMPLATE=file:%s" % path)
+        return 0
+    if args.command == "verify":
+        if args.sha256 is None:
+            print(sha256_of(args.path))
+        else:
+            verify(args.path, args.sha256)
+            print("%s: ok" % args.path)
+        return 0
+    command = args.run[1:] if args.run[:1] == ["--"] else args.run
+    if not command:
+        parser.error("measure needs a command after --")
+    modes = [tuple(m.split("=", 1)) for m in args.mode] or [
+        ("local", "file:FA2_template.py")]
+    print(show(measure(command, modes, args.runs)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())